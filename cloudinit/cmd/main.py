@@ -311,6 +311,7 @@ def main_init(name, args):
         return (init.datasource, ["Consuming user data failed!"])
 
     apply_reporting_cfg(init.cfg)
+    templater.set_bytecode_cache_dir(init.paths.template_cache_dir)
 
     # Stage 8 - re-read and apply relevant cloud-config to include user-data
     mods = stages.Modules(init, extract_fns(args), reporter=args.reporter)
@@ -373,6 +374,7 @@ def main_modules(action_name, args):
         logging.resetLogging()
     logging.setupLogging(mods.cfg)
     apply_reporting_cfg(init.cfg)
+    templater.set_bytecode_cache_dir(init.paths.template_cache_dir)
 
     # now that logging is setup and stdout redirected, send welcome
     welcome(name, msg=w_msg)
@@ -436,6 +438,7 @@ def main_single(name, args):
         logging.resetLogging()
     logging.setupLogging(mods.cfg)
     apply_reporting_cfg(init.cfg)
+    templater.set_bytecode_cache_dir(init.paths.template_cache_dir)
 
     # now that logging is setup and stdout redirected, send welcome
     welcome(name, msg=w_msg)
@@ -684,10 +687,13 @@ def main(sysv_args=None):
     args.reporter = events.ReportEventStack(
         rname, rdesc, reporting_enabled=report_on)
 
-    with args.reporter:
-        return util.log_time(
-            logfunc=LOG.debug, msg="cloud-init mode '%s'" % name,
-            get_uptime=True, func=functor, args=(name, args))
+    try:
+        with args.reporter:
+            return util.log_time(
+                logfunc=LOG.debug, msg="cloud-init mode '%s'" % name,
+                get_uptime=True, func=functor, args=(name, args))
+    finally:
+        reporting.flush_events()
 
 
 if __name__ == '__main__':
@@ -55,4 +55,6 @@ def fixup_module(mod, def_freq=PER_INSTANCE):
         setattr(mod, 'distros', [])
     if not hasattr(mod, 'osfamilies'):
         setattr(mod, 'osfamilies', [])
+    if not hasattr(mod, 'package_transaction'):
+        setattr(mod, 'package_transaction', False)
     return mod
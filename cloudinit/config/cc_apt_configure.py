@@ -236,6 +236,8 @@ from cloudinit import util
 
 LOG = logging.getLogger(__name__)
 
+package_transaction = True
+
 # this will match 'XXX:YYY' (ie, 'cloud-archive:foo' or 'ppa:bar')
 ADD_APT_REPO_MATCH = r"^[\w-]+:\w"
 
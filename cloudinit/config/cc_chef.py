@@ -89,6 +89,8 @@ from cloudinit import util
 
 import six
 
+package_transaction = True
+
 RUBY_VERSION_DEFAULT = "1.8"
 
 CHEF_DIRS = tuple([
@@ -268,6 +270,8 @@ def handle(name, cfg, cloud, log, _args):
     else:
         run = False
     if run:
+        # the run may rely on packages queued by earlier modules
+        cloud.distro.flush_packages()
         run_chef(chef_cfg, log)
         post_run_chef(chef_cfg, log)
 
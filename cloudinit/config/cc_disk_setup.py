@@ -80,6 +80,17 @@ specified using ``filesystem``.
     Using ``overwrite: true`` for filesystems is dangerous and can lead to data
     loss, so double check the entry in ``fs_setup``.
 
+Setting ``fast: true`` on an ``fs_setup`` entry skips discarding the device
+and (for ext3/ext4) defers inode table and journal initialization to the
+kernel, which makes formatting large ephemeral disks much quicker. An ``-E``
+given in ``extra_opts`` is merged with these settings, with the ones from
+``extra_opts`` taking precedence. The time taken to set up each filesystem is
+reported as an event under this module.
+
+Partitioning and filesystem creation on different disks happen at the same
+time. On any one disk, the partition table is written first, then the
+filesystems are created in the order they are listed in ``fs_setup``.
+
 **Internal name:** ``cc_disk_setup``
 
 **Module frequency:** per instance
@@ -104,13 +115,17 @@ specified using ``filesystem``.
           partition: <"auto"/"any"/"none"/<partition number>>
           overwrite: <true/false>
           replace_fs: <filesystem type>
+          fast: <true/false>
 """
 
+from cloudinit.reporting import events
 from cloudinit.settings import PER_INSTANCE
 from cloudinit import util
 import logging
 import os
+import re
 import shlex
+import time
 
 frequency = PER_INSTANCE
 
@@ -125,14 +140,35 @@ WIPEFS_CMD = util.which("wipefs")
 
 LANG_C_ENV = {'LANG': 'C'}
 
+# how many disks are partitioned and formatted at the same time
+MAX_WORKERS = 8
+
+# kernel names of partitions: sdb1, vdb1, xvdb1 and, for disks whose own
+# name ends in a digit, nvme0n1p1, mmcblk0p1
+PARTITION_NAME_RES = (re.compile(r"^((?:s|h|v|xv)d[a-z]+)\d+$"),
+                      re.compile(r"^(.*\d)p\d+$"))
+
 LOG = logging.getLogger(__name__)
 
+# (device, nodeps) -> enumerate_disk entries and device -> check_fs result,
+# dropped whenever this module changes a partition table or filesystem
+_LSBLK_CACHE = {}
+_BLKID_CACHE = {}
+
+
+def clear_device_cache():
+    _LSBLK_CACHE.clear()
+    _BLKID_CACHE.clear()
+
 
 def handle(_name, cfg, cloud, log, _args):
     """
     See doc/examples/cloud-config-disk-setup.txt for documentation on the
     format.
     """
+    clear_device_cache()
+    plan = DiskPlan()
+
     disk_setup = cfg.get("disk_setup")
     if isinstance(disk_setup, dict):
         update_disk_setup_devices(disk_setup, cloud.device_name_to_device)
@@ -141,14 +177,7 @@ def handle(_name, cfg, cloud, log, _args):
             if not isinstance(definition, dict):
                 log.warn("Invalid disk definition for %s" % disk)
                 continue
-
-            try:
-                log.debug("Creating new partition table/disk")
-                util.log_time(logfunc=LOG.debug,
-                              msg="Creating partition on %s" % disk,
-                              func=mkpart, args=(disk, definition))
-            except Exception as e:
-                util.logexc(LOG, "Failed partitioning operation\n%s" % e)
+            plan.add(disk, partition_disk, disk, definition)
 
     fs_setup = cfg.get("fs_setup")
     if isinstance(fs_setup, list):
@@ -158,15 +187,92 @@ def handle(_name, cfg, cloud, log, _args):
             if not isinstance(definition, dict):
                 log.warn("Invalid file system definition: %s" % definition)
                 continue
+            plan.add(definition.get('device'), create_filesystem, definition,
+                     cloud.reporter)
 
-            try:
-                log.debug("Creating new filesystem.")
-                device = definition.get('device')
-                util.log_time(logfunc=LOG.debug,
-                              msg="Creating fs for %s" % device,
-                              func=mkfs, args=(definition,))
-            except Exception as e:
-                util.logexc(LOG, "Failed during filesystem operation\n%s" % e)
+    plan.run()
+
+
+def partition_disk(disk, definition):
+    try:
+        LOG.debug("Creating new partition table/disk")
+        util.log_time(logfunc=LOG.debug,
+                      msg="Creating partition on %s" % disk,
+                      func=mkpart, args=(disk, definition))
+    except Exception as e:
+        util.logexc(LOG, "Failed partitioning operation\n%s" % e)
+
+
+def create_filesystem(definition, reporter=None):
+    device = definition.get('device')
+    with events.ReportEventStack(
+            name="mkfs-%s" % os.path.basename(str(device)), parent=reporter,
+            description="creating filesystem on %s" % device) as rep:
+        start = time.time()
+        outcome = "took"
+        try:
+            LOG.debug("Creating new filesystem.")
+            util.log_time(logfunc=LOG.debug,
+                          msg="Creating fs for %s" % device,
+                          func=mkfs, args=(definition,))
+        except Exception as e:
+            util.logexc(LOG, "Failed during filesystem operation\n%s" % e)
+            outcome = "failed after"
+            rep.result = events.status.FAIL
+        rep.message = ("filesystem setup for %s %s %.3f seconds" %
+                       (device, outcome, time.time() - start))
+
+
+def device_disk(device):
+    """
+    Return the disk that device (a disk or a partition) lives on, so that
+    all work on one disk can be kept in order.
+    """
+    if not device:
+        return None
+    device = os.path.realpath(device)
+    name = os.path.basename(device)
+    syspath = "/sys/class/block/%s" % name
+    if os.path.exists(os.path.join(syspath, "partition")):
+        disk = os.path.basename(os.path.dirname(os.path.realpath(syspath)))
+        return "/dev/%s" % disk
+    # partitions made earlier in this run are not in sysfs yet when the
+    # plan is built, so go by the name the kernel will give them
+    for part_re in PARTITION_NAME_RES:
+        match = part_re.match(name)
+        if match:
+            return os.path.join(os.path.dirname(device), match.group(1))
+    return device
+
+
+class DiskPlan(object):
+    """
+    Steps to run against disks, in the order they were added for any one
+    disk, with the steps for different disks run concurrently.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self.disks = []
+        self.steps = {}
+
+    def add(self, device, func, *args):
+        disk = device_disk(device)
+        if disk not in self.steps:
+            self.disks.append(disk)
+            self.steps[disk] = []
+        self.steps[disk].append((func, args))
+
+    def _run_disk(self, disk):
+        for (func, args) in self.steps[disk]:
+            func(*args)
+
+    def run(self):
+        results = util.parallel_map(self._run_disk, self.disks,
+                                    max_workers=self.max_workers)
+        for (_result, exc) in results:
+            if exc is not None:
+                raise exc
 
 
 def update_disk_setup_devices(disk_setup, tformer):
@@ -244,6 +350,14 @@ def enumerate_disk(device, nodeps=False):
         name: the device name, i.e. sda
     """
 
+    key = (device, nodeps)
+    if key not in _LSBLK_CACHE:
+        _LSBLK_CACHE[key] = _read_lsblk(device, nodeps)
+    for d in _LSBLK_CACHE[key]:
+        yield dict(d)
+
+
+def _read_lsblk(device, nodeps):
     lsblk_cmd = [LSBLK_CMD, '--pairs', '--output', 'NAME,TYPE,FSTYPE,LABEL',
                  device]
 
@@ -258,6 +372,7 @@ def enumerate_disk(device, nodeps=False):
 
     parts = [x for x in (info.strip()).splitlines() if len(x.split()) > 0]
 
+    entries = []
     for part in parts:
         d = {
             'name': None,
@@ -269,7 +384,8 @@ def enumerate_disk(device, nodeps=False):
         for key, value in value_splitter(part):
             d[key.lower()] = value
 
-        yield d
+        entries.append(d)
+    return entries
 
 
 def device_type(device):
@@ -310,6 +426,12 @@ def check_fs(device):
 
     Return values are device, label, type, uuid
     """
+    if device not in _BLKID_CACHE:
+        _BLKID_CACHE[device] = _read_blkid(device)
+    return _BLKID_CACHE[device]
+
+
+def _read_blkid(device):
     out, label, fs_type, uuid = None, None, None, None
 
     blkid_cmd = [BLKID_CMD, '-c', '/dev/null', device]
@@ -655,6 +777,8 @@ def purge_disk(device):
                 util.subp(wipefs_cmd)
             except Exception:
                 raise Exception("Failed FS purge of /dev/%s" % d['name'])
+            finally:
+                clear_device_cache()
 
     purge_disk_ptable(device)
 
@@ -684,6 +808,8 @@ def read_parttbl(device):
         util.subp(udev_cmd)
     except Exception as e:
         util.logexc(LOG, "Failed reading the partition table %s" % e)
+    finally:
+        clear_device_cache()
 
 
 def exec_mkpart_mbr(device, layout):
@@ -715,6 +841,8 @@ def exec_mkpart_gpt(device, layout):
     except Exception:
         LOG.warn("Failed to partition device %s" % device)
         raise
+    finally:
+        clear_device_cache()
 
 
 def exec_mkpart(table_type, device, layout):
@@ -814,6 +942,58 @@ def lookup_force_flag(fs):
     return ''
 
 
+def lookup_fast_opts(fs):
+    """
+    Options that make creating a file system quick: no discard of the
+    device and lazy inode table / journal initialization where supported.
+    """
+    opts = {
+        'ext2': ['-E', 'nodiscard'],
+        'ext3': ['-E', 'lazy_journal_init=1,nodiscard'],
+        'ext4': ['-E', 'lazy_itable_init=1,lazy_journal_init=1,nodiscard'],
+        'xfs': ['-K'],
+        'btrfs': ['-K'],
+    }
+
+    if fs.lower() in opts:
+        return opts[fs.lower()]
+
+    LOG.warn("Fast creation options for %s are unknown." % fs)
+    return []
+
+
+def merge_extended_opts(fast_opts, extra_opts):
+    """
+    mke2fs only honours the last -E it is given, so fold the -E settings of
+    fast_opts into the one in extra_opts, letting the user's settings win.
+    Returns the (fast_opts, extra_opts) to use.
+    """
+    extra_opts = list(extra_opts)
+    found = None
+    for (i, opt) in enumerate(extra_opts):
+        if opt == '-E' and i + 1 < len(extra_opts):
+            found = (i + 1, '')
+        elif opt.startswith('-E') and len(opt) > 2:
+            found = (i, '-E')
+    if found is None or '-E' not in fast_opts:
+        return (fast_opts, extra_opts)
+
+    def key(setting):
+        name = setting.split('=')[0]
+        return 'discard' if name == 'nodiscard' else name
+
+    fast_opts = list(fast_opts)
+    pos = fast_opts.index('-E')
+    fast_settings = fast_opts[pos + 1].split(',')
+    del fast_opts[pos:pos + 2]
+    (i, prefix) = found
+    settings = extra_opts[i][len(prefix):].split(',')
+    user_keys = set(key(s) for s in settings)
+    settings = [s for s in fast_settings if key(s) not in user_keys] + settings
+    extra_opts[i] = prefix + ",".join(settings)
+    return (fast_opts, extra_opts)
+
+
 def mkfs(fs_cfg):
     """
     Create a file system on the device.
@@ -833,6 +1013,10 @@ def mkfs(fs_cfg):
                             'any' means the first filesystem that matches
                             on the device.
 
+                fast: skip discarding the device and initialize the
+                            inode tables and journal lazily, if the file
+                            system supports it.
+
             When 'cmd' is provided then no other parameter is required.
     """
     label = fs_cfg.get('label')
@@ -843,6 +1027,7 @@ def mkfs(fs_cfg):
     fs_opts = fs_cfg.get('extra_opts', [])
     fs_replace = fs_cfg.get('replace_fs', False)
     overwrite = fs_cfg.get('overwrite', False)
+    fast = fs_cfg.get('fast', False)
 
     # ensure that we get a real device rather than a symbolic link
     device = os.path.realpath(device)
@@ -946,6 +1131,12 @@ def mkfs(fs_cfg):
         if overwrite or device_type(device) == "disk":
             fs_cmd.append(lookup_force_flag(fs_type))
 
+        if fast:
+            fast_opts = lookup_fast_opts(fs_type)
+            if fs_opts:
+                (fast_opts, fs_opts) = merge_extended_opts(fast_opts, fs_opts)
+            fs_cmd.extend(fast_opts)
+
     # Add the extends FS options
     if fs_opts:
         fs_cmd.extend(fs_opts)
@@ -956,3 +1147,5 @@ def mkfs(fs_cfg):
         util.subp(fs_cmd)
     except Exception as e:
         raise Exception("Failed to exec of '%s':\n%s" % (fs_cmd, e))
+    finally:
+        clear_device_cache()
@@ -56,6 +56,7 @@ from cloudinit import util
 LOG = logging.getLogger(__name__)
 
 frequency = PER_INSTANCE
+package_transaction = True
 
 BUILTIN_CFG = {
     'config': None,
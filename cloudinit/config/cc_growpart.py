@@ -102,13 +102,27 @@ class RESIZE(object):
 
 LOG = logging.getLogger(__name__)
 
+# A partition followed by fewer free sectors than this can not be grown
+# (a GPT disk keeps its 33 sector backup table at the very end).
+MIN_FREE_SECTORS = 34
+
+# resizer class -> result of its available(), which may fork to find out
+_AVAILABLE = {}
+
+
+def resizer_available(resizer):
+    key = type(resizer)
+    if key not in _AVAILABLE:
+        _AVAILABLE[key] = resizer.available()
+    return _AVAILABLE[key]
+
 
 def resizer_factory(mode):
     resize_class = None
     if mode == "auto":
         for (_name, resizer) in RESIZERS:
             cur = resizer()
-            if cur.available():
+            if resizer_available(cur):
                 resize_class = cur
                 break
 
@@ -124,7 +138,7 @@ def resizer_factory(mode):
             raise TypeError("unknown resize mode %s" % mode)
 
         mclass = mmap[mode]()
-        if mclass.available():
+        if resizer_available(mclass):
             resize_class = mclass
 
         if not resize_class:
@@ -153,6 +167,12 @@ class ResizeGrowPart(object):
 
     def resize(self, diskdev, partnum, partdev):
         before = get_size(partdev)
+        free = part_free_sectors(partdev)
+        if free is not None and free < MIN_FREE_SECTORS:
+            LOG.debug("%s is followed by %s free sectors, not running "
+                      "growpart", partdev, free)
+            return (before, before)
+
         try:
             util.subp(["growpart", '--dry-run', diskdev, partnum])
         except util.ProcessExecutionError as e:
@@ -252,6 +272,29 @@ def device_part_info(devpath):
     return (diskdevpath, ptnum)
 
 
+def part_free_sectors(devpath):
+    # return the number of 512 byte sectors between the end of partition
+    # devpath and the next partition or the end of its disk, as sysfs
+    # reports them, or None if that can not be determined.
+    syspath = "/sys/class/block/%s" % os.path.basename(
+        os.path.realpath(devpath))
+    try:
+        start = int(util.load_file(os.path.join(syspath, "start")))
+        size = int(util.load_file(os.path.join(syspath, "size")))
+        disksyspath = os.path.dirname(os.path.realpath(syspath))
+        limit = int(util.load_file(os.path.join(disksyspath, "size")))
+        for name in os.listdir(disksyspath):
+            pstart = os.path.join(disksyspath, name, "start")
+            if not os.path.exists(pstart):
+                continue
+            pstart = int(util.load_file(pstart))
+            if start < pstart < limit:
+                limit = pstart
+    except (IOError, OSError, ValueError):
+        return None
+    return limit - (start + size)
+
+
 def devent2dev(devent):
     if devent.startswith("/dev/"):
         return devent
@@ -263,54 +306,86 @@ def devent2dev(devent):
 
 
 def resize_devices(resizer, devices):
-    # returns a tuple of tuples containing (entry-in-devices, action, message)
-    info = []
-    for devent in devices:
+    # returns a list of tuples containing (entry-in-devices, action, message)
+    # in the order of devices. Partitions on different disks are resized
+    # concurrently, those on the same disk one after another.
+    info = [None] * len(devices)
+    disks = {}
+    disk_order = []
+    seen = {}
+    duplicates = []
+    for (index, devent) in enumerate(devices):
         try:
             blockdev = devent2dev(devent)
         except ValueError as e:
-            info.append((devent, RESIZE.SKIPPED,
-                         "unable to convert to device: %s" % e,))
+            info[index] = (devent, RESIZE.SKIPPED,
+                           "unable to convert to device: %s" % e,)
             continue
 
         try:
             statret = os.stat(blockdev)
         except OSError as e:
-            info.append((devent, RESIZE.SKIPPED,
-                         "stat of '%s' failed: %s" % (blockdev, e),))
+            info[index] = (devent, RESIZE.SKIPPED,
+                           "stat of '%s' failed: %s" % (blockdev, e),)
             continue
 
         if (not stat.S_ISBLK(statret.st_mode) and
                 not stat.S_ISCHR(statret.st_mode)):
-            info.append((devent, RESIZE.SKIPPED,
-                         "device '%s' not a block device" % blockdev,))
+            info[index] = (devent, RESIZE.SKIPPED,
+                           "device '%s' not a block device" % blockdev,)
             continue
 
+        # '/' and the device mounted there only need growing once
+        realdev = os.path.realpath(blockdev)
+        if realdev in seen:
+            duplicates.append((index, seen[realdev]))
+            continue
+        seen[realdev] = index
+
         try:
             (disk, ptnum) = device_part_info(blockdev)
         except (TypeError, ValueError) as e:
-            info.append((devent, RESIZE.SKIPPED,
-                         "device_part_info(%s) failed: %s" % (blockdev, e),))
+            info[index] = (devent, RESIZE.SKIPPED,
+                           "device_part_info(%s) failed: %s" % (blockdev, e),)
             continue
 
-        try:
-            (old, new) = resizer.resize(disk, ptnum, blockdev)
-            if old == new:
-                info.append((devent, RESIZE.NOCHANGE,
-                             "no change necessary (%s, %s)" % (disk, ptnum),))
-            else:
-                info.append((devent, RESIZE.CHANGED,
-                             "changed (%s, %s) from %s to %s" %
-                             (disk, ptnum, old, new),))
-
-        except ResizeFailedException as e:
-            info.append((devent, RESIZE.FAILED,
-                         "failed to resize: disk=%s, ptnum=%s: %s" %
-                         (disk, ptnum, e),))
+        if disk not in disks:
+            disks[disk] = []
+            disk_order.append(disk)
+        disks[disk].append((index, devent, blockdev, ptnum))
+
+    def resize_disk(disk):
+        for (index, devent, blockdev, ptnum) in disks[disk]:
+            info[index] = resize_partition(resizer, devent, disk, ptnum,
+                                           blockdev)
+
+    for (_result, exc) in util.parallel_map(resize_disk, disk_order):
+        if exc is not None:
+            raise exc
+
+    for (index, first) in duplicates:
+        info[index] = (devices[index],) + tuple(info[first][1:])
 
     return info
 
 
+def resize_partition(resizer, devent, disk, ptnum, blockdev):
+    try:
+        (old, new) = resizer.resize(disk, ptnum, blockdev)
+        if old == new:
+            return (devent, RESIZE.NOCHANGE,
+                    "no change necessary (%s, %s)" % (disk, ptnum),)
+        else:
+            return (devent, RESIZE.CHANGED,
+                    "changed (%s, %s) from %s to %s" %
+                    (disk, ptnum, old, new),)
+
+    except ResizeFailedException as e:
+        return (devent, RESIZE.FAILED,
+                "failed to resize: disk=%s, ptnum=%s: %s" %
+                (disk, ptnum, e),)
+
+
 def handle(_name, cfg, _cloud, log, _args):
     if 'growpart' not in cfg:
         log.debug("No 'growpart' entry in cfg.  Using default: %s" %
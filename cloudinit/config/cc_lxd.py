@@ -63,6 +63,7 @@ from cloudinit import util
 import os
 
 distros = ['ubuntu']
+package_transaction = True
 
 
 def handle(name, cfg, cloud, log, args):
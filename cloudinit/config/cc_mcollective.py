@@ -77,6 +77,7 @@ PRICERT_FILE = "/etc/mcollective/ssl/server-private.pem"
 SERVER_CFG = '/etc/mcollective/server.cfg'
 
 LOG = logging.getLogger(__name__)
+package_transaction = True
 
 
 def configure(config, server_cfg=SERVER_CFG,
@@ -23,9 +23,12 @@ Migrator
 
 This module handles moving old versions of cloud-init data to newer ones.
 Currently, it only handles renaming cloud-init's per-frequency semaphore files
-to canonicalized name and renaming legacy semaphore names to newer ones. This
-module is enabled by default, but can be disabled by specifying ``migrate:
-false`` in config.
+to canonicalized name and renaming legacy semaphore names to newer ones. When
+semaphores are kept in marker files (the default, see ``semaphores`` in the
+``paths`` of ``system_info``), it also turns a semaphore index left from using
+``semaphores: index`` back into marker files; the index itself takes in marker
+files when first read. This module is enabled by default, but can be disabled
+by specifying ``migrate: false`` in config.
 
 **Internal name:** ``cc_migrator``
 
@@ -38,6 +41,7 @@ false`` in config.
     migrate: <true/false>
 """
 
+import json
 import os
 import shutil
 
@@ -67,6 +71,35 @@ def _migrate_canon_sems(cloud):
     return am_adjusted
 
 
+def _migrate_sem_index(cloud):
+    paths = (cloud.paths.get_ipath('sem'), cloud.paths.get_cpath('sem'))
+    use_index = cloud.paths.sem_backend == 'index'
+    am_adjusted = 0
+    for sem_path in paths:
+        if not sem_path:
+            continue
+        index_fn = os.path.join(sem_path, helpers.SEM_INDEX_FILE)
+        if not os.path.isfile(index_fn):
+            continue
+        index = json.loads(util.load_file(index_fn))
+        canon_index = {}
+        for (entry, contents) in index.items():
+            (name, ext) = os.path.splitext(entry)
+            canon_index[helpers.canon_sem_name(name) + ext] = contents
+        if use_index:
+            if canon_index != index:
+                util.write_file_atomic(
+                    index_fn, [json.dumps(canon_index, indent=1,
+                                          sort_keys=True)])
+                am_adjusted += len(set(canon_index) - set(index))
+            continue
+        for (entry, contents) in canon_index.items():
+            util.write_file(os.path.join(sem_path, entry), contents + "\n")
+        util.del_file(index_fn)
+        am_adjusted += len(canon_index)
+    return am_adjusted
+
+
 def _migrate_legacy_sems(cloud, log):
     legacy_adjust = {
         'apt-update-upgrade': [
@@ -78,7 +111,7 @@ def _migrate_legacy_sems(cloud, log):
     for sem_path in paths:
         if not sem_path or not os.path.exists(sem_path):
             continue
-        sem_helper = helpers.FileSemaphores(sem_path)
+        sem_helper = helpers.get_semaphores(cloud.paths, sem_path)
         for (mod_name, migrate_to) in legacy_adjust.items():
             possibles = [mod_name, helpers.canon_sem_name(mod_name)]
             old_exists = []
@@ -101,6 +134,8 @@ def handle(name, cfg, cloud, log, _args):
     if not util.translate_bool(do_migrate):
         log.debug("Skipping module named %s, migration disabled", name)
         return
+    sems_indexed = _migrate_sem_index(cloud)
+    log.debug("Migrated %s semaphore index entries", sems_indexed)
     sems_moved = _migrate_canon_sems(cloud)
     log.debug("Migrated %s semaphore files to there canonicalized names",
               sems_moved)
@@ -45,7 +45,11 @@ values. It defaults to::
 Swap files can be configured by setting the path to the swap file to create
 with ``filename``, the size of the swap file with ``size`` maximum size of
 the swap file if using an ``size: auto`` with ``maxsize``. By default no
-swap file is created.
+swap file is created. The swap file is prepared in the background while the
+other fstab entries are worked out and written; its own entry is added once it
+is ready, before swap and the mounts are activated. On ext4, and on xfs with
+kernel 4.18 or later, its space is only reserved with fallocate; otherwise it
+is written out with zeros.
 
 **Internal name:** ``cc_mounts``
 
@@ -68,10 +72,14 @@ swap file is created.
 
 from string import whitespace
 
+import errno
 import logging
 import os.path
 import re
+import threading
+import time
 
+from cloudinit.reporting import events
 from cloudinit import type_utils
 from cloudinit import util
 
@@ -81,6 +89,13 @@ DEVICE_NAME_RE = re.compile(DEVICE_NAME_FILTER)
 WS = re.compile("[%s]+" % (whitespace))
 FSTAB_PATH = "/etc/fstab"
 
+# file systems where swapon accepts a file whose blocks were only reserved
+# with fallocate, with the first kernel version that does; anywhere else the
+# swap file has to be written out.  Before 4.18 xfs reports the unwritten
+# extents of such a file as holes and swapon refuses it.
+SWAP_FALLOCATE_FS = {'ext4': (0,), 'xfs': (4, 18)}
+SWAP_WRITE_SIZE = 8 * 2 ** 20
+
 LOG = logging.getLogger(__name__)
 
 
@@ -251,13 +266,8 @@ def setup_swapfile(fname, size=None, maxsize=None):
     msg = "creating swap file '%s' of %sMB" % (fname, mbsize)
     try:
         util.ensure_dir(tdir)
-        util.log_time(LOG.debug, msg, func=util.subp,
-                      args=[['sh', '-c',
-                            ('rm -f "$1" && umask 0066 && '
-                             '{ fallocate -l "${2}M" "$1" || '
-                             ' dd if=/dev/zero "of=$1" bs=1M "count=$2"; } && '
-                             'mkswap "$1" || { r=$?; rm -f "$1"; exit $r; }'),
-                             'setup_swap', fname, mbsize]])
+        util.log_time(LOG.debug, msg, func=create_swapfile,
+                      args=[fname, int(mbsize) * 2 ** 20])
 
     except Exception as e:
         raise IOError("Failed %s: %s" % (msg, e))
@@ -265,6 +275,63 @@ def setup_swapfile(fname, size=None, maxsize=None):
     return fname
 
 
+def kernel_version():
+    """Return the (major, minor) version of the running kernel."""
+    return tuple(int(v) for v in
+                 re.match(r"(\d+)\.(\d+)", os.uname()[2]).groups())
+
+
+def swap_allocate_method(tdir):
+    """
+    Return 'fallocate' if a swap file in tdir can just have its space
+    reserved, or 'write' if it must be filled with zeros.
+    """
+    if not hasattr(os, 'posix_fallocate'):
+        return 'write'
+    info = util.get_mount_info(tdir)
+    if info and info[1] in SWAP_FALLOCATE_FS:
+        if kernel_version() >= SWAP_FALLOCATE_FS[info[1]]:
+            return 'fallocate'
+    return 'write'
+
+
+def _write_zeros(fd, size):
+    zeros = b'\0' * SWAP_WRITE_SIZE
+    view = memoryview(zeros)
+    while size > 0:
+        written = os.write(fd, view[:min(size, SWAP_WRITE_SIZE)])
+        size -= written
+
+
+def create_swapfile(fname, size):
+    """
+    Create fname, readable only by root, with size bytes of space behind it
+    and format it with mkswap, removing it again on failure.
+    """
+    method = swap_allocate_method(os.path.dirname(fname))
+    util.del_file(fname)
+    fd = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        try:
+            if method == 'fallocate':
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError as e:
+                    if e.errno not in (errno.EOPNOTSUPP, errno.ENOSYS):
+                        raise
+                    method = 'write'
+            if method == 'write':
+                _write_zeros(fd, size)
+        finally:
+            os.close(fd)
+        util.subp(['mkswap', fname])
+    except Exception:
+        util.del_file(fname)
+        raise
+    LOG.debug("swap file %s was allocated using %s", fname, method)
+    return method
+
+
 def handle_swapcfg(swapcfg):
     """handle the swap config, calling setup_swap if necessary.
        return None or (filename, size)
@@ -309,7 +376,43 @@ def handle_swapcfg(swapcfg):
     return None
 
 
-def handle(_name, cfg, cloud, log, _args):
+def start_swapcfg(swapcfg, reporter=None):
+    """
+    Run handle_swapcfg(swapcfg) in the background. Returns a function that
+    waits for it to finish and returns what handle_swapcfg did.
+    """
+    result = []
+
+    def run():
+        with events.ReportEventStack(
+                name="swap", parent=reporter,
+                description="setting up swap file") as rep:
+            start = time.time()
+            try:
+                result.append(handle_swapcfg(swapcfg))
+            except Exception:
+                util.logexc(LOG, "Failed setting up swap")
+            rep.message = ("swap file setup took %.3f seconds" %
+                           (time.time() - start))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    def wait():
+        thread.join()
+        if result:
+            return result[0]
+        return None
+
+    return wait
+
+
+def mount_entries(cfg, cloud, log):
+    """
+    Work out the fstab entries for the 'mounts' config and the default
+    mounts, with every field filled in.
+    """
     # fs_spec, fs_file, fs_vfstype, fs_mntops, fs-freq, fs_passno
     def_mnt_opts = "defaults,nobootwait"
     if cloud.distro.uses_systemd():
@@ -399,26 +502,19 @@ def handle(_name, cfg, cloud, log, _args):
             log.debug("Skipping non-existent device named %s", x[0])
         else:
             actlist.append(x)
+    return actlist
 
-    swapret = handle_swapcfg(cfg.get('swap', {}))
-    if swapret:
-        actlist.append([swapret, "none", "swap", "sw", "0", "0"])
-
-    if len(actlist) == 0:
-        log.debug("No modifications to fstab needed.")
-        return
 
+def write_fstab(actlist, log):
+    """
+    Replace the entries this module added to fstab before with actlist,
+    making the directories they mount on.
+    """
     comment = "comment=cloudconfig"
     cc_lines = []
-    needswap = False
-    dirs = []
     for line in actlist:
         # write 'comment' in the fs_mntops, entry,  claiming this
-        line[3] = "%s,%s" % (line[3], comment)
-        if line[2] == "swap":
-            needswap = True
-        if line[1].startswith("/"):
-            dirs.append(line[1])
+        line = line[:3] + ["%s,%s" % (line[3], comment)] + line[4:]
         cc_lines.append('\t'.join(line))
 
     fstab_lines = []
@@ -435,18 +531,39 @@ def handle(_name, cfg, cloud, log, _args):
     contents = "%s\n" % ('\n'.join(fstab_lines))
     util.write_file(FSTAB_PATH, contents)
 
-    if needswap:
+    for line in actlist:
+        if line[1].startswith("/"):
+            try:
+                util.ensure_dir(line[1])
+            except Exception:
+                util.logexc(log, "Failed to make '%s' config-mount", line[1])
+
+
+def handle(_name, cfg, cloud, log, _args):
+    # writing out a swap file can take a while, so get that going first and
+    # write fstab without it meanwhile; it is waited for even when that
+    # fails, and its entry added once it is ready
+    wait_for_swap = start_swapcfg(cfg.get('swap', {}), cloud.reporter)
+    try:
+        actlist = mount_entries(cfg, cloud, log)
+        if actlist:
+            write_fstab(actlist, log)
+    finally:
+        swapret = wait_for_swap()
+    if swapret:
+        actlist.append([swapret, "none", "swap", "sw", "0", "0"])
+        write_fstab(actlist, log)
+
+    if len(actlist) == 0:
+        log.debug("No modifications to fstab needed.")
+        return
+
+    if any(line[2] == "swap" for line in actlist):
         try:
             util.subp(("swapon", "-a"))
         except Exception:
             util.logexc(log, "Activating swap via 'swapon -a' failed")
 
-    for d in dirs:
-        try:
-            util.ensure_dir(d)
-        except Exception:
-            util.logexc(log, "Failed to make '%s' config-mount", d)
-
     try:
         util.subp(("mount", "-a"))
     except util.ProcessExecutionError:
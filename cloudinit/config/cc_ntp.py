@@ -62,6 +62,7 @@ frequency = PER_INSTANCE
 NTP_CONF = '/etc/ntp.conf'
 NR_POOL_SERVERS = 4
 distros = ['centos', 'debian', 'fedora', 'opensuse', 'ubuntu']
+package_transaction = True
 
 
 def handle(name, cfg, cloud, log, _args):
@@ -30,6 +30,10 @@ be provided. Each entry in the list can be either a package name or a list with
 two entries, the first being the package name and the second being the specific
 package version to install.
 
+Unless a reboot may be needed, the packages are installed together with those
+of later modules that install packages of their own, in a single package
+manager run, and at the latest before a module that does not.
+
 **Internal name:** ``cc_package_update_upgrade_install``
 
 **Module frequency:** per instance
@@ -59,6 +63,7 @@ from cloudinit import util
 
 REBOOT_FILE = "/var/run/reboot-required"
 REBOOT_CMD = ["/sbin/reboot"]
+package_transaction = True
 
 
 def _multi_cfg_bool_get(cfg, *keys):
@@ -108,7 +113,11 @@ def handle(_name, cfg, cloud, log, _args):
 
     if len(pkglist):
         try:
-            cloud.distro.install_packages(pkglist)
+            # the reboot check below needs the packages installed right away
+            if reboot_if_required:
+                cloud.distro.install_packages(pkglist)
+            else:
+                cloud.distro.queue_packages(pkglist)
         except Exception as e:
             util.logexc(log, "Failed to install packages: %s", pkglist)
             errors.append(e)
@@ -71,6 +71,8 @@ import socket
 from cloudinit import helpers
 from cloudinit import util
 
+package_transaction = True
+
 PUPPET_CONF_PATH = '/etc/puppet/puppet.conf'
 PUPPET_SSL_CERT_DIR = '/var/lib/puppet/ssl/certs/'
 PUPPET_SSL_DIR = '/var/lib/puppet/ssl'
@@ -112,6 +114,9 @@ def handle(name, cfg, cloud, log, _args):
         log.debug(("Attempting to install puppet %s,"),
                   version if version else 'latest')
         cloud.distro.install_packages(('puppet', version))
+    # installing puppet took anything queued along with it, otherwise make
+    # sure the packages the agent may rely on are in place
+    cloud.distro.flush_packages()
 
     # ... and then update the puppet configuration
     if 'conf' in puppet_cfg:
@@ -51,6 +51,8 @@ import os
 
 from cloudinit import util
 
+package_transaction = True
+
 # Note: see http://saltstack.org/topics/installation/
 
 
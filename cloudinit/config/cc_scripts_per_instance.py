@@ -25,13 +25,20 @@ Scripts Per Instance
 
 Any scripts in the ``scripts/per-instance`` directory on the datasource will
 be run when a new instance is first booted. Scripts will be run in alphabetical
-order. This module does not accept any config keys.
+order.
+
+Scripts can be run concurrently with ``scripts_max_workers``; see the
+``cc_scripts_user`` module documentation.
 
 **Internal name:** ``cc_scripts_per_instance``
 
 **Module frequency:** per instance
 
 **Supported distros:** all
+
+**Config keys**::
+
+    scripts_max_workers: <number of scripts to run at once, default 1>
 """
 
 import os
@@ -45,12 +52,15 @@ frequency = PER_INSTANCE
 SCRIPT_SUBDIR = 'per-instance'
 
 
-def handle(name, _cfg, cloud, log, _args):
+def handle(name, cfg, cloud, log, _args):
     # Comes from the following:
     # https://forums.aws.amazon.com/thread.jspa?threadID=96918
     runparts_path = os.path.join(cloud.get_cpath(), 'scripts', SCRIPT_SUBDIR)
+    workers = util.get_cfg_option_int(cfg, 'scripts_max_workers', 1)
     try:
-        util.runparts(runparts_path)
+        util.runparts(runparts_path, max_workers=workers,
+                      ledger=cloud.get_ipath_cur('scripts_ledger'),
+                      reporter=cloud.reporter)
     except Exception:
         log.warn("Failed to run module %s (%s in %s)",
                  name, SCRIPT_SUBDIR, runparts_path)
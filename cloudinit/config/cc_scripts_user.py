@@ -28,13 +28,25 @@ This module runs all user scripts. User scripts are not specified in the
 ``scripts`` dir in the instance configuration. Any cloud-config parts with a
 ``#!`` will be treated as a script and run. Scripts specified as cloud-config
 parts will be run in the order they are specified in the configuration.
-This module does not accept any config keys.
+Start and end time, exit code and output size of each script run by this and
+the other scripts modules are appended to ``scripts-ledger.jsonl`` in the
+instance directory, and each script gets a reporting event of its own.
+
+Setting ``scripts_max_workers`` above 1 runs scripts whose names start with
+the same number (``10-metrics``, ``10-logs``) concurrently, on up to that
+many workers; other scripts, and the groups themselves, still run in order.
+The setting applies to the ``scripts-per-boot``, ``scripts-per-instance``,
+``scripts-per-once`` and ``scripts-vendor`` modules as well.
 
 **Internal name:** ``cc_scripts_user``
 
 **Module frequency:** per instance
 
 **Supported distros:** all
+
+**Config keys**::
+
+    scripts_max_workers: <number of scripts to run at once, default 1>
 """
 
 import os
@@ -48,13 +60,16 @@ frequency = PER_INSTANCE
 SCRIPT_SUBDIR = 'scripts'
 
 
-def handle(name, _cfg, cloud, log, _args):
+def handle(name, cfg, cloud, log, _args):
     # This is written to by the user data handlers
     # Ie, any custom shell scripts that come down
     # go here...
     runparts_path = os.path.join(cloud.get_ipath_cur(), SCRIPT_SUBDIR)
+    workers = util.get_cfg_option_int(cfg, 'scripts_max_workers', 1)
     try:
-        util.runparts(runparts_path)
+        util.runparts(runparts_path, max_workers=workers,
+                      ledger=cloud.get_ipath_cur('scripts_ledger'),
+                      reporter=cloud.reporter)
     except Exception:
         log.warn("Failed to run module %s (%s in %s)",
                  name, SCRIPT_SUBDIR, runparts_path)
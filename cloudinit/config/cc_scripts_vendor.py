@@ -26,6 +26,9 @@ when a new instance is first booted. Scripts will be run in alphabetical order.
 Vendor scripts can be run with an optional prefix specified in the ``prefix``
 entry under the ``vendor_data`` config key.
 
+Scripts can be run concurrently with ``scripts_max_workers``; see the
+``cc_scripts_user`` module documentation.
+
 **Internal name:** ``cc_scripts_vendor``
 
 **Module frequency:** per instance
@@ -36,6 +39,7 @@ entry under the ``vendor_data`` config key.
 
     vendor_data:
         prefix: <vendor data prefix>
+    scripts_max_workers: <number of scripts to run at once, default 1>
 """
 
 import os
@@ -57,8 +61,11 @@ def handle(name, cfg, cloud, log, _args):
 
     prefix = util.get_cfg_by_path(cfg, ('vendor_data', 'prefix'), [])
 
+    workers = util.get_cfg_option_int(cfg, 'scripts_max_workers', 1)
     try:
-        util.runparts(runparts_path, exe_prefix=prefix)
+        util.runparts(runparts_path, exe_prefix=prefix, max_workers=workers,
+                      ledger=cloud.get_ipath_cur('scripts_ledger'),
+                      reporter=cloud.reporter)
     except Exception:
         log.warn("Failed to run module %s (%s in %s)",
                  name, SCRIPT_SUBDIR, runparts_path)
@@ -84,6 +84,7 @@ import tempfile
 LOG = logging.getLogger(__name__)
 
 frequency = PER_INSTANCE
+package_transaction = True
 SNAPPY_CMD = "snappy"
 NAMESPACE_DELIM = '.'
 
@@ -43,6 +43,7 @@ from cloudinit import util
 
 
 distros = ['redhat', 'fedora']
+package_transaction = True
 required_packages = ['rhn-setup']
 def_ca_cert_path = "/usr/share/rhn/RHN-ORG-TRUSTED-SSL-CERT"
 
@@ -49,7 +49,9 @@ will be generated. The key types to generate can be specified using the
 ``ssh_genkeytypes`` config flag, which accepts a list of key types to use. For
 each key type for which this module has been instructed to create a keypair, if
 a key of the same type is already present on the system (i.e. if
-``ssh_deletekeys`` was false), no key will be generated.
+``ssh_deletekeys`` was false), no key will be generated. Keys of different
+types are generated concurrently, and the time taken for each is reported as
+an event under this module's reporting event.
 
 Supported key types for the ``ssh_keys`` and the ``ssh_genkeytypes`` config
 flags are:
@@ -108,8 +110,10 @@ public keys.
 import glob
 import os
 import sys
+import time
 
 from cloudinit.distros import ug_util
+from cloudinit.reporting import events
 from cloudinit import ssh_util
 from cloudinit import util
 
@@ -120,6 +124,7 @@ DISABLE_ROOT_OPTS = (
 
 GENERATE_KEY_NAMES = ['rsa', 'dsa', 'ecdsa', 'ed25519']
 KEY_FILE_TPL = '/etc/ssh/ssh_host_%s_key'
+GENERATE_KEY_WORKERS = 4
 
 CONFIG_KEY_TO_FILE = {}
 PRIV_TO_PUB = {}
@@ -132,6 +137,31 @@ for k in GENERATE_KEY_NAMES:
 KEY_GEN_TPL = 'o=$(ssh-keygen -yf "%s") && echo "$o" root@localhost > "%s"'
 
 
+def generate_key(keytype, keyfile, log, env, reporter=None):
+    """Run ssh-keygen for keytype, returning its output (or None)."""
+    cmd = ['ssh-keygen', '-t', keytype, '-N', '', '-f', keyfile]
+    with events.ReportEventStack(
+            name="keygen-%s" % keytype, parent=reporter,
+            description="generating %s host key" % keytype) as rep:
+        start = time.time()
+        try:
+            out, _err = util.subp(cmd, capture=True, env=env)
+            rep.message = ("generated %s host key in %.3f seconds" %
+                           (keytype, time.time() - start))
+            return util.decode_binary(out)
+        except util.ProcessExecutionError as e:
+            err = util.decode_binary(e.stderr).lower()
+            if (e.exit_code == 1 and
+                    err.lower().startswith("unknown key")):
+                log.debug("ssh-keygen: unknown key type '%s'", keytype)
+            else:
+                util.logexc(log, "Failed generating key type %s to "
+                            "file %s", keytype, keyfile)
+            rep.message = ("failed generating %s host key after %.3f "
+                           "seconds" % (keytype, time.time() - start))
+    return None
+
+
 def handle(_name, cfg, cloud, log, _args):
 
     # remove the static keys from the pristine image
@@ -171,26 +201,30 @@ def handle(_name, cfg, cloud, log, _args):
                                            GENERATE_KEY_NAMES)
         lang_c = os.environ.copy()
         lang_c['LANG'] = 'C'
+        todo = []
         for keytype in genkeys:
             keyfile = KEY_FILE_TPL % (keytype)
             if os.path.exists(keyfile):
                 continue
             util.ensure_dir(os.path.dirname(keyfile))
-            cmd = ['ssh-keygen', '-t', keytype, '-N', '', '-f', keyfile]
-
-            # TODO(harlowja): Is this guard needed?
-            with util.SeLinuxGuard("/etc/ssh", recursive=True):
-                try:
-                    out, err = util.subp(cmd, capture=True, env=lang_c)
-                    sys.stdout.write(util.decode_binary(out))
-                except util.ProcessExecutionError as e:
-                    err = util.decode_binary(e.stderr).lower()
-                    if (e.exit_code == 1 and
-                            err.lower().startswith("unknown key")):
-                        log.debug("ssh-keygen: unknown key type '%s'", keytype)
-                    else:
-                        util.logexc(log, "Failed generating key type %s to "
-                                    "file %s", keytype, keyfile)
+            todo.append((keytype, keyfile))
+
+        # ssh-keygen runs are independent of each other, so run them all
+        # at once and relabel /etc/ssh a single time when they are done.
+        # TODO(harlowja): Is this guard needed?
+        with util.SeLinuxGuard("/etc/ssh", recursive=True):
+            results = util.parallel_map(
+                lambda item: generate_key(item[0], item[1], log, lang_c,
+                                          cloud.reporter),
+                todo, max_workers=GENERATE_KEY_WORKERS)
+        for (out, _exc) in results:
+            if out:
+                sys.stdout.write(out)
+        # anything other than a failed ssh-keygen still fails the module,
+        # as it did when the keys were generated one after another
+        for (_out, exc) in results:
+            if exc is not None:
+                raise exc
 
     try:
         (users, _groups) = ug_util.normalize_users_groups(cfg, cloud.distro)
@@ -96,19 +96,22 @@ config keys for an entry in ``users`` are as follows:
           system: <true/false>
 """
 
-# Ensure this is aliased to a name not 'distros'
-# since the module attribute 'distros'
-# is a list of distros that are supported, not a sub-module
-from cloudinit import distros as ds
-
+from cloudinit.distros import ug_util
 from cloudinit.settings import PER_INSTANCE
 
 frequency = PER_INSTANCE
 
 
-def handle(name, cfg, cloud, _log, _args):
-    (users, groups) = ds.normalize_users_groups(cfg, cloud.distro)
-    for (name, members) in groups.items():
-        cloud.distro.create_group(name, members)
-    for (user, config) in users.items():
-        cloud.distro.create_user(user, **config)
+def handle(name, cfg, cloud, log, _args):
+    (users, groups) = ug_util.normalize_users_groups(cfg, cloud.distro)
+    results = cloud.distro.create_users_groups(users, groups)
+    failed = []
+    for user in users:
+        if results.get(user) is None:
+            log.debug("Set up user %s", user)
+        else:
+            log.warn("Failed to set up user %s: %s", user, results[user])
+            failed.append(user)
+    if failed:
+        raise RuntimeError("Failed to set up %s of %s users: %s" %
+                           (len(failed), len(users), ", ".join(failed)))
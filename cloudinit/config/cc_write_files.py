@@ -59,8 +59,11 @@ binary gzip data can be specified and will be decoded before being written.
 """
 
 import base64
+import grp
 import os
+import pwd
 import six
+import zlib
 
 from cloudinit.settings import PER_INSTANCE
 from cloudinit import util
@@ -70,6 +73,8 @@ frequency = PER_INSTANCE
 DEFAULT_OWNER = "root:root"
 DEFAULT_PERMS = 0o644
 UNKNOWN_ENC = 'text/plain'
+# how much compressed data is inflated (and written out) at a time
+CHUNK_SIZE = 64 * 1024
 
 
 def handle(name, cfg, _cloud, log, _args):
@@ -105,6 +110,8 @@ def write_files(name, files, log):
     if not files:
         return
 
+    owners = OwnerCache()
+    written_dirs = set()
     for (i, f_info) in enumerate(files):
         path = f_info.get('path')
         if not path:
@@ -113,11 +120,44 @@ def write_files(name, files, log):
             continue
         path = os.path.abspath(path)
         extractions = canonicalize_extraction(f_info.get('encoding'), log)
-        contents = extract_contents(f_info.get('content', ''), extractions)
+        chunks = iter_contents(f_info.get('content', ''), extractions)
         (u, g) = util.extract_usergroup(f_info.get('owner', DEFAULT_OWNER))
+        (uid, gid) = owners.lookup(u, g)
         perms = decode_perms(f_info.get('permissions'), DEFAULT_PERMS, log)
-        util.write_file(path, contents, mode=perms)
-        util.chownbyname(path, u, g)
+        written = util.write_file_atomic(path, chunks, mode=perms, uid=uid,
+                                         gid=gid)
+        written_dirs.add(os.path.dirname(written))
+
+    # make the new directory entries durable once per directory rather
+    # than once per file
+    for d in sorted(written_dirs):
+        util.fsync_dir(d)
+
+
+class OwnerCache(object):
+    """Resolves user and group names to ids, looking each up only once."""
+
+    def __init__(self):
+        self.uids = {}
+        self.gids = {}
+
+    def lookup(self, user=None, group=None):
+        # returns (uid, gid) with -1 for the ones not given, like
+        # util.chownbyname does
+        uid = -1
+        gid = -1
+        try:
+            if user:
+                if user not in self.uids:
+                    self.uids[user] = pwd.getpwnam(user).pw_uid
+                uid = self.uids[user]
+            if group:
+                if group not in self.gids:
+                    self.gids[group] = grp.getgrnam(group).gr_gid
+                gid = self.gids[group]
+        except KeyError as e:
+            raise OSError("Unknown user or group: %s" % (e))
+        return (uid, gid)
 
 
 def decode_perms(perm, default, log):
@@ -135,13 +175,41 @@ def decode_perms(perm, default, log):
         return default
 
 
-def extract_contents(contents, extraction_types):
-    result = contents
+def iter_contents(contents, extraction_types):
+    """
+    Decode contents as extraction_types say, returning an iterator over
+    the result that inflates gzip content a piece at a time while it is
+    being written.
+    """
+    result = [contents]
     for t in extraction_types:
         if t == 'application/x-gzip':
-            result = util.decomp_gzip(result, quiet=False, decode=False)
+            result = _gunzip(b''.join(util.encode_text(c) for c in result))
         elif t == 'application/base64':
-            result = base64.b64decode(result)
+            result = [base64.b64decode(
+                b''.join(util.encode_text(c) for c in result))]
         elif t == UNKNOWN_ENC:
             pass
     return result
+
+
+def _gunzip(data):
+    try:
+        # a gzip file may hold several members one after another
+        while data:
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            for start in range(0, len(data), CHUNK_SIZE):
+                chunk = inflater.decompress(data[start:start + CHUNK_SIZE])
+                if chunk:
+                    yield chunk
+            chunk = inflater.flush()
+            if chunk:
+                yield chunk
+            # python 2 decompress objects have no eof, so a truncated
+            # stream goes unnoticed there
+            eof = getattr(inflater, 'eof', True)
+            if not inflater.unused_data and not eof:
+                raise zlib.error("truncated gzip data")
+            data = inflater.unused_data
+    except zlib.error as e:
+        raise util.DecompressionError(six.text_type(e))
@@ -25,6 +25,7 @@ import six
 from six import StringIO
 
 import abc
+import contextlib
 import os
 import re
 import stat
@@ -67,10 +68,81 @@ class Distro(object):
         self._paths = paths
         self._cfg = cfg
         self.name = name
+        self._package_txn = None
+
+    def _install_packages(self, pkglist):
+        # distros written before package transactions override
+        # install_packages itself; keep them working, as long as they do
+        if (six.get_unbound_function(type(self).install_packages) is not
+                six.get_unbound_function(Distro.install_packages)):
+            return type(self).install_packages(self, pkglist)
+        raise NotImplementedError()
 
-    @abc.abstractmethod
     def install_packages(self, pkglist):
-        raise NotImplementedError()
+        """Install the packages in pkglist now.
+
+        Inside a package transaction, anything queued with queue_packages is
+        installed in the same package manager invocation and packages the
+        transaction already installed are not asked for again."""
+        txn = self._package_txn
+        if txn is None:
+            return self._install_packages(pkglist)
+        txn.requests += 1
+        self._flush_packages(txn, txn.wanted(pkglist))
+
+    def queue_packages(self, pkglist):
+        """Install pkglist with the next install or transaction flush.
+
+        Outside a package transaction this is the same as install_packages.
+        """
+        txn = self._package_txn
+        if txn is None:
+            return self.install_packages(pkglist)
+        txn.requests += 1
+        txn.queue(pkglist)
+
+    def flush_packages(self):
+        """Install anything queued in the current package transaction."""
+        txn = self._package_txn
+        if txn is not None and txn.pending:
+            self._flush_packages(txn, [])
+
+    def _flush_packages(self, txn, wanted):
+        queued = txn.take(wanted)
+        pkglist = wanted + queued
+        if not pkglist:
+            return
+        txn.invocations += 1
+        try:
+            self._install_packages(pkglist)
+        except Exception:
+            if not (wanted and queued):
+                raise
+            # don't let a bad queued package fail the caller's install, the
+            # queued packages get their own attempt with the next flush
+            LOG.warn("Installing %s along with queued %s failed, retrying"
+                     " without the queued packages", wanted, queued)
+            txn.queue(queued)
+            txn.invocations += 1
+            self._install_packages(wanted)
+            pkglist = wanted
+        txn.installed.update(PackageTransaction.key(p) for p in pkglist)
+
+    @contextlib.contextmanager
+    def package_transaction(self):
+        """Collect package installs made inside the block.
+
+        Yields the PackageTransaction; anything still queued when the block
+        exits is installed then.  Nested transactions join the outer one."""
+        if self._package_txn is not None:
+            yield self._package_txn
+            return
+        txn = self._package_txn = PackageTransaction()
+        try:
+            yield txn
+            self.flush_packages()
+        finally:
+            self._package_txn = None
 
     @abc.abstractmethod
     def _write_network(self, settings):
@@ -352,14 +424,13 @@ class Distro(object):
     def get_default_user(self):
         return self.get_option('default_user')
 
-    def add_user(self, name, **kwargs):
+    def _useradd_cmd(self, name, kwargs):
         """
-        Add a user to the system using standard GNU tools
+        Build the useradd command for the given user config, returning the
+        command, the command to log (with secrets redacted) and the groups
+        that should be created before running it.
         """
-        if util.is_user(name):
-            LOG.info("User %s already exists, skipping." % name)
-            return
-
+        kwargs = dict(kwargs)
         if 'create_groups' in kwargs:
             create_groups = kwargs.pop('create_groups')
         else:
@@ -402,6 +473,7 @@ class Distro(object):
                 # kwargs.items loop below wants a comma delimeted string
                 # that can go right through to the command.
                 kwargs['groups'] = ",".join(groups)
+                groups = list(groups)
             else:
                 groups = groups.split(",")
 
@@ -409,12 +481,6 @@ class Distro(object):
             if primary_group:
                 groups.append(primary_group)
 
-        if create_groups and groups:
-            for group in groups:
-                if not util.is_group(group):
-                    self.create_group(group)
-                    LOG.debug("created group %s for user %s", name, group)
-
         # Check the values and create the command
         for key, val in kwargs.items():
 
@@ -440,6 +506,26 @@ class Distro(object):
             adduser_cmd.append('-m')
             log_adduser_cmd.append('-m')
 
+        if not create_groups:
+            groups = []
+        return (adduser_cmd, log_adduser_cmd, groups or [])
+
+    def add_user(self, name, **kwargs):
+        """
+        Add a user to the system using standard GNU tools
+        """
+        if util.is_user(name):
+            LOG.info("User %s already exists, skipping." % name)
+            return
+
+        (adduser_cmd, log_adduser_cmd, groups) = self._useradd_cmd(
+            name, kwargs)
+        if groups:
+            for group in groups:
+                if not util.is_group(group):
+                    self.create_group(group)
+                    LOG.debug("created group %s for user %s", name, group)
+
         # Run the command
         LOG.debug("Adding user %s", name)
         try:
@@ -507,23 +593,168 @@ class Distro(object):
 
         # Import SSH keys
         if 'ssh_authorized_keys' in kwargs:
-            # Try to handle this in a smart manner.
-            keys = kwargs['ssh_authorized_keys']
-            if isinstance(keys, six.string_types):
-                keys = [keys]
-            elif isinstance(keys, dict):
-                keys = list(keys.values())
-            if keys is not None:
-                if not isinstance(keys, (tuple, list, set)):
-                    LOG.warn("Invalid type '%s' detected for"
-                             " 'ssh_authorized_keys', expected list,"
-                             " string, dict, or set.", type(keys))
-                else:
-                    keys = set(keys) or []
-                    ssh_util.setup_user_keys(keys, name, options=None)
+            self._setup_user_ssh_keys(name, kwargs['ssh_authorized_keys'])
 
         return True
 
+    def _setup_user_ssh_keys(self, name, keys):
+        # Try to handle this in a smart manner.
+        if isinstance(keys, six.string_types):
+            keys = [keys]
+        elif isinstance(keys, dict):
+            keys = list(keys.values())
+        if keys is not None:
+            if not isinstance(keys, (tuple, list, set)):
+                LOG.warn("Invalid type '%s' detected for"
+                         " 'ssh_authorized_keys', expected list,"
+                         " string, dict, or set.", type(keys))
+            else:
+                keys = set(keys) or []
+                ssh_util.setup_user_keys(keys, name, options=None)
+
+    def create_users_groups(self, users, groups):
+        """
+        Create the given groups and users (as normalized by
+        ug_util.normalize_users_groups) in one pass.
+
+        The existing accounts are read once up front, passwords are set with
+        a single chpasswd call, all sudo rules are written with a single
+        write and group memberships are only added where they are missing.
+        Returns a dict mapping each user name to None when it was set up
+        successfully or to the exception that stopped its setup.
+        """
+        known_users = set(util.get_user_names())
+        known_groups = util.get_group_members()
+        extrausers = ['--extrausers'] if util.system_is_snappy() else []
+
+        def add_group(name):
+            try:
+                util.subp(['groupadd', name] + extrausers)
+                LOG.info("Created new group %s" % name)
+            except Exception:
+                util.logexc(LOG, "Failed to create group %s", name)
+                return
+            known_groups[name] = set()
+
+        for name in groups:
+            if name in known_groups:
+                LOG.warn("Skipping creation of existing group '%s'" % name)
+            else:
+                add_group(name)
+
+        results = {}
+        for (name, config) in users.items():
+            if 'snapuser' in config:
+                try:
+                    self.add_snap_user(name, **config)
+                    results[name] = None
+                except Exception as e:
+                    results[name] = e
+                continue
+            results[name] = None
+            if name in known_users:
+                LOG.info("User %s already exists, skipping." % name)
+                continue
+            (cmd, log_cmd, user_groups) = self._useradd_cmd(name, config)
+            for group in user_groups:
+                if group not in known_groups:
+                    add_group(group)
+                    LOG.debug("created group %s for user %s", name, group)
+            LOG.debug("Adding user %s", name)
+            try:
+                util.subp(cmd, logstring=log_cmd)
+            except Exception as e:
+                util.logexc(LOG, "Failed to create user %s", name)
+                results[name] = e
+                continue
+            known_users.add(name)
+
+        def pending(names):
+            return [n for n in names if results.get(n) is None]
+
+        def fail(names, exc):
+            for name in names:
+                if results.get(name) is None:
+                    results[name] = exc
+
+        todo = pending(n for n in users if 'snapuser' not in users[n])
+        for (key, hashed) in (('plain_text_passwd', False),
+                              ('hashed_passwd', True)):
+            names = [n for n in todo if users[n].get(key)]
+            if names:
+                try:
+                    self.set_passwds(
+                        [(n, users[n][key]) for n in names], hashed=hashed)
+                except Exception as e:
+                    if len(names) == 1:
+                        fail(names, e)
+                        continue
+                    # one bad entry fails the whole chpasswd run, so go
+                    # through the users one by one to find out which
+                    LOG.debug("Retrying passwords for %s one at a time",
+                              ", ".join(names))
+                    for name in names:
+                        try:
+                            self.set_passwd(name, users[name][key],
+                                            hashed=hashed)
+                        except Exception as e:
+                            fail([name], e)
+
+        for name in pending(todo):
+            if users[name].get('lock_passwd', True):
+                try:
+                    self.lock_passwd(name)
+                except Exception as e:
+                    fail([name], e)
+
+        sudo_content = []
+        for name in pending(todo):
+            if 'sudo' in users[name]:
+                try:
+                    sudo_content.append(
+                        self._sudo_rules_content(name, users[name]['sudo']))
+                except TypeError as e:
+                    util.logexc(LOG, "Failed to create sudo rules for %s",
+                                name)
+                    fail([name], e)
+        if sudo_content:
+            try:
+                self._write_sudo_content(self.ci_sudoers_fn,
+                                         "".join(sudo_content))
+            except IOError as e:
+                fail([n for n in todo if 'sudo' in users[n]], e)
+
+        for name in pending(todo):
+            if 'ssh_authorized_keys' in users[name]:
+                try:
+                    self._setup_user_ssh_keys(
+                        name, users[name]['ssh_authorized_keys'])
+                except Exception as e:
+                    util.logexc(LOG, "Failed to set up ssh keys for %s", name)
+                    fail([name], e)
+
+        # members are added last, so they may refer to any of the users
+        # created above
+        for (name, members) in groups.items():
+            if name not in known_groups:
+                continue
+            for member in members or []:
+                if member in known_groups[name]:
+                    continue
+                if member not in known_users:
+                    LOG.warn("Unable to add group member '%s' to group '%s'"
+                             "; user does not exist.", member, name)
+                    continue
+                try:
+                    util.subp(['usermod', '-a', '-G', name, member])
+                except Exception:
+                    util.logexc(LOG, "Failed to add user '%s' to group '%s'",
+                                member, name)
+                    continue
+                known_groups[name].add(member)
+                LOG.info("Added user '%s' to group '%s'" % (member, name))
+        return results
+
     def lock_passwd(self, name):
         """
         Lock the password of a user, i.e., disable password logins
@@ -538,7 +769,13 @@ class Distro(object):
             raise e
 
     def set_passwd(self, user, passwd, hashed=False):
-        pass_string = '%s:%s' % (user, passwd)
+        return self.set_passwds([(user, passwd)], hashed=hashed)
+
+    def set_passwds(self, user_passwds, hashed=False):
+        """Set the passwords of several (user, passwd) pairs at once."""
+        users = [user for (user, _passwd) in user_passwds]
+        pass_string = "\n".join('%s:%s' % (user, passwd)
+                                for (user, passwd) in user_passwds)
         cmd = ['chpasswd']
 
         if hashed:
@@ -547,10 +784,11 @@ class Distro(object):
             # about long names.
             cmd.append('-e')
 
+        users = ", ".join(users)
         try:
-            util.subp(cmd, pass_string, logstring="chpasswd for %s" % user)
+            util.subp(cmd, pass_string, logstring="chpasswd for %s" % users)
         except Exception as e:
-            util.logexc(LOG, "Failed to set password for %s", user)
+            util.logexc(LOG, "Failed to set password for %s", users)
             raise e
 
         return True
@@ -596,10 +834,7 @@ class Distro(object):
                 raise e
         util.ensure_dir(path, 0o750)
 
-    def write_sudo_rules(self, user, rules, sudo_file=None):
-        if not sudo_file:
-            sudo_file = self.ci_sudoers_fn
-
+    def _sudo_rules_content(self, user, rules):
         lines = [
             '',
             "# User rules for %s" % user,
@@ -614,7 +849,9 @@ class Distro(object):
             raise TypeError(msg % (type_utils.obj_name(rules)))
         content = "\n".join(lines)
         content += "\n"  # trailing newline
+        return content
 
+    def _write_sudo_content(self, sudo_file, content):
         self.ensure_sudo_dir(os.path.dirname(sudo_file))
         if not os.path.exists(sudo_file):
             contents = [
@@ -633,6 +870,12 @@ class Distro(object):
                 util.logexc(LOG, "Failed to append sudoers file %s", sudo_file)
                 raise e
 
+    def write_sudo_rules(self, user, rules, sudo_file=None):
+        if not sudo_file:
+            sudo_file = self.ci_sudoers_fn
+        self._write_sudo_content(sudo_file,
+                                 self._sudo_rules_content(user, rules))
+
     def create_group(self, name, members=None):
         group_add_cmd = ['groupadd', name]
         if util.system_is_snappy():
@@ -662,6 +905,63 @@ class Distro(object):
                 LOG.info("Added user '%s' to group '%s'" % (member, name))
 
 
+class PackageTransaction(object):
+    """Package install requests made while a package transaction is open.
+
+    Entries are anything install_packages accepts: package names or
+    (name, version) tuples.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.installed = set()
+        self.requests = 0
+        self.invocations = 0
+
+    @staticmethod
+    def key(pkg):
+        # ('name',) and ('name', None) are just 'name'
+        if isinstance(pkg, (list, tuple)):
+            if len(pkg) == 2 and pkg[1]:
+                return tuple(pkg)
+            return pkg[0]
+        return pkg
+
+    def wanted(self, pkglist, skip=()):
+        """Return the entries of pkglist not yet installed or in skip."""
+        # a lone tuple is a single (name, version) entry, as in
+        # util.expand_package_list
+        if not isinstance(pkglist, list):
+            pkglist = [pkglist]
+        seen = set(skip) | self.installed
+        wanted = []
+        for pkg in pkglist:
+            key = self.key(pkg)
+            if key not in seen:
+                seen.add(key)
+                wanted.append(pkg)
+        return wanted
+
+    def queue(self, pkglist):
+        self.pending.extend(
+            self.wanted(pkglist, skip=[self.key(p) for p in self.pending]))
+
+    def take(self, pkglist):
+        """Empty the queue, returning the entries not already in pkglist."""
+        pending = self.pending
+        self.pending = []
+        return self.wanted(pending, skip=[self.key(p) for p in pkglist])
+
+    @property
+    def saved(self):
+        return max(0, self.requests - self.invocations)
+
+    def summary(self):
+        return ("%s package install requests in %s package manager"
+                " invocations (%s saved)" %
+                (self.requests, self.invocations, self.saved))
+
+
 def _get_package_mirror_info(mirror_info, data_source=None,
                              mirror_filter=util.search_for_mirror):
     # given a arch specific 'mirror_info' entry (from package_mirrors)
@@ -56,7 +56,7 @@ class Distro(distros.Distro):
         ]
         util.write_file(out_fn, "\n".join(lines))
 
-    def install_packages(self, pkglist):
+    def _install_packages(self, pkglist):
         self.update_package_sources()
         self.package_command('', pkgs=pkglist)
 
@@ -20,7 +20,10 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import json
 import os
+import time
 
 from cloudinit import distros
 from cloudinit import helpers
@@ -43,6 +46,14 @@ APT_GET_WRAPPER = {
     'enabled': 'auto',
 }
 
+# What apt-get update fetches depends on these; a change to any of them
+# means the package lists have to be refreshed.
+APT_SOURCES_PATHS = ('/etc/apt/sources.list', '/etc/apt/sources.list.d',
+                     '/etc/apt/trusted.gpg', '/etc/apt/trusted.gpg.d',
+                     '/etc/apt/apt.conf', '/etc/apt/apt.conf.d')
+APT_LISTS_DIR = "/var/lib/apt/lists"
+APT_UPDATE_RECORD = "apt-update.json"
+
 ENI_HEADER = """# This file is generated from information provided by
 # the datasource.  Changes to it will not persist across an instance.
 # To disable cloud-init's network configuration capabilities, write a file
@@ -83,7 +94,7 @@ class Distro(distros.Distro):
         ]
         util.write_file(out_fn, "\n".join(lines))
 
-    def install_packages(self, pkglist):
+    def _install_packages(self, pkglist):
         self.update_package_sources()
         self.package_command('install', pkgs=pkglist)
 
@@ -93,9 +104,9 @@ class Distro(distros.Distro):
 
     def _write_network_config(self, netconfig):
         ns = parse_net_config_data(netconfig)
-        self._net_renderer.render_network_state("/", ns)
+        changed = self._net_renderer.render_network_state("/", ns)
         _maybe_remove_legacy_eth0()
-        return []
+        return sorted(changed)
 
     def _bring_up_interfaces(self, device_names):
         use_all = False
@@ -185,14 +196,87 @@ class Distro(distros.Distro):
                       args=(cmd,), kwargs={'env': e, 'capture': False})
 
     def update_package_sources(self):
-        self._runner.run("update-sources", self.package_command,
-                         ["update"], freq=PER_INSTANCE)
+        self._runner.run("update-sources", self._update_package_sources,
+                         [], freq=PER_INSTANCE)
+
+    def _update_package_sources(self):
+        # Skip 'apt-get update' when the last one we ran was done with the
+        # same sources, keys and apt config and is no older than
+        # apt_update_max_age seconds.  Unset or 0 always updates.
+        max_age = self.get_option("apt_update_max_age", 0)
+        if not (max_age and self._paths):
+            self.package_command("update")
+            return
+        record_fn = os.path.join(self._paths.get_cpath("data"),
+                                 APT_UPDATE_RECORD)
+        fingerprint = apt_sources_fingerprint()
+        age = apt_update_age(record_fn, fingerprint)
+        if age is not None and age <= max_age:
+            LOG.debug("Skipping apt-get update, sources unchanged since the"
+                      " last update %ds ago", age)
+            return
+        # don't trust the lists if this update fails half way
+        util.del_file(record_fn)
+        self.package_command("update")
+        util.write_file(record_fn, json.dumps(
+            {'fingerprint': fingerprint, 'time': int(time.time())}))
 
     def get_primary_arch(self):
         (arch, _err) = util.subp(['dpkg', '--print-architecture'])
         return str(arch).strip()
 
 
+def apt_sources_fingerprint(paths=None):
+    """Return a hash over the contents of the files apt-get update uses.
+
+    Directories in paths contribute each regular file directly in them."""
+    if paths is None:
+        paths = APT_SOURCES_PATHS
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+            files.extend(f for f in names if os.path.isfile(f))
+        else:
+            files.append(path)
+    digest = hashlib.sha256()
+    for path in files:
+        try:
+            with open(path, 'rb') as fp:
+                contents = fp.read()
+        except (IOError, OSError):
+            contents = b''
+            path += " (missing)"
+        digest.update(util.encode_text("%s %d\n" % (path, len(contents))))
+        digest.update(contents)
+    return digest.hexdigest()
+
+
+def apt_update_age(record_fn, fingerprint, lists_dir=None):
+    """Return the seconds since the update recorded in record_fn.
+
+    None is returned if there is no record, it was for other sources or
+    the package lists are gone."""
+    if lists_dir is None:
+        lists_dir = APT_LISTS_DIR
+    try:
+        record = util.load_json(util.load_file(record_fn))
+        if record.get('fingerprint') != fingerprint:
+            return None
+        age = time.time() - record['time']
+    except Exception:
+        return None
+    if age < 0:
+        # the clock went backwards, nothing can be said about the lists
+        return None
+    try:
+        if not [f for f in os.listdir(lists_dir) if '_Packages' in f]:
+            return None
+    except OSError:
+        return None
+    return int(age)
+
+
 def _get_wrapper_prefix(cmd, mode):
     if isinstance(cmd, str):
         cmd = [str(cmd)]
@@ -283,6 +283,19 @@ class Distro(distros.Distro):
             keys = set(kwargs['ssh_authorized_keys']) or []
             ssh_util.setup_user_keys(keys, name, options=None)
 
+    def create_users_groups(self, users, groups):
+        # pw(8) has no batch interface, so set them up one at a time
+        for (name, members) in groups.items():
+            self.create_group(name, members)
+        results = {}
+        for (name, config) in users.items():
+            try:
+                self.create_user(name, **config)
+                results[name] = None
+            except Exception as e:
+                results[name] = e
+        return results
+
     def _write_network(self, settings):
         entries = net_util.translate_network(settings)
         nameservers = []
@@ -383,7 +396,7 @@ class Distro(distros.Distro):
         if len(err):
             LOG.warn("Error running %s: %s", cmd, err)
 
-    def install_packages(self, pkglist):
+    def _install_packages(self, pkglist):
         self.update_package_sources()
         self.package_command('install', pkgs=pkglist)
 
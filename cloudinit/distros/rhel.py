@@ -64,13 +64,13 @@ class Distro(distros.Distro):
         self._net_renderer = sysconfig.Renderer()
         cfg['ssh_svcname'] = 'sshd'
 
-    def install_packages(self, pkglist):
+    def _install_packages(self, pkglist):
         self.package_command('install', pkgs=pkglist)
 
     def _write_network_config(self, netconfig):
         ns = parse_net_config_data(netconfig)
-        self._net_renderer.render_network_state("/", ns)
-        return []
+        changed = self._net_renderer.render_network_state("/", ns)
+        return sorted(changed)
 
     def _write_network(self, settings):
         # TODO(harlowja) fix this... since this is the ubuntu format
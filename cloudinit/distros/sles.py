@@ -50,7 +50,7 @@ class Distro(distros.Distro):
         self._runner = helpers.Runners(paths)
         self.osfamily = 'suse'
 
-    def install_packages(self, pkglist):
+    def _install_packages(self, pkglist):
         self.package_command('install', args='-l', pkgs=pkglist)
 
     def _write_network(self, settings):
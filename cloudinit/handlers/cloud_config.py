@@ -95,7 +95,14 @@ class CloudConfigPartHandler(handlers.Handler):
             lines.append(util.yaml_dumps(self.cloud_buf))
         else:
             lines = []
-        util.write_file(self.cloud_fn, "\n".join(lines), 0o600)
+        content = "\n".join(lines)
+        util.write_file(self.cloud_fn, content, 0o600)
+        # later stages read this back, let them skip the yaml parse
+        if self.cloud_buf is not None:
+            util.write_conf_sidecar(self.cloud_fn, content, self.cloud_buf,
+                                    0o600)
+        else:
+            util.del_file(util.conf_sidecar_path(self.cloud_fn))
 
     def _extract_mergers(self, payload, headers):
         merge_header_headers = ''
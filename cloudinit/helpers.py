@@ -23,6 +23,7 @@
 from time import time
 
 import contextlib
+import json
 import os
 
 import six
@@ -38,6 +39,8 @@ from cloudinit import util
 
 LOG = logging.getLogger(__name__)
 
+SEM_INDEX_FILE = ".index.json"
+
 
 class LockFailure(Exception):
     pass
@@ -129,15 +132,14 @@ class FileSemaphores(object):
             return False
 
         cname = canon_sem_name(name)
-        sem_file = self._get_path(cname, freq)
         # This isn't really a good atomic check
         # but it suffices for where and when cloudinit runs
-        if os.path.exists(sem_file):
+        if self._exists(cname, freq):
             return True
 
         # this case could happen if the migrator module hadn't run yet
         # but the item had run before we did canon_sem_name.
-        if cname != name and os.path.exists(self._get_path(name, freq)):
+        if cname != name and self._exists(name, freq):
             LOG.warn("%s has run without canonicalized name [%s].\n"
                      "likely the migrator has not yet run. "
                      "It will run next boot.\n"
@@ -147,6 +149,9 @@ class FileSemaphores(object):
 
         return False
 
+    def _exists(self, name, freq):
+        return os.path.exists(self._get_path(name, freq))
+
     def _get_path(self, name, freq):
         sem_path = self.sem_path
         if not freq or freq == PER_INSTANCE:
@@ -155,6 +160,136 @@ class FileSemaphores(object):
             return os.path.join(sem_path, "%s.%s" % (name, freq))
 
 
+class IndexSemaphores(FileSemaphores):
+    """Semaphores kept as entries of a single index file in sem_path.
+
+    Entries are named like the marker files of FileSemaphores would be.
+    The index is read once and kept; every check stats it and re-reads it
+    only if another writer replaced it since.  Acquiring or clearing
+    replaces it atomically.  Marker files found in sem_path when the index
+    is first loaded are moved into it.
+    """
+
+    def __init__(self, sem_path):
+        super(IndexSemaphores, self).__init__(sem_path)
+        self.index_fn = os.path.join(sem_path, SEM_INDEX_FILE)
+        self._index = None
+        self._stamp = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.index_fn)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def _load(self):
+        stamp = self._stat()
+        if self._index is not None and stamp == self._stamp:
+            return self._index
+        index = {}
+        if stamp is not None:
+            try:
+                index = json.loads(util.load_file(self.index_fn))
+            except (IOError, OSError, ValueError):
+                util.logexc(LOG, "Failed reading semaphore index %s",
+                            self.index_fn)
+        migrate = []
+        if self._index is None:
+            migrate = self._marker_files()
+        self._index = index
+        self._stamp = stamp
+        if migrate:
+            self._migrate(migrate)
+        return self._index
+
+    def _marker_files(self):
+        try:
+            names = os.listdir(self.sem_path)
+        except OSError:
+            return []
+        # dot files are the index itself and its temporary copies
+        return [n for n in sorted(names) if not n.startswith(".") and
+                os.path.isfile(os.path.join(self.sem_path, n))]
+
+    def _migrate(self, markers):
+        index = dict(self._index)
+        for name in markers:
+            index[name] = util.load_file(
+                os.path.join(self.sem_path, name)).strip()
+        try:
+            self._write(index)
+        except (IOError, OSError):
+            util.logexc(LOG, "Failed writing semaphore index %s",
+                        self.index_fn)
+            self._index = index
+            return
+        for name in markers:
+            util.del_file(os.path.join(self.sem_path, name))
+        LOG.debug("Moved %s semaphore files into %s", len(markers),
+                  self.index_fn)
+
+    def _write(self, index):
+        util.write_file_atomic(
+            self.index_fn, [json.dumps(index, indent=1, sort_keys=True)])
+        self._index = index
+        self._stamp = self._stat()
+
+    def _entry(self, name, freq):
+        return os.path.basename(self._get_path(name, freq))
+
+    def _exists(self, name, freq):
+        # one stat picks up entries another Runners wrote since we loaded
+        return self._entry(name, freq) in self._load()
+
+    def _acquire(self, name, freq):
+        self._load()
+        if self.has_run(name, freq):
+            return None
+        index = dict(self._index)
+        index[self._entry(name, freq)] = "%s: %s" % (os.getpid(), time())
+        try:
+            self._write(index)
+        except (IOError, OSError):
+            util.logexc(LOG, "Failed writing semaphore index %s",
+                        self.index_fn)
+            return None
+        return FileLock(self.index_fn)
+
+    def clear(self, name, freq):
+        name = canon_sem_name(name)
+        index = dict(self._load())
+        if index.pop(self._entry(name, freq), None) is None:
+            return True
+        try:
+            self._write(index)
+        except (IOError, OSError):
+            util.logexc(LOG, "Failed writing semaphore index %s",
+                        self.index_fn)
+            return False
+        return True
+
+    def clear_all(self):
+        super(IndexSemaphores, self).clear_all()
+        self._index = None
+        self._stamp = None
+
+
+SEMAPHORE_BACKENDS = {
+    'files': FileSemaphores,
+    'index': IndexSemaphores,
+}
+
+
+def get_semaphores(paths, sem_path):
+    """The semaphores for sem_path, of the kind paths is configured for."""
+    backend = getattr(paths, 'sem_backend', 'files')
+    if backend not in SEMAPHORE_BACKENDS:
+        LOG.warn("Unknown semaphores type '%s', using 'files'", backend)
+        backend = 'files'
+    return SEMAPHORE_BACKENDS[backend](sem_path)
+
+
 class Runners(object):
     def __init__(self, paths):
         self.paths = paths
@@ -176,7 +311,7 @@ class Runners(object):
         if not sem_path:
             return None
         if sem_path not in self.sems:
-            self.sems[sem_path] = FileSemaphores(sem_path)
+            self.sems[sem_path] = get_semaphores(self.paths, sem_path)
         return self.sems[sem_path]
 
     def run(self, name, functor, args, freq=None, clear_on_fail=False):
@@ -250,7 +385,7 @@ class ConfigMerger(object):
             cc_fn = self._paths.get_ipath_cur(cc_p)
             if cc_fn and os.path.isfile(cc_fn):
                 try:
-                    i_cfgs.append(util.read_conf(cc_fn))
+                    i_cfgs.append(util.read_conf_sidecar(cc_fn))
                 except Exception:
                     util.logexc(LOG, 'Failed loading of cloud-config from %s',
                                 cc_fn)
@@ -332,10 +467,12 @@ class Paths(object):
         self.instance_link = os.path.join(self.cloud_dir, 'instance')
         self.boot_finished = os.path.join(self.instance_link, "boot-finished")
         self.upstart_conf_d = path_cfgs.get('upstart_dir')
+        self.sem_backend = path_cfgs.get('semaphores', 'files')
         self.seed_dir = os.path.join(self.cloud_dir, 'seed')
         # This one isn't joined, since it should just be read-only
         template_dir = path_cfgs.get('templates_dir', '/etc/cloud/templates/')
         self.template_tpl = os.path.join(template_dir, '%s.tmpl')
+        self.template_cache_dir = path_cfgs.get('template_cache_dir')
         self.lookups = {
             "handlers": "handlers",
             "scripts": "scripts",
@@ -351,6 +488,7 @@ class Paths(object):
             "vendordata_raw": "vendor-data.txt",
             "vendordata": "vendor-data.txt.i",
             "instance_id": ".instance-id",
+            "scripts_ledger": "scripts-ledger.jsonl",
         }
         # Set when a datasource becomes active
         self.datasource = ds
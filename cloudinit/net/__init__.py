@@ -27,6 +27,10 @@ LOG = logging.getLogger(__name__)
 SYS_CLASS_NET = "/sys/class/net/"
 DEFAULT_PRIMARY_INTERFACE = 'eth0'
 
+# attribute files of each device that snapshot() reads
+SNAPSHOT_FIELDS = ('address', 'carrier', 'dormant', 'iflink', 'operstate')
+_SNAPSHOT = None
+
 
 def sys_dev_path(devname, path=""):
     return SYS_CLASS_NET + devname + "/" + path
@@ -109,6 +113,71 @@ def is_disabled_cfg(cfg):
     return cfg.get('config') == "disabled"
 
 
+def _read_snapshot_field(path):
+    try:
+        with open(path, "r") as fp:
+            return fp.read().strip()
+    except (IOError, OSError):
+        # carrier and friends fail with EINVAL when a device is down
+        return None
+
+
+def snapshot(refresh=False):
+    """Return {name: info} describing every device in SYS_CLASS_NET.
+
+    Each info dict has the 'name' of the device, the contents of its
+    SNAPSHOT_FIELDS attribute files (None when missing or unreadable) and
+    the booleans 'bridge', 'physical' and 'wireless'.  Each device
+    directory is listed once and only attribute files that exist are
+    opened.  The result is cached for the life of the process (a single
+    cloud-init stage) and must not be modified; pass refresh=True to
+    read sysfs again.
+    """
+    global _SNAPSHOT
+    if _SNAPSHOT is not None and not refresh:
+        return _SNAPSHOT
+    snap = {}
+    try:
+        devs = get_devicelist()
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        devs = []
+    for name in devs:
+        devdir = os.path.join(SYS_CLASS_NET, name)
+        try:
+            entries = set(os.listdir(devdir))
+        except OSError:
+            # device went away while we were looking
+            continue
+        info = {
+            'name': name,
+            'bridge': 'bridge' in entries,
+            'physical': 'device' in entries,
+            'wireless': 'wireless' in entries,
+        }
+        for field in SNAPSHOT_FIELDS:
+            info[field] = None
+            if field in entries:
+                info[field] = _read_snapshot_field(
+                    os.path.join(devdir, field))
+        snap[name] = info
+    _SNAPSHOT = snap
+    return snap
+
+
+def _clear_snapshot():
+    global _SNAPSHOT
+    _SNAPSHOT = None
+
+
+def _snapshot_int(info, field):
+    try:
+        return int(info[field])
+    except (TypeError, ValueError):
+        return None
+
+
 def sys_netdev_info(name, field):
     if not os.path.exists(os.path.join(SYS_CLASS_NET, name)):
         raise OSError("%s: interface does not exist in %s" %
@@ -130,42 +199,30 @@ def generate_fallback_config():
 
     # get list of interfaces that could have connections
     invalid_interfaces = set(['lo'])
-    potential_interfaces = set(get_devicelist())
-    potential_interfaces = potential_interfaces.difference(invalid_interfaces)
+    devices = snapshot()
     # sort into interfaces with carrier, interfaces which could have carrier,
     # and ignore interfaces that are definitely disconnected
     connected = []
     possibly_connected = []
-    for interface in potential_interfaces:
-        if interface.startswith("veth"):
+    for interface, info in devices.items():
+        if interface in invalid_interfaces or interface.startswith("veth"):
             continue
-        if os.path.exists(sys_dev_path(interface, "bridge")):
+        if info['bridge']:
             # skip any bridges
             continue
-        try:
-            carrier = int(sys_netdev_info(interface, 'carrier'))
-            if carrier:
-                connected.append(interface)
-                continue
-        except OSError:
-            pass
+        if _snapshot_int(info, 'carrier'):
+            connected.append(interface)
+            continue
         # check if nic is dormant or down, as this may make a nick appear to
         # not have a carrier even though it could acquire one when brought
         # online by dhclient
-        try:
-            dormant = int(sys_netdev_info(interface, 'dormant'))
-            if dormant:
-                possibly_connected.append(interface)
-                continue
-        except OSError:
-            pass
-        try:
-            operstate = sys_netdev_info(interface, 'operstate')
-            if operstate in ['dormant', 'down', 'lowerlayerdown', 'unknown']:
-                possibly_connected.append(interface)
-                continue
-        except OSError:
-            pass
+        if _snapshot_int(info, 'dormant'):
+            possibly_connected.append(interface)
+            continue
+        if info['operstate'] in ['dormant', 'down', 'lowerlayerdown',
+                                 'unknown']:
+            possibly_connected.append(interface)
+            continue
 
     # don't bother with interfaces that might not be connected if there are
     # some that definitely are
@@ -183,7 +240,7 @@ def generate_fallback_config():
     else:
         name = sorted(potential_interfaces)[0]
 
-    mac = sys_netdev_info(name, 'address')
+    mac = devices[name]['address']
     target_name = name
 
     nconf['config'].append(
@@ -340,6 +397,8 @@ def _rename_interfaces(renames, strict_present=True, strict_busy=True,
                 errors.append(
                     "[unknown] Error performing %s%s for %s, %s: %s" %
                     (op, params, mac, new_name, e))
+        # names in the cached snapshot are no longer accurate
+        _clear_snapshot()
 
     if len(errors):
         raise Exception('\n'.join(errors))
@@ -25,8 +25,7 @@ import sys
 
 import six
 
-from . import get_devicelist
-from . import sys_netdev_info
+from . import snapshot
 
 from cloudinit import util
 
@@ -202,7 +201,6 @@ def read_kernel_cmdline_config(files=None, mac_addrs=None, cmdline=None):
         return None
 
     if mac_addrs is None:
-        mac_addrs = dict((k, sys_netdev_info(k, 'address'))
-                         for k in get_devicelist())
+        mac_addrs = dict((k, v['address']) for k, v in snapshot().items())
 
     return config_from_klibc_net_cfg(files=files, mac_addrs=mac_addrs)
@@ -125,127 +125,211 @@ def _iface_start_entry(iface, index, render_hwaddress=False):
     return lines
 
 
+def _stanzas_by_device(contents):
+    """Group the lines of interfaces(5) contents by the device they affect.
+
+    Returns {device: [lines]} where the 'auto', 'allow-*' and 'iface'
+    lines naming a device and the option lines following its 'iface' line
+    are collected under that device.  Aliases (eth0:1) are grouped with
+    their device.  Used to tell which devices a new rendering changed.
+    """
+    stanzas = {}
+    current = None
+    for line in contents.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        split = line.split()
+        if split[0] == 'iface' and len(split) > 1:
+            current = split[1].partition(":")[0]
+            stanzas.setdefault(current, []).append(line)
+        elif split[0] == 'auto' or split[0].startswith('allow-'):
+            for name in split[1:]:
+                stanzas.setdefault(name.partition(":")[0], []).append(
+                    "%s %s" % (split[0], name))
+        elif split[0] in ('mapping', 'source', 'source-directory'):
+            current = None
+        elif current is not None:
+            stanzas[current].append(line)
+    return stanzas
+
+
+def _tokenize_deb_config(contents):
+    """Yield (line number, tokens) for each statement in interfaces(5) data.
+
+    Comments and blank lines are skipped and lines ending in a backslash
+    are joined with the next one (the line number is the first one's).
+    """
+    pending = []
+    start = None
+    for lineno, line in enumerate(contents.splitlines(), 1):
+        line = line.strip()
+        if not pending and (not line or line.startswith('#')):
+            continue
+        if start is None:
+            start = lineno
+        if line.endswith('\\'):
+            pending.append(line[:-1])
+            continue
+        pending.append(line)
+        tokens = ' '.join(pending).split()
+        if tokens:
+            yield (start, tokens)
+        pending = []
+        start = None
+    if pending:
+        tokens = ' '.join(pending).split()
+        if tokens:
+            yield (start, tokens)
+
+
+def _read_deb_config_source(path):
+    with open(path, "r") as fp:
+        return fp.read().strip()
+
+
+def _deb_config_includes(option, arg, src_dir):
+    """Return the sorted list of files a source/source-directory names."""
+    if not arg.startswith("/"):
+        arg = os.path.join(src_dir or "", arg)
+    if option == "source":
+        return sorted(glob.glob(arg))
+    found = []
+    for expanded_path in glob.glob(arg):
+        for path in os.listdir(expanded_path):
+            full_path = os.path.join(expanded_path, path)
+            if (os.path.isfile(full_path) and
+                    re.match("^[a-zA-Z0-9_-]+$", path) is not None):
+                found.append(full_path)
+    return sorted(found)
+
+
 def _parse_deb_config_data(ifaces, contents, src_dir, src_path):
     """Parses the file contents, placing result into ifaces.
 
     '_source_path' is added to every dictionary entry to define which file
     the configration information came from.
 
+    Files included with 'source' and 'source-directory' are parsed where
+    they are referenced.  A file that (directly or not) includes itself or
+    a malformed statement raises a ParserError naming the file and line.
+
     :param ifaces: interface dictionary
     :param contents: contents of interfaces file
     :param src_dir: directory interfaces file was located
     :param src_path: file path the `contents` was read
     """
+    including = []
+    if src_path:
+        including.append(os.path.realpath(src_path))
+    _parse_deb_config_source(ifaces, contents, src_dir, src_path, including)
+    for iface in ifaces.keys():
+        if 'auto' not in ifaces[iface]:
+            ifaces[iface]['auto'] = False
+
+
+def _parse_deb_config_source(ifaces, contents, src_dir, src_path, including):
+    where = src_path or "<data>"
     currif = None
-    for line in contents.splitlines():
-        line = line.strip()
-        if line.startswith('#'):
-            continue
-        split = line.split(' ')
+    for lineno, split in _tokenize_deb_config(contents):
         option = split[0]
-        if option == "source-directory":
-            parsed_src_dir = split[1]
-            if not parsed_src_dir.startswith("/"):
-                parsed_src_dir = os.path.join(src_dir, parsed_src_dir)
-            for expanded_path in glob.glob(parsed_src_dir):
-                dir_contents = os.listdir(expanded_path)
-                dir_contents = [
-                    os.path.join(expanded_path, path)
-                    for path in dir_contents
-                    if (os.path.isfile(os.path.join(expanded_path, path)) and
-                        re.match("^[a-zA-Z0-9_-]+$", path) is not None)
-                ]
-                for entry in dir_contents:
-                    with open(entry, "r") as fp:
-                        src_data = fp.read().strip()
-                    abs_entry = os.path.abspath(entry)
-                    _parse_deb_config_data(
-                        ifaces, src_data,
-                        os.path.dirname(abs_entry), abs_entry)
-        elif option == "source":
-            new_src_path = split[1]
-            if not new_src_path.startswith("/"):
-                new_src_path = os.path.join(src_dir, new_src_path)
-            for expanded_path in glob.glob(new_src_path):
-                with open(expanded_path, "r") as fp:
-                    src_data = fp.read().strip()
-                abs_path = os.path.abspath(expanded_path)
-                _parse_deb_config_data(
-                    ifaces, src_data,
-                    os.path.dirname(abs_path), abs_path)
-        elif option == "auto":
-            for iface in split[1:]:
-                if iface not in ifaces:
-                    ifaces[iface] = {
-                        # Include the source path this interface was found in.
-                        "_source_path": src_path
-                    }
-                ifaces[iface]['auto'] = True
-        elif option == "iface":
-            iface, family, method = split[1:4]
+        if option in ("source", "source-directory") and len(split) > 1:
+            for path in _deb_config_includes(option, split[1], src_dir):
+                abs_path = os.path.abspath(path)
+                real_path = os.path.realpath(abs_path)
+                if real_path in including:
+                    raise ParserError(
+                        "%s:%s: '%s' is already being parsed, not including"
+                        " it again" % (where, lineno, abs_path))
+                _parse_deb_config_source(
+                    ifaces, _read_deb_config_source(abs_path),
+                    os.path.dirname(abs_path), abs_path,
+                    including + [real_path])
+            continue
+        try:
+            currif = _parse_deb_config_statement(ifaces, currif, split,
+                                                 src_path)
+        except ParserError as e:
+            raise ParserError("%s:%s: %s" % (where, lineno, e))
+        except (IndexError, KeyError, ValueError):
+            raise ParserError("%s:%s: invalid statement '%s'" % (
+                where, lineno, ' '.join(split)))
+
+
+def _parse_deb_config_statement(ifaces, currif, split, src_path):
+    """Apply one tokenized statement to ifaces, return the current iface."""
+    option = split[0]
+    if option == "auto":
+        for iface in split[1:]:
             if iface not in ifaces:
                 ifaces[iface] = {
                     # Include the source path this interface was found in.
                     "_source_path": src_path
                 }
-            elif 'family' in ifaces[iface]:
-                raise ParserError(
-                    "Interface %s can only be defined once. "
-                    "Re-defined in '%s'." % (iface, src_path))
-            ifaces[iface]['family'] = family
-            ifaces[iface]['method'] = method
-            currif = iface
-        elif option == "hwaddress":
-            if split[1] == "ether":
-                val = split[2]
-            else:
-                val = split[1]
-            ifaces[currif]['hwaddress'] = val
-        elif option in NET_CONFIG_OPTIONS:
-            ifaces[currif][option] = split[1]
-        elif option in NET_CONFIG_COMMANDS:
-            if option not in ifaces[currif]:
-                ifaces[currif][option] = []
-            ifaces[currif][option].append(' '.join(split[1:]))
-        elif option.startswith('dns-'):
-            if 'dns' not in ifaces[currif]:
-                ifaces[currif]['dns'] = {}
-            if option == 'dns-search':
-                ifaces[currif]['dns']['search'] = []
-                for domain in split[1:]:
-                    ifaces[currif]['dns']['search'].append(domain)
-            elif option == 'dns-nameservers':
-                ifaces[currif]['dns']['nameservers'] = []
-                for server in split[1:]:
-                    ifaces[currif]['dns']['nameservers'].append(server)
-        elif option.startswith('bridge_'):
-            if 'bridge' not in ifaces[currif]:
-                ifaces[currif]['bridge'] = {}
-            if option in NET_CONFIG_BRIDGE_OPTIONS:
-                bridge_option = option.replace('bridge_', '', 1)
-                ifaces[currif]['bridge'][bridge_option] = split[1]
-            elif option == "bridge_ports":
-                ifaces[currif]['bridge']['ports'] = []
-                for iface in split[1:]:
-                    ifaces[currif]['bridge']['ports'].append(iface)
-            elif option == "bridge_hw" and split[1].lower() == "mac":
-                ifaces[currif]['bridge']['mac'] = split[2]
-            elif option == "bridge_pathcost":
-                if 'pathcost' not in ifaces[currif]['bridge']:
-                    ifaces[currif]['bridge']['pathcost'] = {}
-                ifaces[currif]['bridge']['pathcost'][split[1]] = split[2]
-            elif option == "bridge_portprio":
-                if 'portprio' not in ifaces[currif]['bridge']:
-                    ifaces[currif]['bridge']['portprio'] = {}
-                ifaces[currif]['bridge']['portprio'][split[1]] = split[2]
-        elif option.startswith('bond-'):
-            if 'bond' not in ifaces[currif]:
-                ifaces[currif]['bond'] = {}
-            bond_option = option.replace('bond-', '', 1)
-            ifaces[currif]['bond'][bond_option] = split[1]
-    for iface in ifaces.keys():
-        if 'auto' not in ifaces[iface]:
-            ifaces[iface]['auto'] = False
+            ifaces[iface]['auto'] = True
+    elif option == "iface":
+        iface, family, method = split[1:4]
+        if iface not in ifaces:
+            ifaces[iface] = {
+                # Include the source path this interface was found in.
+                "_source_path": src_path
+            }
+        elif 'family' in ifaces[iface]:
+            raise ParserError(
+                "Interface %s can only be defined once. "
+                "Re-defined in '%s'." % (iface, src_path))
+        ifaces[iface]['family'] = family
+        ifaces[iface]['method'] = method
+        currif = iface
+    elif option == "hwaddress":
+        if split[1] == "ether":
+            val = split[2]
+        else:
+            val = split[1]
+        ifaces[currif]['hwaddress'] = val
+    elif option in NET_CONFIG_OPTIONS:
+        ifaces[currif][option] = split[1]
+    elif option in NET_CONFIG_COMMANDS:
+        if option not in ifaces[currif]:
+            ifaces[currif][option] = []
+        ifaces[currif][option].append(' '.join(split[1:]))
+    elif option.startswith('dns-'):
+        if 'dns' not in ifaces[currif]:
+            ifaces[currif]['dns'] = {}
+        if option == 'dns-search':
+            ifaces[currif]['dns']['search'] = []
+            for domain in split[1:]:
+                ifaces[currif]['dns']['search'].append(domain)
+        elif option == 'dns-nameservers':
+            ifaces[currif]['dns']['nameservers'] = []
+            for server in split[1:]:
+                ifaces[currif]['dns']['nameservers'].append(server)
+    elif option.startswith('bridge_'):
+        if 'bridge' not in ifaces[currif]:
+            ifaces[currif]['bridge'] = {}
+        if option in NET_CONFIG_BRIDGE_OPTIONS:
+            bridge_option = option.replace('bridge_', '', 1)
+            ifaces[currif]['bridge'][bridge_option] = split[1]
+        elif option == "bridge_ports":
+            ifaces[currif]['bridge']['ports'] = []
+            for iface in split[1:]:
+                ifaces[currif]['bridge']['ports'].append(iface)
+        elif option == "bridge_hw" and split[1].lower() == "mac":
+            ifaces[currif]['bridge']['mac'] = split[2]
+        elif option == "bridge_pathcost":
+            if 'pathcost' not in ifaces[currif]['bridge']:
+                ifaces[currif]['bridge']['pathcost'] = {}
+            ifaces[currif]['bridge']['pathcost'][split[1]] = split[2]
+        elif option == "bridge_portprio":
+            if 'portprio' not in ifaces[currif]['bridge']:
+                ifaces[currif]['bridge']['portprio'] = {}
+            ifaces[currif]['bridge']['portprio'][split[1]] = split[2]
+    elif option.startswith('bond-'):
+        if 'bond' not in ifaces[currif]:
+            ifaces[currif]['bond'] = {}
+        bond_option = option.replace('bond-', '', 1)
+        ifaces[currif]['bond'][bond_option] = split[1]
+    return currif
 
 
 def parse_deb_config(path):
@@ -363,6 +447,8 @@ class Renderer(renderer.Renderer):
         return content
 
     def _render_iface(self, iface, render_hwaddress=False):
+        # network state records are read-only, work on a copy of it
+        iface = dict(iface)
         sections = []
         subnets = iface.get('subnets', {})
         if subnets:
@@ -413,9 +499,8 @@ class Renderer(renderer.Renderer):
         # there (as that is the only interface that will be always up).
         lo = {'name': 'lo', 'type': 'physical', 'inet': 'inet',
               'subnets': [{'type': 'loopback', 'control': 'auto'}]}
-        for iface in network_state.iter_interfaces():
-            if iface.get('name') == "lo":
-                lo = copy.deepcopy(iface)
+        if network_state.get_interface('lo') is not None:
+            lo = copy.deepcopy(network_state.get_interface('lo'))
 
         nameservers = network_state.dns_nameservers
         if nameservers:
@@ -452,30 +537,43 @@ class Renderer(renderer.Renderer):
         return '\n\n'.join(['\n'.join(s) for s in sections]) + "\n"
 
     def render_network_state(self, target, network_state):
+        """Render network_state into target, writing only changed files.
+
+        Returns the set of interface names whose stanzas in the rendered
+        interfaces file differ from the ones previously on disk.
+        """
         fpeni = os.path.join(target, self.eni_path)
-        util.ensure_dir(os.path.dirname(fpeni))
         header = self.eni_header if self.eni_header else ""
-        util.write_file(fpeni, header + self._render_interfaces(network_state))
+        content = header + self._render_interfaces(network_state)
+        try:
+            old_content = util.load_file(fpeni)
+        except (IOError, OSError):
+            old_content = ""
+        files = {fpeni: content}
 
         if self.netrules_path:
             netrules = os.path.join(target, self.netrules_path)
-            util.ensure_dir(os.path.dirname(netrules))
-            util.write_file(netrules,
-                            self._render_persistent_net(network_state))
+            files[netrules] = self._render_persistent_net(network_state)
 
         if self.links_path_prefix:
-            self._render_systemd_links(target, network_state,
-                                       links_prefix=self.links_path_prefix)
+            files.update(self._render_systemd_links(
+                target, network_state, links_prefix=self.links_path_prefix))
+
+        if fpeni not in self._write_changed_files(files):
+            return set()
+        old_stanzas = _stanzas_by_device(old_content)
+        return set(dev for (dev, stanza) in
+                   _stanzas_by_device(content).items()
+                   if old_stanzas.get(dev) != stanza)
 
     def _render_systemd_links(self, target, network_state, links_prefix):
+        """Return {path: content} of .link files, removing stale ones."""
         fp_prefix = os.path.join(target, links_prefix)
-        for f in glob.glob(fp_prefix + "*"):
-            os.unlink(f)
-        for iface in network_state.iter_interfaces():
-            if (iface['type'] == 'physical' and 'name' in iface and
-                    iface.get('mac_address')):
+        links = {}
+        for iface in network_state.iter_interfaces_by_type('physical'):
+            if 'name' in iface and iface.get('mac_address'):
                 fname = fp_prefix + iface['name'] + ".link"
-                content = "\n".join([
+                links[fname] = "\n".join([
                     "[Match]",
                     "MACAddress=" + iface['mac_address'],
                     "",
@@ -483,7 +581,10 @@ class Renderer(renderer.Renderer):
                     "Name=" + iface['name'],
                     ""
                 ])
-                util.write_file(fname, content)
+        for f in glob.glob(fp_prefix + "*"):
+            if f not in links:
+                os.unlink(f)
+        return links
 
 
 def network_state_to_eni(network_state, header=None, render_hwaddress=False):
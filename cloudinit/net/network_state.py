@@ -112,18 +112,104 @@ class CommandHandlerMeta(type):
                                                       parents, dct)
 
 
+class _Record(dict):
+    """A dict that can not be modified once it has been created.
+
+    Copies (``copy.copy``, ``copy.deepcopy``, ``dict.copy``) and pickles of a
+    record are plain dicts, so callers that need to tweak an entry can take
+    a copy and change that instead.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'%s' object is read-only" % type(self).__name__)
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict((k, copy.deepcopy(v, memo)) for k, v in self.items())
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class InterfaceRecord(_Record):
+    __slots__ = ()
+
+
+class SubnetRecord(_Record):
+    __slots__ = ()
+
+
+class RouteRecord(_Record):
+    __slots__ = ()
+
+
+def _make_route(route):
+    return RouteRecord((k, copy.deepcopy(v)) for k, v in route.items())
+
+
+def _make_subnet(subnet):
+    contents = {}
+    for k, v in subnet.items():
+        if k == 'routes' and v:
+            contents[k] = [_make_route(r) for r in v]
+        else:
+            contents[k] = copy.deepcopy(v)
+    return SubnetRecord(contents)
+
+
+def _make_interface(iface):
+    contents = {}
+    for k, v in iface.items():
+        if k == 'subnets' and v:
+            contents[k] = [_make_subnet(s) for s in v]
+        else:
+            contents[k] = copy.deepcopy(v)
+    return InterfaceRecord(contents)
+
+
 class NetworkState(object):
+    """Read-only snapshot of a parsed network config.
+
+    Interfaces, subnets and routes are exposed as read-only records and
+    interfaces are indexed by name, type and mac address when the snapshot
+    is taken, so renderers can look them up repeatedly without scanning or
+    copying the whole state again.
+    """
 
     def __init__(self, network_state, version=NETWORK_STATE_VERSION):
-        self._network_state = copy.deepcopy(network_state)
         self._version = version
+        self._interfaces = []
+        self._by_name = {}
+        self._by_type = {}
+        self._by_mac = {}
+        ifaces = network_state.get('interfaces', {})
+        for iface in six.itervalues(ifaces):
+            iface = _make_interface(iface)
+            self._interfaces.append(iface)
+            self._by_name[iface.get('name')] = iface
+            self._by_type.setdefault(iface.get('type'), []).append(iface)
+            if iface.get('mac_address'):
+                self._by_mac.setdefault(iface['mac_address'].lower(),
+                                        []).append(iface)
+        self._routes = [_make_route(r)
+                        for r in network_state.get('routes', [])]
+        dns = network_state.get('dns', {})
+        self._nameservers = list(dns.get('nameservers', []))
+        self._searchdomains = list(dns.get('search', []))
 
     @property
     def version(self):
         return self._version
 
     def iter_routes(self, filter_func=None):
-        for route in self._network_state.get('routes', []):
+        for route in self._routes:
             if filter_func is not None:
                 if filter_func(route):
                     yield route
@@ -132,27 +218,29 @@ class NetworkState(object):
 
     @property
     def dns_nameservers(self):
-        try:
-            return self._network_state['dns']['nameservers']
-        except KeyError:
-            return []
+        return list(self._nameservers)
 
     @property
     def dns_searchdomains(self):
-        try:
-            return self._network_state['dns']['search']
-        except KeyError:
-            return []
+        return list(self._searchdomains)
 
     def iter_interfaces(self, filter_func=None):
-        ifaces = self._network_state.get('interfaces', {})
-        for iface in six.itervalues(ifaces):
+        for iface in self._interfaces:
             if filter_func is None:
                 yield iface
             else:
                 if filter_func(iface):
                     yield iface
 
+    def iter_interfaces_by_type(self, iface_type):
+        return iter(self._by_type.get(iface_type, []))
+
+    def get_interface(self, name):
+        return self._by_name.get(name)
+
+    def get_interfaces_by_mac(self, mac_address):
+        return list(self._by_mac.get(mac_address.lower(), []))
+
 
 @six.add_metaclass(CommandHandlerMeta)
 class NetworkStateInterpreter(object):
@@ -262,7 +350,6 @@ class NetworkStateInterpreter(object):
             'subnets': subnets,
         })
         self._network_state['interfaces'].update({command.get('name'): iface})
-        self.dump_network_state()
 
     @ensure_command_keys(['name', 'vlan_id', 'vlan_link'])
     def handle_vlan(self, command):
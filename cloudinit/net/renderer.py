@@ -16,10 +16,18 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with Curtin.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+import os
+
 import six
 
+from cloudinit import atomic_helper
+from cloudinit import util
+
 from .udev import generate_udev_rule
 
+LOG = logging.getLogger(__name__)
+
 
 def filter_by_type(match_type):
     return lambda iface: match_type == iface['type']
@@ -34,13 +42,38 @@ filter_by_physical = filter_by_type('physical')
 
 class Renderer(object):
 
+    @staticmethod
+    def _write_changed_files(files, mode=0o644):
+        """Write out the {path: content} in files, skipping unchanged ones.
+
+        Each file whose content differs from what is already on disk is
+        replaced atomically (written to a temporary file then renamed).
+        Returns the list of paths that were written.
+        """
+        changed = []
+        for path in sorted(files):
+            content = util.encode_text(files[path])
+            try:
+                current = util.load_file(path, decode=False)
+            except (IOError, OSError):
+                current = None
+            if current == content:
+                continue
+            util.ensure_dir(os.path.dirname(path))
+            with util.SeLinuxGuard(path=path):
+                atomic_helper.write_file(path, content, mode=mode)
+            changed.append(path)
+        LOG.debug("Wrote %s of %s network config files: %s",
+                  len(changed), len(files), changed)
+        return changed
+
     @staticmethod
     def _render_persistent_net(network_state):
         """Given state, emit udev rules to map mac to ifname."""
         # TODO(harlowja): this seems shared between eni renderer and
         # this, so move it to a shared location.
         content = six.StringIO()
-        for iface in network_state.iter_interfaces(filter_by_physical):
+        for iface in network_state.iter_interfaces_by_type('physical'):
             # for physical interfaces write out a persist net udev rule
             if 'name' in iface and iface.get('mac_address'):
                 content.write(generate_udev_rule(iface['name'],
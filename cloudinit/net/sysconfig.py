@@ -285,8 +285,7 @@ class Renderer(renderer.Renderer):
 
     @classmethod
     def _render_physical_interfaces(cls, network_state, iface_contents):
-        physical_filter = renderer.filter_by_physical
-        for iface in network_state.iter_interfaces(physical_filter):
+        for iface in network_state.iter_interfaces_by_type('physical'):
             iface_name = iface['name']
             iface_subnets = iface.get("subnets", [])
             iface_cfg = iface_contents[iface_name]
@@ -303,8 +302,7 @@ class Renderer(renderer.Renderer):
 
     @classmethod
     def _render_bond_interfaces(cls, network_state, iface_contents):
-        bond_filter = renderer.filter_by_type('bond')
-        for iface in network_state.iter_interfaces(bond_filter):
+        for iface in network_state.iter_interfaces_by_type('bond'):
             iface_name = iface['name']
             iface_cfg = iface_contents[iface_name]
             cls._render_bonding_opts(iface_cfg, iface)
@@ -322,8 +320,7 @@ class Renderer(renderer.Renderer):
 
     @staticmethod
     def _render_vlan_interfaces(network_state, iface_contents):
-        vlan_filter = renderer.filter_by_type('vlan')
-        for iface in network_state.iter_interfaces(vlan_filter):
+        for iface in network_state.iter_interfaces_by_type('vlan'):
             iface_name = iface['name']
             iface_cfg = iface_contents[iface_name]
             iface_cfg['VLAN'] = True
@@ -338,12 +335,16 @@ class Renderer(renderer.Renderer):
             content.add_nameserver(nameserver)
         for searchdomain in network_state.dns_searchdomains:
             content.add_search_domain(searchdomain)
-        return "\n".join([_make_header(';'), str(content)])
+        header = _make_header(';')
+        content_str = str(content)
+        # an existing file we rendered already carries the header
+        if not content_str.startswith(header):
+            content_str = "\n".join([header, content_str])
+        return content_str
 
     @classmethod
     def _render_bridge_interfaces(cls, network_state, iface_contents):
-        bridge_filter = renderer.filter_by_type('bridge')
-        for iface in network_state.iter_interfaces(bridge_filter):
+        for iface in network_state.iter_interfaces_by_type('bridge'):
             iface_name = iface['name']
             iface_cfg = iface_contents[iface_name]
             iface_cfg.kind = 'bridge'
@@ -385,16 +386,25 @@ class Renderer(renderer.Renderer):
         return contents
 
     def render_network_state(self, target, network_state):
+        """Render network_state into target, writing only changed files.
+
+        Returns the set of interface names whose ifcfg or route files
+        were changed.
+        """
         base_sysconf_dir = os.path.join(target, self.sysconf_dir)
-        for path, data in self._render_sysconfig(base_sysconf_dir,
-                                                 network_state).items():
-            util.write_file(path, data)
+        files = self._render_sysconfig(base_sysconf_dir, network_state)
+        ifaces_by_path = {}
+        for path in files:
+            # ifcfg-eth0, ifcfg-eth0:1 and route-eth0 all belong to eth0
+            fname = os.path.basename(path)
+            ifaces_by_path[path] = fname.partition("-")[2].partition(":")[0]
         if self.dns_path:
             dns_path = os.path.join(target, self.dns_path)
-            resolv_content = self._render_dns(network_state,
-                                              existing_dns_path=dns_path)
-            util.write_file(dns_path, resolv_content)
+            files[dns_path] = self._render_dns(network_state,
+                                               existing_dns_path=dns_path)
         if self.netrules_path:
-            netrules_content = self._render_persistent_net(network_state)
             netrules_path = os.path.join(target, self.netrules_path)
-            util.write_file(netrules_path, netrules_content)
+            files[netrules_path] = self._render_persistent_net(network_state)
+        changed = self._write_changed_files(files)
+        return set(ifaces_by_path[path] for path in changed
+                   if path in ifaces_by_path)
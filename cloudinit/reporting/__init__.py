@@ -16,24 +16,54 @@ DEFAULT_CONFIG = {
 }
 
 
+# handler name -> (config, handler) for handlers made by update_configuration
+_configured = {}
+
+
+def _unregister_handler(handler_name):
+    handler = instantiated_handler_registry.registered_items.get(
+        handler_name)
+    instantiated_handler_registry.unregister_item(handler_name, force=True)
+    _configured.pop(handler_name, None)
+    if hasattr(handler, 'close'):
+        handler.close()
+
+
 def update_configuration(config):
     """Update the instanciated_handler_registry.
 
     :param config:
         The dictionary containing changes to apply.  If a key is given
         with a False-ish value, the registered handler matching that name
-        will be unregistered.
+        will be unregistered.  A handler whose configuration is the same
+        as before is kept; one that is replaced or unregistered is closed,
+        publishing the events it still holds.
     """
     for handler_name, handler_config in config.items():
         if not handler_config:
-            instantiated_handler_registry.unregister_item(
-                handler_name, force=True)
+            _unregister_handler(handler_name)
+            continue
+        (old_config, old_handler) = _configured.get(handler_name,
+                                                    (None, None))
+        registered = instantiated_handler_registry.registered_items.get(
+            handler_name)
+        if (old_handler is not None and registered is old_handler and
+                old_config == handler_config):
             continue
         handler_config = handler_config.copy()
         cls = available_handlers.registered_items[handler_config.pop('type')]
-        instantiated_handler_registry.unregister_item(handler_name)
+        _unregister_handler(handler_name)
         instance = cls(**handler_config)
         instantiated_handler_registry.register_item(handler_name, instance)
+        handler_config['type'] = config[handler_name]['type']
+        _configured[handler_name] = (handler_config, instance)
+
+
+def flush_events():
+    """Ask every registered handler to publish the events it holds."""
+    for _, handler in instantiated_handler_registry.registered_items.items():
+        if hasattr(handler, 'flush'):
+            handler.flush()
 
 
 instantiated_handler_registry = DictRegistry()
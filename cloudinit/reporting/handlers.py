@@ -1,8 +1,16 @@
 # vi: ts=4 expandtab
 
 import abc
+import collections
+import errno
+import io
 import json
+import os
 import six
+import socket
+import struct
+import threading
+import time
 
 from cloudinit import log as logging
 from cloudinit.registry import DictRegistry
@@ -11,6 +19,12 @@ from cloudinit import (url_helper, util)
 
 LOG = logging.getLogger(__name__)
 
+DEFAULT_JSONL_PATH = "/run/cloud-init/events.jsonl"
+JOURNAL_SOCKET = "/run/systemd/journal/socket"
+
+# python2 has no monotonic clock
+_monotonic = getattr(time, 'monotonic', time.time)
+
 
 @six.add_metaclass(abc.ABCMeta)
 class ReportingHandler(object):
@@ -24,6 +38,17 @@ class ReportingHandler(object):
     def publish_event(self, event):
         """Publish an event."""
 
+    def flush(self):
+        """Ensure ReportingHandler has published all events"""
+        pass
+
+    def close(self):
+        """Publish what is held and release the handler's resources.
+
+        Called when the handler is unregistered or replaced; it is not
+        used again afterwards."""
+        self.flush()
+
 
 class LogHandler(ReportingHandler):
     """Publishes events to the cloud-init log at the ``DEBUG`` log level."""
@@ -85,7 +110,288 @@ class WebHookHandler(ReportingHandler):
             LOG.warn("failed posting event: %s" % event.as_string())
 
 
+class BatchedWebHookHandler(WebHookHandler):
+    """Post events to a webhook in batches from a background thread.
+
+    Events are posted as a json list once ``batch_size`` of them are
+    queued or the oldest has waited ``flush_interval`` seconds.  A failed
+    post is retried with exponential backoff (up to ``max_backoff``
+    seconds) without blocking the publisher.  At most ``max_queue``
+    events are held; while the endpoint is down the oldest are dropped.
+    """
+
+    def __init__(self, endpoint, consumer_key=None, token_key=None,
+                 token_secret=None, consumer_secret=None, timeout=None,
+                 retries=None, batch_size=50, flush_interval=1.0,
+                 max_queue=1000, backoff=1.0, max_backoff=30.0,
+                 flush_timeout=10.0):
+        super(BatchedWebHookHandler, self).__init__(
+            endpoint, consumer_key=consumer_key, token_key=token_key,
+            token_secret=token_secret, consumer_secret=consumer_secret,
+            timeout=timeout, retries=retries)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.max_queue = max(self.batch_size, int(max_queue))
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.flush_timeout = float(flush_timeout)
+        self.dropped = 0
+        # an RLock so a signal handler interrupting publish_event on the
+        # main thread can still flush
+        self._cond = threading.Condition(threading.RLock())
+        self._queue = collections.deque()
+        self._first_queued = None
+        self._posting = 0
+        self._flushing = 0
+        self._closed = False
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run,
+                                            name="reporting-webhook")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def publish_event(self, event):
+        with self._cond:
+            if not self._queue:
+                self._first_queued = time.time()
+            self._queue.append(event.as_dict())
+            self._trim()
+            self._start()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def _trim(self):
+        dropped = len(self._queue) - self.max_queue
+        if dropped <= 0:
+            return
+        if not self.dropped:
+            LOG.warn("reporting endpoint %s is not keeping up, dropping"
+                     " oldest events", self.endpoint)
+        for _ in range(dropped):
+            self._queue.popleft()
+        self.dropped += dropped
+
+    def _post(self, batch):
+        if self.oauth_helper:
+            readurl = self.oauth_helper.readurl
+        else:
+            readurl = url_helper.readurl
+        readurl(self.endpoint, data=json.dumps(batch), timeout=self.timeout,
+                retries=self.retries, ssl_details=self.ssl_details)
+
+    def _next_batch(self):
+        while True:
+            if self._closed:
+                return None
+            if self._queue:
+                if (self._flushing or len(self._queue) >= self.batch_size):
+                    break
+                wait = self._first_queued + self.flush_interval - time.time()
+                if wait <= 0:
+                    break
+            else:
+                wait = None
+            self._cond.wait(wait)
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        self._first_queued = time.time()
+        self._posting += 1
+        return batch
+
+    def _run(self):
+        delay = 0
+        while True:
+            with self._cond:
+                if delay:
+                    self._cond.wait(delay)
+                batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._post(batch)
+                delay = 0
+            except Exception as e:
+                delay = min(self.max_backoff, (delay * 2) or self.backoff)
+                LOG.debug("failed posting %s events to %s, retrying in"
+                          " %ss: %s", len(batch), self.endpoint, delay, e)
+                with self._cond:
+                    self._queue.extendleft(reversed(batch))
+                    self._trim()
+            with self._cond:
+                self._posting -= 1
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait for queued events to be posted.
+
+        Gives up after ``timeout`` (default ``flush_timeout``) seconds,
+        returning False if events are still queued."""
+        if timeout is None:
+            timeout = self.flush_timeout
+        end = time.time() + timeout
+        with self._cond:
+            self._flushing += 1
+            try:
+                self._cond.notify_all()
+                while self._queue or self._posting:
+                    left = end - time.time()
+                    if left <= 0:
+                        LOG.warn("gave up flushing %s events to %s",
+                                 len(self._queue), self.endpoint)
+                        return False
+                    self._cond.wait(left)
+            finally:
+                self._flushing -= 1
+        return True
+
+    def close(self):
+        """Flush, then stop the background thread.
+
+        Events that could not be posted within ``flush_timeout`` are
+        dropped."""
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+
+
+class JsonLinesHandler(ReportingHandler):
+    """Append each event to a file as a line of json.
+
+    Besides the event's own fields each line has ``monotonic`` (a
+    monotonic clock reading taken when the event was published), ``pid``,
+    ``stage`` (the top level event, e.g. ``init-network``) and ``parent``
+    (the name of the enclosing event, or None).  The file is opened once
+    and kept open, line buffered.
+    """
+
+    def __init__(self, path=DEFAULT_JSONL_PATH, mode=0o644):
+        super(JsonLinesHandler, self).__init__()
+        self.path = path
+        self.mode = mode
+        self._fp = None
+        self._pid = None
+
+    def _open(self):
+        pid = os.getpid()
+        if self._fp is not None and self._pid == pid:
+            return self._fp
+        util.ensure_dir(os.path.dirname(self.path))
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     self.mode)
+        # a forked child gets its own descriptor, the parent's stays open
+        self._fp = io.open(fd, 'w', buffering=1, encoding='utf-8')
+        self._pid = pid
+        return self._fp
+
+    def publish_event(self, event):
+        record = event.as_dict()
+        (parent, _sep, _name) = event.name.rpartition('/')
+        record.update({
+            'monotonic': _monotonic(),
+            'pid': os.getpid(),
+            'stage': event.name.split('/', 1)[0],
+            'parent': parent or None,
+        })
+        try:
+            self._open().write(
+                six.text_type(json.dumps(record, sort_keys=True)) + u"\n")
+        except (IOError, OSError) as e:
+            LOG.warn("failed writing event to %s: %s", self.path, e)
+
+    def flush(self):
+        if self._fp is not None and self._pid == os.getpid():
+            self._fp.flush()
+
+    def close(self):
+        if self._fp is not None and self._pid == os.getpid():
+            self._fp.close()
+        self._fp = None
+        self._pid = None
+
+
+class UnixSocketHandler(ReportingHandler):
+    """Send each event as a json datagram to a unix socket.
+
+    Sending never blocks: an event the reader has no room for (or that
+    can not be sent at all, e.g. nothing is listening yet) is dropped and
+    counted in ``dropped``.
+    """
+
+    def __init__(self, path):
+        super(UnixSocketHandler, self).__init__()
+        self.path = path
+        self.dropped = 0
+        self._sock = None
+
+    def _encode(self, event):
+        return json.dumps(event.as_dict(), sort_keys=True).encode('utf-8')
+
+    def publish_event(self, event):
+        data = self._encode(event)
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._sock.setblocking(False)
+            self._sock.sendto(data, self.path)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                if not self.dropped:
+                    LOG.warn("failed sending event to %s: %s", self.path, e)
+            self.dropped += 1
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class JournaldHandler(UnixSocketHandler):
+    """Send events to journald as native journal entries.
+
+    The event's fields are sent as ``CLOUDINIT_*`` journal fields with
+    ``MESSAGE`` set to the event's string form, so they can be matched
+    with e.g. ``journalctl CLOUDINIT_EVENT_TYPE=finish``.
+    """
+
+    def __init__(self, path=JOURNAL_SOCKET, identifier="cloud-init"):
+        super(JournaldHandler, self).__init__(path)
+        self.identifier = identifier
+
+    @staticmethod
+    def _field(name, value):
+        value = six.text_type(value).encode('utf-8')
+        name = name.encode('utf-8')
+        if b'\n' not in value:
+            return name + b'=' + value + b'\n'
+        # values with newlines are sent with their length, little endian
+        return (name + b'\n' + struct.pack('<Q', len(value)) + value +
+                b'\n')
+
+    def _encode(self, event):
+        if getattr(event, 'result', None) in ('WARN', 'FAIL'):
+            priority = 4
+        else:
+            priority = 6
+        fields = [('MESSAGE', event.as_string()), ('PRIORITY', priority),
+                  ('SYSLOG_IDENTIFIER', self.identifier)]
+        for (key, value) in sorted(event.as_dict().items()):
+            if key == 'files':
+                value = json.dumps(value, sort_keys=True)
+            fields.append(('CLOUDINIT_' + key.upper(), value))
+        return b''.join(self._field(k, v) for (k, v) in fields)
+
+
 available_handlers = DictRegistry()
 available_handlers.register_item('log', LogHandler)
 available_handlers.register_item('print', PrintHandler)
 available_handlers.register_item('webhook', WebHookHandler)
+available_handlers.register_item('batched_webhook', BatchedWebHookHandler)
+available_handlers.register_item('jsonl', JsonLinesHandler)
+available_handlers.register_item('unix_socket', UnixSocketHandler)
+available_handlers.register_item('journald', JournaldHandler)
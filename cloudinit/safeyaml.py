@@ -19,14 +19,41 @@
 import yaml
 
 
-class _CustomSafeLoader(yaml.SafeLoader):
+class _CustomConstructors(object):
+    """Constructors shared by the python and the libyaml based loader."""
+
     def construct_python_unicode(self, node):
         return self.construct_scalar(node)
 
-_CustomSafeLoader.add_constructor(
-    u'tag:yaml.org,2002:python/unicode',
-    _CustomSafeLoader.construct_python_unicode)
+    @classmethod
+    def add_custom_constructors(cls):
+        cls.add_constructor(u'tag:yaml.org,2002:python/unicode',
+                            cls.construct_python_unicode)
+
+
+class _CustomSafeLoader(_CustomConstructors, yaml.SafeLoader):
+    pass
+
+_CustomSafeLoader.add_custom_constructors()
+
+
+# The same, parsing with libyaml when pyyaml was built with it; only the
+# scanner and parser are in C, the constructors are shared.
+if getattr(yaml, '__with_libyaml__', False):
+    class _CustomCSafeLoader(_CustomConstructors, yaml.CSafeLoader):
+        pass
+
+    _CustomCSafeLoader.add_custom_constructors()
+else:
+    _CustomCSafeLoader = None
 
 
 def load(blob):
+    if _CustomCSafeLoader is not None:
+        try:
+            return(yaml.load(blob, Loader=_CustomCSafeLoader))
+        except yaml.YAMLError:
+            # libyaml is stricter than the python parser in a few corners,
+            # only give up if that doesn't take it either
+            pass
     return(yaml.load(blob, Loader=_CustomSafeLoader))
@@ -25,6 +25,7 @@ import sys
 from six import StringIO
 
 from cloudinit import log as logging
+from cloudinit import reporting
 from cloudinit import util
 from cloudinit import version as vr
 
@@ -60,6 +61,7 @@ def _handle_exit(signum, frame):
     _pprint_frame(frame, 1, BACK_FRAME_TRACE_DEPTH, contents)
     util.multi_log(contents.getvalue(),
                    console=True, stderr=False, log=LOG)
+    reporting.flush_events()
     sys.exit(rc)
 
 
@@ -185,20 +185,15 @@ class DataSourceAzureNet(sources.DataSource):
 
         found = None
 
-        for cdev in candidates:
-            try:
-                if cdev.startswith("/dev/"):
-                    ret = util.mount_cb(cdev, load_azure_ds_dir)
-                else:
-                    ret = load_azure_ds_dir(cdev)
-
-            except NonAzureDataSource:
+        for (cdev, ret, exc) in util.probe_devices(candidates,
+                                                   probe_azure_ds):
+            if isinstance(exc, NonAzureDataSource):
                 continue
-            except BrokenAzureDataSource as exc:
-                raise exc
-            except util.MountFailedError:
+            elif isinstance(exc, util.MountFailedError):
                 LOG.warn("%s was not mountable", cdev)
                 continue
+            elif exc is not None:
+                raise exc
 
             (md, self.userdata_raw, cfg, files) = ret
             self.seed = cdev
@@ -628,6 +623,12 @@ def list_possible_azure_ds_devs():
     return devlist
 
 
+def probe_azure_ds(cdev, mounted=None):
+    if cdev.startswith("/dev/"):
+        return util.mount_cb(cdev, load_azure_ds_dir, mounted=mounted)
+    return load_azure_ds_dir(cdev)
+
+
 def load_azure_ds_dir(source_dir):
     ovf_file = os.path.join(source_dir, "ovf-env.xml")
 
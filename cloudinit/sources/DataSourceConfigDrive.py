@@ -74,25 +74,22 @@ class DataSourceConfigDrive(openstack.SourceMixin, sources.DataSource):
                 util.logexc(LOG, "Failed reading config drive from %s",
                             self.seed_dir)
         if not found:
-            for dev in find_candidate_devs():
-                try:
-                    # Set mtype if freebsd and turn off sync
-                    if dev.startswith("/dev/cd"):
-                        mtype = "cd9660"
-                        sync = False
-                    else:
-                        mtype = None
-                        sync = True
-                    results = util.mount_cb(dev, read_config_drive,
-                                            mtype=mtype, sync=sync)
-                    found = dev
-                except openstack.NonReadable:
-                    pass
-                except util.MountFailedError:
+            for (dev, ret, exc) in util.probe_devices(find_candidate_devs(),
+                                                      mount_config_drive):
+                if isinstance(exc, openstack.BrokenMetadata):
+                    # raised again so that logexc gets its traceback
+                    try:
+                        raise exc
+                    except openstack.BrokenMetadata:
+                        util.logexc(LOG, "Broken config drive: %s", dev)
+                elif isinstance(exc, (openstack.NonReadable,
+                                      util.MountFailedError)):
                     pass
-                except openstack.BrokenMetadata:
-                    util.logexc(LOG, "Broken config drive: %s", dev)
-                if found:
+                elif exc is not None:
+                    raise exc
+                else:
+                    results = ret
+                    found = dev
                     break
         if not found:
             return False
@@ -180,6 +177,18 @@ def read_config_drive(source_dir):
     raise excps[-1]
 
 
+def mount_config_drive(dev, mounted=None):
+    # Set mtype if freebsd and turn off sync
+    if dev.startswith("/dev/cd"):
+        mtype = "cd9660"
+        sync = False
+    else:
+        mtype = None
+        sync = True
+    return util.mount_cb(dev, read_config_drive, mtype=mtype, sync=sync,
+                         mounted=mounted)
+
+
 def get_previous_iid(paths):
     # interestingly, for this purpose the "previous" instance-id is the current
     # instance-id.  cloud-init hasn't moved them over yet as this datasource
@@ -30,6 +30,9 @@ LOG = logging.getLogger(__name__)
 # See: man sshd_config
 DEF_SSHD_CFG = "/etc/ssh/sshd_config"
 
+# fname -> ((inode, size, mtime), parsed map); see parse_ssh_config_map
+_SSHD_CFG_CACHE = {}
+
 # taken from openssh source key.c/key_type_from_name
 VALID_KEY_TYPES = (
     "rsa", "dsa", "ssh-rsa", "ssh-dss", "ecdsa",
@@ -170,35 +173,31 @@ def parse_authorized_keys(fname):
     return contents
 
 
-def update_authorized_keys(old_entries, keys):
-    to_add = list(keys)
+def _iter_authorized_keys(old_entries, keys):
+    # Existing entries are replaced in place by the last of the new keys
+    # with the same base64, every other new key is added at the end.
+    by_base64 = {}
+    for k in keys:
+        if k.base64:
+            by_base64[k.base64] = k
+
+    replaced = set()
+    for ent in old_entries:
+        if ent.valid() and ent.base64 in by_base64:
+            replaced.add(ent.base64)
+            ent = by_base64[ent.base64]
+        yield str(ent)
+
+    for k in keys:
+        if k.base64 not in replaced:
+            yield str(k)
 
-    for i in range(0, len(old_entries)):
-        ent = old_entries[i]
-        if not ent.valid():
-            continue
-        # Replace those with the same base64
-        for k in keys:
-            if not ent.valid():
-                continue
-            if k.base64 == ent.base64:
-                # Replace it with our better one
-                ent = k
-                # Don't add it later
-                if k in to_add:
-                    to_add.remove(k)
-        old_entries[i] = ent
-
-    # Now append any entries we did not match above
-    for key in to_add:
-        old_entries.append(key)
-
-    # Now format them back to strings...
-    lines = [str(b) for b in old_entries]
 
+def update_authorized_keys(old_entries, keys):
+    keys = list(keys)
     # Ensure it ends with a newline
-    lines.append('')
-    return '\n'.join(lines)
+    return ''.join(line + '\n'
+                   for line in _iter_authorized_keys(old_entries, keys))
 
 
 def users_ssh_info(username):
@@ -303,12 +302,23 @@ def parse_ssh_config(fname):
 
 
 def parse_ssh_config_map(fname):
+    # Setting up keys for many users reads the same sshd_config over and
+    # over, so reuse the last parse for as long as the file is unchanged.
+    try:
+        st = os.stat(fname)
+        stamp = (st.st_ino, st.st_size, st.st_mtime)
+    except OSError:
+        stamp = None
+    cached = _SSHD_CFG_CACHE.get(fname)
+    if stamp is not None and cached and cached[0] == stamp:
+        return dict(cached[1])
+
     lines = parse_ssh_config(fname)
-    if not lines:
-        return {}
     ret = {}
     for line in lines:
         if not line.key:
             continue
         ret[line.key] = line.value
-    return ret
+    if stamp is not None:
+        _SSHD_CFG_CACHE[fname] = (stamp, ret)
+    return dict(ret)
@@ -751,12 +751,39 @@ class Modules(object):
 
     def _run_modules(self, mostly_mods):
         cc = self.init.cloudify()
+        # Package installs the modules ask for are collected so that they
+        # take as few package manager runs as possible.
+        with cc.distro.package_transaction() as txn:
+            (which_ran, failures) = self._run_modules_with(cc, mostly_mods)
+            if txn.requests:
+                rep = events.ReportEventStack(
+                    name="package-transaction", parent=self.reporter,
+                    description="installing queued packages")
+                with rep:
+                    self._flush_packages(cc.distro, failures)
+                    rep.message = txn.summary()
+                LOG.debug("Package transaction: %s", txn.summary())
+        return (which_ran, failures)
+
+    def _flush_packages(self, distro, failures):
+        try:
+            distro.flush_packages()
+        except Exception as e:
+            util.logexc(LOG, "Installing queued packages failed")
+            failures.append(("packages", e))
+
+    def _run_modules_with(self, cc, mostly_mods):
         # Return which ones ran
         # and which ones failed + the exception of why it failed
         failures = []
         which_ran = []
         for (mod, name, freq, args) in mostly_mods:
             try:
+                # Modules that don't take part in the package transaction
+                # may rely on queued packages being installed already
+                if not mod.package_transaction:
+                    self._flush_packages(cc.distro, failures)
+
                 # Try the modules frequency, otherwise fallback to a known one
                 if not freq:
                     freq = mod.frequency
@@ -781,8 +808,14 @@ class Modules(object):
                     name=run_name, description=desc, parent=self.reporter)
 
                 with myrep:
-                    ran, _r = cc.run(run_name, mod.handle, func_args,
-                                     freq=freq)
+                    # let the module attach its own events under this one
+                    cloud_reporter = cc.reporter
+                    cc.reporter = myrep
+                    try:
+                        ran, _r = cc.run(run_name, mod.handle, func_args,
+                                         freq=freq)
+                    finally:
+                        cc.reporter = cloud_reporter
                     if ran:
                         myrep.message = "%s ran successfully" % run_name
                     else:
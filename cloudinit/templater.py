@@ -22,7 +22,8 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import collections
+import hashlib
+import os
 import re
 
 try:
@@ -46,6 +47,59 @@ LOG = logging.getLogger(__name__)
 TYPE_MATCHER = re.compile(r"##\s*template:(.*)", re.I)
 BASIC_MATCHER = re.compile(r'\$\{([A-Za-z0-9_.]+)\}|\$([A-Za-z0-9_.]+)')
 
+# Compiled templates: files by name (with the stat they were read at),
+# strings by the hash of their content.
+_CACHE_MAX = 256
+_FILE_CACHE = {}
+_STRING_CACHE = {}
+
+# Set by set_bytecode_cache_dir, None when jinja bytecode is not kept.
+_JINJA_ENV = None
+_JINJA_SOURCES = {}
+
+
+def _basic_lookup(params, path):
+    selected_params = params
+    for key in path[:-1]:
+        if not isinstance(selected_params, dict):
+            raise TypeError("Can not traverse into"
+                            " non-dictionary '%s' of type %s while"
+                            " looking for subkey '%s'"
+                            % (selected_params,
+                               tu.obj_name(selected_params),
+                               key))
+        selected_params = selected_params[key]
+    key = path[-1]
+    if not isinstance(selected_params, dict):
+        raise TypeError("Can not extract key '%s' from non-dictionary"
+                        " '%s' of type %s"
+                        % (key, selected_params,
+                           tu.obj_name(selected_params)))
+    return str(selected_params[key])
+
+
+def _compile_basic(content):
+    # split() gives the text before each match followed by the match's
+    # two groups (only one of which is set), then the text after the last.
+    pieces = BASIC_MATCHER.split(content)
+    plan = []
+    for i in range(0, len(pieces) - 1, 3):
+        name = pieces[i + 1]
+        if name is None:
+            name = pieces[i + 2]
+        plan.append((pieces[i], tuple(name.split("."))))
+    tail = pieces[-1]
+
+    def render(params):
+        out = []
+        for (text, path) in plan:
+            out.append(text)
+            out.append(_basic_lookup(params, path))
+        out.append(tail)
+        return "".join(out)
+
+    return render
+
 
 def basic_render(content, params):
     """This does simple replacement of bash variable like templates.
@@ -54,35 +108,7 @@ def basic_render(content, params):
     ${a.b} or $a.b which will look for a key 'b' in the dictionary rooted
     by key 'a'.
     """
-
-    def replacer(match):
-        # Only 1 of the 2 groups will actually have a valid entry.
-        name = match.group(1)
-        if name is None:
-            name = match.group(2)
-        if name is None:
-            raise RuntimeError("Match encountered but no valid group present")
-        path = collections.deque(name.split("."))
-        selected_params = params
-        while len(path) > 1:
-            key = path.popleft()
-            if not isinstance(selected_params, dict):
-                raise TypeError("Can not traverse into"
-                                " non-dictionary '%s' of type %s while"
-                                " looking for subkey '%s'"
-                                % (selected_params,
-                                   tu.obj_name(selected_params),
-                                   key))
-            selected_params = selected_params[key]
-        key = path.popleft()
-        if not isinstance(selected_params, dict):
-            raise TypeError("Can not extract key '%s' from non-dictionary"
-                            " '%s' of type %s"
-                            % (key, selected_params,
-                               tu.obj_name(selected_params)))
-        return str(selected_params[key])
-
-    return BASIC_MATCHER.sub(replacer, content)
+    return _compile_basic(content)(params)
 
 
 def detect_template(text):
@@ -130,12 +156,98 @@ def detect_template(text):
         return ('basic', basic_render, rest)
 
 
+def set_bytecode_cache_dir(path):
+    """Keep compiled jinja templates in path (None to stop).
+
+    The bytecode is loaded and run as python, so path must only be
+    writable by root."""
+    global _JINJA_ENV
+    _FILE_CACHE.clear()
+    _STRING_CACHE.clear()
+    _JINJA_SOURCES.clear()
+    if not path or not JINJA_AVAILABLE:
+        _JINJA_ENV = None
+        return
+    try:
+        util.ensure_dir(path, mode=0o700)
+    except (IOError, OSError):
+        util.logexc(LOG, "Failed creating template cache dir %s", path)
+        _JINJA_ENV = None
+        return
+    _JINJA_ENV = jinja2.Environment(
+        loader=jinja2.DictLoader(_JINJA_SOURCES),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(path),
+        undefined=jinja2.StrictUndefined, trim_blocks=True, cache_size=0)
+
+
+def _compile_jinja(content):
+    if _JINJA_ENV is None:
+        template = JTemplate(content, undefined=jinja2.StrictUndefined,
+                             trim_blocks=True)
+    else:
+        # the bytecode cache is keyed by template name and checks the
+        # source's checksum, naming by content keeps it valid across runs
+        name = hashlib.sha256(util.encode_text(content)).hexdigest()
+        _JINJA_SOURCES[name] = content
+        try:
+            template = _JINJA_ENV.get_template(name)
+        finally:
+            del _JINJA_SOURCES[name]
+    # keep_trailing_newline is in jinja2 2.7+, not 2.6
+    add = "\n" if content.endswith("\n") else ""
+
+    def render(params):
+        return template.render(**params) + add
+
+    return render
+
+
+def _compile_cheetah(content):
+    klass = CTemplate.compile(source=content)
+
+    def render(params):
+        return klass(searchList=[params]).respond()
+
+    return render
+
+
+def _compile(text):
+    """Detect the type of template text and compile it.
+
+    Returns the template type and a function rendering the template with
+    the params it is given."""
+    template_type, _renderer, content = detect_template(text)
+    if template_type == 'jinja':
+        return (template_type, _compile_jinja(content))
+    elif template_type == 'cheetah':
+        return (template_type, _compile_cheetah(content))
+    return (template_type, _compile_basic(content))
+
+
+def _cache_put(cache, key, value):
+    if len(cache) >= _CACHE_MAX:
+        cache.clear()
+    cache[key] = value
+
+
 def render_from_file(fn, params):
     if not params:
         params = {}
-    template_type, renderer, content = detect_template(util.load_file(fn))
+    try:
+        st = os.stat(fn)
+        stamp = (st.st_mtime, st.st_size, st.st_ino)
+    except OSError:
+        # leave it to load_file to complain
+        stamp = None
+    cached = _FILE_CACHE.get(fn)
+    if stamp and cached and cached[0] == stamp:
+        template_type, render = cached[1]
+    else:
+        template_type, render = _compile(util.load_file(fn))
+        if stamp:
+            _cache_put(_FILE_CACHE, fn, (stamp, (template_type, render)))
     LOG.debug("Rendering content of '%s' using renderer %s", fn, template_type)
-    return renderer(content, params)
+    return render(params)
 
 
 def render_to_file(fn, outfn, params, mode=0o644):
@@ -151,5 +263,9 @@ def render_string_to_file(content, outfn, params, mode=0o644):
 def render_string(content, params):
     if not params:
         params = {}
-    template_type, renderer, content = detect_template(content)
-    return renderer(content, params)
+    key = hashlib.sha256(util.encode_text(content)).hexdigest()
+    compiled = _STRING_CACHE.get(key)
+    if compiled is None:
+        compiled = _compile(content)
+        _cache_put(_STRING_CACHE, key, compiled)
+    return compiled[1](params)
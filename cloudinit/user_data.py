@@ -174,10 +174,13 @@ class UserDataProcessor(object):
         if msg.get_content_type() in EXAMINE_FOR_LAUNCH_INDEX:
             try:
                 # See if it has a launch-index field
-                # that might affect the final header
-                payload = util.load_yaml(msg.get_payload(decode=True))
-                if payload:
-                    payload_idx = payload.get('launch-index')
+                # that might affect the final header, the part handler
+                # parses it anyway so don't unless it might
+                payload = msg.get_payload(decode=True)
+                if b'launch-index' in payload:
+                    payload = util.load_yaml(payload)
+                    if payload:
+                        payload_idx = payload.get('launch-index')
             except Exception:
                 pass
         # Header overrides contents, for now (?) or the other way around?
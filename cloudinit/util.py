@@ -29,6 +29,7 @@ import glob
 import grp
 import gzip
 import hashlib
+import io
 import json
 import os
 import os.path
@@ -43,6 +44,7 @@ import string
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
 from base64 import b64decode, b64encode
@@ -424,6 +426,53 @@ def read_conf(fname):
             raise
 
 
+def conf_sidecar_path(fname):
+    """Return where write_conf_sidecar keeps the json copy of fname."""
+    return os.path.splitext(fname)[0] + ".json"
+
+
+def write_conf_sidecar(fname, content, cfg, mode=0o644):
+    """
+    Store cfg, the parsed form of the yaml content written to fname, as
+    json next to fname so read_conf_sidecar can skip parsing the yaml.
+
+    Nothing is stored if cfg does not come back the same from json (for
+    example non-string keys, dates or binary values).
+    """
+    sidecar = conf_sidecar_path(fname)
+    try:
+        blob = json.dumps({'sha256': hash_blob(content, 'sha256'),
+                           'config': cfg})
+        if json.loads(blob)['config'] != cfg:
+            raise ValueError("config changed by json")
+    except (TypeError, ValueError) as e:
+        LOG.debug("Not writing %s: %s", sidecar, e)
+        del_file(sidecar)
+        return
+    write_file(sidecar, blob, mode)
+
+
+def read_conf_sidecar(fname):
+    """
+    Like read_conf, but return the config stored by write_conf_sidecar
+    instead when it was stored for the current content of fname.
+    """
+    try:
+        content = load_file(fname)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return {}
+        raise
+    try:
+        sidecar = json.loads(load_file(conf_sidecar_path(fname)))
+        if (sidecar['sha256'] == hash_blob(content, 'sha256') and
+                isinstance(sidecar['config'], dict)):
+            return sidecar['config']
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+    return load_yaml(content, default={})
+
+
 # Merges X lists, and then keeps the
 # unique ones, but orders by sort order
 # instead of by the original order
@@ -769,7 +818,179 @@ def del_dir(path):
     shutil.rmtree(path)
 
 
-def runparts(dirp, skip_no_exist=True, exe_prefix=None):
+# scripts named like '10-foo' and '10_bar' share the group '10'
+RUNPARTS_GROUP_RE = re.compile(r'^(\d+)[-_.]')
+
+
+def runparts_groups(exe_paths):
+    """
+    Split exe_paths into consecutive runs of scripts whose names start
+    with the same number; scripts without one are a group of their own.
+    """
+    groups = []
+    last = None
+    for exe_path in exe_paths:
+        match = RUNPARTS_GROUP_RE.match(os.path.basename(exe_path))
+        key = match.group(1) if match else None
+        if not groups or key is None or key != last:
+            groups.append([])
+        groups[-1].append(exe_path)
+        last = key
+    return groups
+
+
+# only this much of each output stream of a script is copied to the log
+RUNPARTS_LOG_MAX = 64 * 1024
+# only this much of each output stream of a script run concurrently is held
+# back to be written out in one piece, the rest is passed on as it comes
+# (a script run on its own has all its output passed on as it comes)
+RUNPARTS_HOLD_MAX = 1024 * 1024
+# how long to wait for the output of a script that has exited to end, in
+# case something it left running in the background still holds it open
+RUNPARTS_EOF_WAIT = 1.0
+
+
+class _PartOutput(object):
+    """
+    One output stream of a script run by runparts.
+
+    The script writes to a pipe that a thread drains, counting the bytes
+    and copying lines to the log up to RUNPARTS_LOG_MAX bytes.  With hold
+    (for scripts run concurrently) the output is kept in memory, so that
+    release() can write the output of each script out in one piece; no
+    more than RUNPARTS_HOLD_MAX bytes are held back.  Past that, after
+    release() and without hold, output is passed straight on to stream.
+    """
+
+    def __init__(self, name, stream, hold=True):
+        (self._reader, self.writer) = os.pipe()
+        self.name = name
+        self.stream = stream
+        self.size = 0
+        self.logged = 0
+        self.partial = b''
+        self.held = []
+        self.held_size = 0
+        self.released = not hold
+        self.lock = threading.Lock()
+        self.eof = threading.Event()
+        thread = threading.Thread(target=self._drain)
+        thread.daemon = True
+        thread.start()
+
+    def _drain(self):
+        while True:
+            data = os.read(self._reader, 65536)
+            if not data:
+                break
+            with self.lock:
+                self.size += len(data)
+                lines = (self.partial + data).split(b'\n')
+                self.partial = lines.pop()
+                for line in lines:
+                    self._log(line)
+                self.held.append(data)
+                self.held_size += len(data)
+                if self.released or self.held_size > RUNPARTS_HOLD_MAX:
+                    self._write_held()
+        with self.lock:
+            if self.partial:
+                self._log(self.partial)
+                self.partial = b''
+        os.close(self._reader)
+        self.eof.set()
+
+    def _write_held(self):
+        if self.held:
+            data = b''.join(self.held)
+            if hasattr(self.stream, 'buffer'):
+                self.stream.buffer.write(data)
+            elif isinstance(self.stream, io.TextIOBase):
+                # e.g. a StringIO put in place of sys.stdout
+                self.stream.write(data.decode('utf-8', 'replace'))
+            else:
+                self.stream.write(data)
+            self.stream.flush()
+        self.held = []
+        self.held_size = 0
+
+    def _log(self, line):
+        if self.logged >= RUNPARTS_LOG_MAX:
+            return
+        line = line[:RUNPARTS_LOG_MAX - self.logged]
+        self.logged += len(line) + 1
+        LOG.debug("%s: %s", self.name, line.decode('utf-8', 'replace'))
+        if self.logged >= RUNPARTS_LOG_MAX:
+            LOG.debug("%s: not logging more than %s bytes of output",
+                      self.name, RUNPARTS_LOG_MAX)
+
+    def release(self):
+        """Write out what was held back and pass on anything after it."""
+        with self.lock:
+            self._write_held()
+            self.released = True
+
+
+def _runpart(cmd, hold=False):
+    """
+    Run one script for runparts, returning (record, error, outputs).
+
+    The script's stdout and stderr go through a _PartOutput each, which
+    outputs holds.  With hold their output is held back until they are
+    released, once the script's turn comes.
+    """
+    start = time.time()
+    error = None
+    exit_code = 0
+    name = os.path.basename(cmd[-1])
+    outs = (_PartOutput(name, sys.stdout, hold),
+            _PartOutput(name, sys.stderr, hold))
+    try:
+        LOG.debug("Running command %s", cmd)
+        try:
+            with open(os.devnull) as devnull:
+                # close_fds keeps the other scripts' pipes out
+                proc = subprocess.Popen(cmd, stdin=devnull,
+                                        stdout=outs[0].writer,
+                                        stderr=outs[1].writer,
+                                        close_fds=True)
+        except OSError as e:
+            raise ProcessExecutionError(cmd=cmd, reason=e, errno=e.errno)
+        finally:
+            for out in outs:
+                os.close(out.writer)
+        exit_code = proc.wait()
+        if exit_code != 0:
+            raise ProcessExecutionError(cmd=cmd, exit_code=exit_code)
+    except ProcessExecutionError as e:
+        exit_code = e.exit_code if e.exit_code != '-' else None
+        error = e
+    end = time.time()
+    deadline = end + RUNPARTS_EOF_WAIT
+    for out in outs:
+        out.eof.wait(max(0, deadline - time.time()))
+    record = {'script': cmd[-1], 'start': start, 'end': end,
+              'duration': round(end - start, 3), 'exit_code': exit_code,
+              'stdout_bytes': outs[0].size, 'stderr_bytes': outs[1].size}
+    return (record, error, outs)
+
+
+def runparts(dirp, skip_no_exist=True, exe_prefix=None, max_workers=1,
+             ledger=None, reporter=None):
+    """
+    Run the executables in dirp in sorted order.
+
+    With max_workers above 1 the scripts of a group (see runparts_groups)
+    run concurrently on up to max_workers threads; groups still run one
+    after the other.  The output of every script is counted and copied to
+    the log (see _PartOutput).  A script run on its own has its output
+    passed on as it comes; that of concurrently run scripts is written out
+    a script at a time once its group is done.
+
+    Start, end, duration, exit code and output sizes of each script are
+    appended as a json line to the file ledger, if given, and a child
+    event of reporter is reported for each script, if given.
+    """
     if skip_no_exist and not os.path.isdir(dirp):
         return
 
@@ -789,11 +1010,52 @@ def runparts(dirp, skip_no_exist=True, exe_prefix=None):
         exe_path = os.path.join(dirp, exe_name)
         if os.path.isfile(exe_path) and os.access(exe_path, os.X_OK):
             attempted.append(exe_path)
-            try:
-                subp(prefix + [exe_path], capture=False)
-            except ProcessExecutionError as e:
-                logexc(LOG, "Failed running %s [%s]", exe_path, e.exit_code)
-                failed.append(e)
+
+    if max_workers > 1:
+        groups = runparts_groups(attempted)
+    else:
+        groups = [[exe_path] for exe_path in attempted]
+
+    def run(exe_path, hold=False):
+        if reporter is None:
+            return _runpart(prefix + [exe_path], hold)
+        # the reporting handlers import util, so this can't be done above
+        from cloudinit.reporting import events
+        with events.ReportEventStack(
+                name="script-%s" % os.path.basename(exe_path),
+                description="running %s" % exe_path,
+                parent=reporter) as rep:
+            result = _runpart(prefix + [exe_path], hold)
+            record = result[0]
+            rep.message = ("%s exited %s after %0.3f seconds" %
+                           (exe_path, record['exit_code'],
+                            record['duration']))
+            if result[1]:
+                rep.result = events.status.FAIL
+        return result
+
+    for group in groups:
+        if len(group) == 1:
+            results = [(run(group[0]), None)]
+        else:
+            LOG.debug("Running %s concurrently", group)
+            results = parallel_map(
+                lambda exe_path: run(exe_path, hold=True),
+                group, max_workers=max_workers)
+        for (exe_path, (result, exc)) in zip(group, results):
+            if exc is not None:
+                raise exc
+            (record, error, outs) = result
+            for out in outs:
+                out.release()
+            if error:
+                logexc(LOG, "Failed running %s [%s]", exe_path,
+                       error.exit_code)
+                failed.append(error)
+            LOG.debug("Ran %s in %0.3f seconds", exe_path,
+                      record['duration'])
+            if ledger:
+                append_file(ledger, json.dumps(record, sort_keys=True) + "\n")
 
     if failed and attempted:
         raise RuntimeError('Runparts: %s failures in %s attempted commands'
@@ -1450,6 +1712,15 @@ def is_group(name):
         return False
 
 
+def get_user_names():
+    return [p.pw_name for p in pwd.getpwall()]
+
+
+def get_group_members():
+    """Return a dict mapping every group name to the set of its members."""
+    return dict((g.gr_name, set(g.gr_mem)) for g in grp.getgrall())
+
+
 def rename(src, dest):
     LOG.debug("Renaming %s to %s", src, dest)
     # TODO(harlowja) use a se guard here??
@@ -1550,7 +1821,8 @@ def mounts():
     return mounted
 
 
-def mount_cb(device, callback, data=None, rw=False, mtype=None, sync=True):
+def mount_cb(device, callback, data=None, rw=False, mtype=None, sync=True,
+             mounted=None):
     """
     Mount the device, call method 'callback' passing the directory
     in which it was mounted, then unmount.  Return whatever 'callback'
@@ -1558,6 +1830,9 @@ def mount_cb(device, callback, data=None, rw=False, mtype=None, sync=True):
 
     mtype is a filesystem type.  it may be a list, string (a single fsname)
     or a list of fsnames.
+
+    mounted is an already read mount table (as returned by mounts()); when
+    not given the table is read on each call.
     """
 
     if isinstance(mtype, str):
@@ -1582,7 +1857,8 @@ def mount_cb(device, callback, data=None, rw=False, mtype=None, sync=True):
         # we cannot do a smart "auto", so just call 'mount' once with no -t
         mtypes = ['']
 
-    mounted = mounts()
+    if mounted is None:
+        mounted = mounts()
     with tempdir() as tmpd:
         umount = False
         if os.path.realpath(device) in mounted:
@@ -1631,6 +1907,82 @@ def mount_cb(device, callback, data=None, rw=False, mtype=None, sync=True):
             return ret
 
 
+def probe_devices(devices, callback, max_workers=4):
+    """
+    Call callback(device, mounted) for each entry in devices, running up to
+    max_workers of them concurrently, and yield (device, result, exception)
+    tuples in the same order as devices.
+
+    'mounted' is the mount table, read once for the whole scan so that
+    callbacks can hand it to mount_cb.  Only max_workers devices are ever
+    probed ahead of the consumer; when the consumer stops iterating the
+    probes already started are waited for (so that nothing is left mounted)
+    and no further ones are started.
+    """
+    devices = list(devices)
+    mounted = mounts()
+    results = [None] * len(devices)
+
+    def probe(index):
+        device = devices[index]
+        try:
+            results[index] = (device, callback(device, mounted), None)
+        except Exception as e:
+            results[index] = (device, None, e)
+
+    threads = []
+
+    def start(index):
+        if index < len(devices):
+            thread = threading.Thread(target=probe, args=(index,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+    try:
+        for index in range(min(max(1, max_workers), len(devices))):
+            start(index)
+        for index in range(len(devices)):
+            threads[index].join()
+            yield results[index]
+            start(len(threads))
+    finally:
+        for thread in threads:
+            thread.join()
+
+
+def parallel_map(func, items, max_workers=4):
+    """
+    Call func(item) for each entry in items using up to max_workers
+    threads and return a list of (result, exception) tuples in the same
+    order as items; exception is None when func returned normally.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next(pending, None)
+            if index is None:
+                return
+            try:
+                results[index] = (func(items[index]), None)
+            except Exception as e:
+                results[index] = (None, e)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(max(1, max_workers), len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
 def get_builtin_cfg():
     # Deep copy so that others can't modify
     return obj_copy.deepcopy(CFG_BUILTIN)
@@ -1744,6 +2096,59 @@ def write_file(filename, content, mode=0o644, omode="wb"):
     chmod(filename, mode)
 
 
+def write_file_atomic(filename, chunks, mode=0o644, uid=None, gid=None):
+    """
+    Replaces a file with the given content in one step, so that nothing
+    ever sees it partially written or with the wrong mode or owner.
+
+    The content is streamed into a temporary file next to the target and
+    synced to disk, then the file gets its mode and owner set and is
+    renamed into place. If filename is a symlink, the file it points to is
+    the one replaced. The directory holding the file is not synced, see
+    fsync_dir.
+
+    @param filename: The full path of the file to write.
+    @param chunks: An iterable of the strings or bytes to write.
+    @param mode: The filesystem mode to set on the file.
+    @param uid: The numeric user id to give the file, None to leave it.
+    @param gid: The numeric group id to give the file, None to leave it.
+    @return: The path of the file that was actually written.
+    """
+    filename = os.path.realpath(filename)
+    dirname = os.path.dirname(filename)
+    ensure_dir(dirname)
+    (fd, tmpname) = tempfile.mkstemp(
+        dir=dirname, prefix=".%s." % os.path.basename(filename))
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            for chunk in chunks:
+                chunk = encode_text(chunk)
+                fh.write(chunk)
+                size += len(chunk)
+            # without this a crash could leave the rename but not the data
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.chmod(tmpname, mode)
+        chownbyid(tmpname, uid, gid)
+        with SeLinuxGuard(path=filename):
+            os.rename(tmpname, filename)
+    except Exception:
+        del_file(tmpname)
+        raise
+    LOG.debug("Wrote %s - [%s] %s bytes", filename, mode, size)
+    return filename
+
+
+def fsync_dir(path):
+    """Flush the entries of directory path (e.g. new or renamed files)."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def delete_dir_contents(dirname):
     """
     Deletes all contents of a directory without deleting the directory itself.
@@ -146,6 +146,8 @@ class FilesystemMockingTestCase(ResourceUsingTestCase):
     def patchUtils(self, new_root):
         patch_funcs = {
             util: [('write_file', 1),
+                   ('write_file_atomic', 1),
+                   ('fsync_dir', 1),
                    ('append_file', 1),
                    ('load_file', 1),
                    ('ensure_dir', 1),
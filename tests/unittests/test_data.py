@@ -110,6 +110,24 @@ class TestConsumeUserData(helpers.FilesystemMockingTestCase):
         self.assertEqual('qux', cc['baz'])
         self.assertEqual('qux2', cc['bar'])
 
+    def test_cloud_config_json_sidecar(self):
+        blob = "#cloud-config\nruncmd: [ls]\nlocale: en_US.UTF-8\n"
+        ci = stages.Init()
+        ci.datasource = FakeDataSource(blob)
+        new_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, new_root)
+        self.patchUtils(new_root)
+        self.patchOS(new_root)
+        ci.fetch()
+        ci.consume_data()
+        cc_fn = ci.paths.get_ipath("cloud_config")
+        expected = {'runcmd': ['ls'], 'locale': 'en_US.UTF-8'}
+        self.assertEqual(expected, util.read_conf(cc_fn))
+        self.assertTrue(os.path.exists(util.conf_sidecar_path(cc_fn)))
+        with mock.patch.object(util, 'load_yaml') as m_load:
+            self.assertEqual(expected, util.read_conf_sidecar(cc_fn))
+        self.assertEqual(0, m_load.call_count)
+
     def test_simple_jsonp_vendor_and_user(self):
         # test that user-data wins over vendor
         user_blob = '''
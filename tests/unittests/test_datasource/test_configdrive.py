@@ -3,6 +3,7 @@ import json
 import os
 import shutil
 import six
+import sys
 import tempfile
 
 from cloudinit import helpers
@@ -464,6 +465,34 @@ class TestConfigDriveDataSource(TestCase):
             util.find_devs_with = orig_find_devs_with
             util.is_partition = orig_is_partition
 
+    def test_broken_device_logged_with_traceback(self):
+        populate_dir(self.tmp, CFG_DRIVE_FILES_V2)
+        broken = openstack.BrokenMetadata("bad json")
+        logged = []
+
+        def probe_devices(devices, callback):
+            yield ('/dev/vdb', None, broken)
+            yield ('/dev/vdc', ds.read_config_drive(self.tmp), None)
+
+        cfg_ds = ds.DataSourceConfigDrive(
+            settings.CFG_BUILTIN, None,
+            helpers.Paths({'cloud_dir': self.tmp,
+                           'seed_dir': os.path.join(self.tmp, 'nope')}))
+        with ExitStack() as mocks:
+            mocks.enter_context(mock.patch.object(
+                ds, 'find_candidate_devs', return_value=['/dev/vdb']))
+            mocks.enter_context(mock.patch.object(
+                ds.util, 'probe_devices', side_effect=probe_devices))
+            mocks.enter_context(mock.patch.object(ds, 'on_first_boot'))
+            m_logexc = mocks.enter_context(mock.patch.object(
+                ds.util, 'logexc',
+                side_effect=lambda *a: logged.append(sys.exc_info()[1])))
+            self.assertTrue(cfg_ds.get_data())
+        m_logexc.assert_called_once_with(
+            ds.LOG, "Broken config drive: %s", '/dev/vdb')
+        self.assertEqual([broken], logged)
+        self.assertEqual('/dev/vdc', cfg_ds.source)
+
     @mock.patch('cloudinit.sources.DataSourceConfigDrive.on_first_boot')
     def test_pubkeys_v2(self, on_first_boot):
         """Verify that public-keys work in config-drive-v2."""
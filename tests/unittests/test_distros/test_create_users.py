@@ -0,0 +1,114 @@
+from cloudinit import distros
+from cloudinit import util
+
+from .. import helpers
+
+import os
+import shutil
+import tempfile
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestCreateUsersGroups(helpers.FilesystemMockingTestCase):
+
+    def setUp(self):
+        super(TestCreateUsersGroups, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        os.makedirs(os.path.join(self.tmp, "etc", "sudoers.d"))
+        cls = distros.fetch("ubuntu")
+        self.distro = cls("ubuntu", {}, None)
+        self.subp_calls = []
+
+    def _create(self, users, groups, known_users=(), known_groups=None,
+                fail_cmd=None, fail_data=None):
+        def fake_subp(cmd, data=None, **kwargs):
+            self.subp_calls.append((cmd, data))
+            if cmd[:len(fail_cmd or [])] == fail_cmd:
+                if fail_data is None or fail_data in (data or ""):
+                    raise util.ProcessExecutionError(exit_code=9)
+            return ("", "")
+
+        self.patchOS(self.tmp)
+        self.patchUtils(self.tmp)
+        with mock.patch.multiple(
+                util, subp=mock.DEFAULT, system_is_snappy=mock.DEFAULT,
+                get_user_names=mock.DEFAULT,
+                get_group_members=mock.DEFAULT) as mocks:
+            mocks['subp'].side_effect = fake_subp
+            mocks['system_is_snappy'].return_value = False
+            mocks['get_user_names'].return_value = list(known_users)
+            mocks['get_group_members'].return_value = dict(
+                known_groups or {})
+            with mock.patch.object(distros.ssh_util,
+                                   'setup_user_keys') as m_keys:
+                results = self.distro.create_users_groups(users, groups)
+                self.m_keys = m_keys
+        return results
+
+    def _commands(self, name):
+        return [c for (c, _d) in self.subp_calls if c[0] == name]
+
+    def test_batches_passwords_and_sudo_rules(self):
+        users = {}
+        for i in range(5):
+            users['svc%d' % i] = {'plain_text_passwd': 'pw%d' % i,
+                                  'sudo': 'ALL=(ALL) NOPASSWD:ALL'}
+        results = self._create(users, {})
+        self.assertEqual(dict((u, None) for u in users), results)
+        self.assertEqual(5, len(self._commands('useradd')))
+        chpasswd = [(c, d) for (c, d) in self.subp_calls
+                    if c[0] == 'chpasswd']
+        self.assertEqual(1, len(chpasswd))
+        self.assertEqual(
+            sorted("svc%d:pw%d" % (i, i) for i in range(5)),
+            sorted(chpasswd[0][1].splitlines()))
+        sudoers = util.load_file(self.distro.ci_sudoers_fn)
+        for user in users:
+            self.assertIn("%s ALL=(ALL) NOPASSWD:ALL" % user, sudoers)
+        self.assertEqual(1, sudoers.count(util.make_header()))
+
+    def test_existing_accounts_not_recreated(self):
+        results = self._create(
+            {'old': {'lock_passwd': False}, 'new': {'lock_passwd': False}},
+            {'admins': ['old', 'new'], 'wheel': ['old']},
+            known_users=['old'], known_groups={'wheel': set(['old'])})
+        self.assertEqual({'old': None, 'new': None}, results)
+        self.assertEqual([['useradd', 'new', '-m']],
+                         self._commands('useradd'))
+        self.assertEqual([['groupadd', 'admins']], self._commands('groupadd'))
+        # members are added after the users they refer to are created
+        self.assertEqual(
+            sorted([['usermod', '-a', '-G', 'admins', 'old'],
+                    ['usermod', '-a', '-G', 'admins', 'new']]),
+            sorted(self._commands('usermod')))
+
+    def test_failed_user_reported_and_skipped(self):
+        results = self._create(
+            {'bad': {'ssh_authorized_keys': ['key']},
+             'good': {'ssh_authorized_keys': ['key']}}, {},
+            fail_cmd=['useradd', 'bad'])
+        self.assertIsInstance(results['bad'], util.ProcessExecutionError)
+        self.assertIsNone(results['good'])
+        self.assertEqual([['passwd', '-l', 'good']],
+                         self._commands('passwd'))
+        self.m_keys.assert_called_once_with(set(['key']), 'good',
+                                            options=None)
+
+    def test_failed_batch_password_retried_per_user(self):
+        users = {'bad': {'plain_text_passwd': 'x'},
+                 'good': {'plain_text_passwd': 'y'}}
+        results = self._create(users, {}, fail_cmd=['chpasswd'],
+                               fail_data='bad:')
+        self.assertIsInstance(results['bad'], util.ProcessExecutionError)
+        self.assertIsNone(results['good'])
+        self.assertEqual(
+            [None, 'bad:x', 'good:y'],
+            [None if '\n' in d else d for (c, d) in self.subp_calls
+             if c[0] == 'chpasswd'])
+        self.assertEqual([['passwd', '-l', 'good']],
+                         self._commands('passwd'))
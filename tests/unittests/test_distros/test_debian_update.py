@@ -0,0 +1,90 @@
+from cloudinit.distros import debian
+from cloudinit import helpers as c_helpers
+from cloudinit import util
+
+from .. import helpers
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestAptUpdateSkip(helpers.TestCase):
+
+    def setUp(self):
+        super(TestAptUpdateSkip, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sources = os.path.join(self.tmp, 'sources.list')
+        self.sources_d = os.path.join(self.tmp, 'sources.list.d')
+        self.lists = os.path.join(self.tmp, 'lists')
+        util.write_file(self.sources, "deb http://archive/ubuntu xenial\n")
+        util.write_file(os.path.join(self.lists, 'archive_xenial_Packages'),
+                        "Package: foo\n")
+        os.mkdir(self.sources_d)
+        self.paths = c_helpers.Paths({'cloud_dir': self.tmp})
+        self.record_fn = os.path.join(self.tmp, 'data', 'apt-update.json')
+        for (name, val) in (
+                ('APT_SOURCES_PATHS', (self.sources, self.sources_d)),
+                ('APT_LISTS_DIR', self.lists)):
+            patcher = mock.patch.object(debian, name, val)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _update(self, max_age=3600):
+        distro = debian.Distro("ubuntu", {'apt_update_max_age': max_age},
+                               self.paths)
+        with mock.patch.object(distro, 'package_command') as m_cmd:
+            distro._update_package_sources()
+        return m_cmd.call_count
+
+    def test_update_runs_without_record_and_records(self):
+        self.assertEqual(1, self._update())
+        record = json.loads(util.load_file(self.record_fn))
+        self.assertEqual(debian.apt_sources_fingerprint(),
+                         record['fingerprint'])
+
+    def test_skipped_when_sources_unchanged_and_fresh(self):
+        self._update()
+        self.assertEqual(0, self._update())
+
+    def test_runs_when_sources_change(self):
+        self._update()
+        util.write_file(os.path.join(self.sources_d, 'ppa.list'),
+                        "deb http://ppa/ubuntu xenial main\n")
+        self.assertEqual(1, self._update())
+        self.assertEqual(0, self._update())
+
+    def test_runs_when_record_too_old(self):
+        self._update()
+        record = json.loads(util.load_file(self.record_fn))
+        record['time'] = time.time() - 7200
+        util.write_file(self.record_fn, json.dumps(record))
+        self.assertEqual(1, self._update())
+
+    def test_runs_when_lists_missing(self):
+        self._update()
+        shutil.rmtree(self.lists)
+        self.assertEqual(1, self._update())
+
+    def test_never_skipped_by_default(self):
+        self._update()
+        self.assertEqual(1, self._update(max_age=0))
+
+    def test_failed_update_leaves_no_record(self):
+        self._update()
+        util.write_file(self.sources, "deb http://mirror/ubuntu xenial\n")
+        distro = debian.Distro("ubuntu", {'apt_update_max_age': 3600},
+                               self.paths)
+        with mock.patch.object(distro, 'package_command',
+                               side_effect=util.ProcessExecutionError()):
+            self.assertRaises(util.ProcessExecutionError,
+                              distro._update_package_sources)
+        self.assertFalse(os.path.exists(self.record_fn))
@@ -0,0 +1,155 @@
+from cloudinit import distros
+from cloudinit import stages
+from cloudinit import util
+
+from .. import helpers
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+class TestPackageTransaction(helpers.TestCase):
+
+    def setUp(self):
+        super(TestPackageTransaction, self).setUp()
+        cls = distros.fetch("ubuntu")
+        self.distro = cls("ubuntu", {}, None)
+        self.installs = []
+        self.fail_with = None
+        patcher = mock.patch.object(
+            self.distro, '_install_packages', side_effect=self._install)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _install(self, pkglist):
+        self.installs.append(list(pkglist))
+        if self.fail_with and self.fail_with in pkglist:
+            raise util.ProcessExecutionError(exit_code=100)
+
+    def test_install_outside_transaction_is_immediate(self):
+        self.distro.install_packages(['a'])
+        self.distro.queue_packages(['b'])
+        self.assertEqual([['a'], ['b']], self.installs)
+
+    def test_queued_packages_join_next_install(self):
+        with self.distro.package_transaction() as txn:
+            self.distro.queue_packages(['a', 'b'])
+            self.distro.queue_packages([('c', '1.0'), 'a'])
+            self.assertEqual([], self.installs)
+            self.distro.install_packages(('d',))
+            self.distro.install_packages(['b', 'd'])
+        self.assertEqual([[('d',), 'a', 'b', ('c', '1.0')]], self.installs)
+        self.assertEqual(4, txn.requests)
+        self.assertEqual(1, txn.invocations)
+        self.assertEqual(3, txn.saved)
+
+    def test_pending_installed_on_flush_and_exit(self):
+        with self.distro.package_transaction():
+            self.distro.queue_packages(['a'])
+            self.distro.flush_packages()
+            self.distro.flush_packages()
+            self.distro.queue_packages(['b'])
+        self.assertEqual([['a'], ['b']], self.installs)
+        self.assertIsNone(self.distro._package_txn)
+
+    def test_nested_transaction_joins_outer(self):
+        with self.distro.package_transaction() as outer:
+            with self.distro.package_transaction() as inner:
+                self.distro.queue_packages(['a'])
+            self.assertIs(outer, inner)
+            self.assertEqual([], self.installs)
+        self.assertEqual([['a']], self.installs)
+
+    def test_bad_queued_package_does_not_fail_install(self):
+        self.fail_with = 'bad'
+        with self.distro.package_transaction() as txn:
+            self.distro.queue_packages(['bad'])
+            self.distro.install_packages(['good'])
+            self.assertEqual(['bad'], txn.pending)
+            self.assertRaises(util.ProcessExecutionError,
+                              self.distro.flush_packages)
+        self.assertEqual([['good', 'bad'], ['good'], ['bad']], self.installs)
+
+    def test_failed_install_raises(self):
+        self.fail_with = 'bad'
+        with self.distro.package_transaction():
+            self.assertRaises(util.ProcessExecutionError,
+                              self.distro.install_packages, ['bad'])
+
+
+class TestModulesPackageTransaction(helpers.TestCase):
+
+    def _module(self, name, pkgs, queue=False, package_transaction=True):
+        def handle(_name, _cfg, cloud, _log, _args):
+            self.order.append(name)
+            if queue:
+                cloud.distro.queue_packages(pkgs)
+            elif pkgs:
+                cloud.distro.install_packages(pkgs)
+        mod = mock.Mock(handle=handle, frequency="always",
+                        package_transaction=package_transaction)
+        return [mod, name, None, []]
+
+    def _run(self, mods):
+        self.order = []
+        distro = distros.fetch("ubuntu")("ubuntu", {}, None)
+
+        def install(pkglist):
+            self.order.append(list(pkglist))
+        init = mock.Mock(cfg={}, reporter=None)
+        init.cloudify.return_value.distro = distro
+        init.cloudify.return_value.run.side_effect = (
+            lambda _name, func, args, freq: (True, func(*args)))
+        runner = stages.Modules(init)
+        runner._cached_cfg = {}
+        with mock.patch.object(distro, '_install_packages',
+                               side_effect=install):
+            return runner._run_modules(mods)
+
+    def test_queued_packages_merged_into_later_install(self):
+        (_ran, failures) = self._run([
+            self._module('pkgs', ['a'], queue=True),
+            self._module('fan', ['ubuntu-fan']),
+            self._module('lxd', ['lxd', 'a'])])
+        self.assertEqual([], failures)
+        self.assertEqual(['pkgs', 'fan', ['ubuntu-fan', 'a'], 'lxd',
+                          ['lxd']], self.order)
+
+    def test_flushed_before_module_outside_transaction(self):
+        self._run([
+            self._module('pkgs', ['a'], queue=True),
+            self._module('scripts', [], package_transaction=False),
+            self._module('fan', ['ubuntu-fan'])])
+        self.assertEqual(['pkgs', ['a'], 'scripts', 'fan', ['ubuntu-fan']],
+                         self.order)
+
+    def test_flushed_at_end_of_stage(self):
+        self._run([self._module('pkgs', ['a', 'b'], queue=True)])
+        self.assertEqual(['pkgs', ['a', 'b']], self.order)
+
+
+class TestOldStyleDistro(helpers.TestCase):
+
+    def test_distro_overriding_install_packages_still_works(self):
+        installs = []
+        base = distros.fetch("ubuntu")
+
+        class OldDistro(base):
+            def install_packages(self, pkglist):
+                installs.append(list(pkglist))
+
+        # undo the in-tree implementation, as an out-of-tree distro
+        # written against the old api would not have one
+        OldDistro._install_packages = distros.Distro._install_packages
+        distro = OldDistro("old", {}, None)
+        distro.install_packages(['a'])
+        with distro.package_transaction():
+            distro.queue_packages(['b', 'c'])
+        self.assertEqual([['a'], ['b', 'c']], installs)
+
+    def test_distro_without_any_install_refused(self):
+        distro = distros.fetch("ubuntu")("ubuntu", {}, None)
+        self.assertRaises(NotImplementedError,
+                          distros.Distro._install_packages, distro, ['a'])
@@ -1,12 +1,21 @@
 from cloudinit.config import cc_disk_setup
+from cloudinit.reporting import events
+from cloudinit import util
 from ..helpers import ExitStack, mock, TestCase
 
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
 
 class TestIsDiskUsed(TestCase):
 
     def setUp(self):
         super(TestIsDiskUsed, self).setUp()
         self.patches = ExitStack()
+        self.addCleanup(self.patches.close)
         mod_name = 'cloudinit.config.cc_disk_setup'
         self.enumerate_disk = self.patches.enter_context(
             mock.patch('{0}.enumerate_disk'.format(mod_name)))
@@ -28,3 +37,237 @@ class TestIsDiskUsed(TestCase):
         self.enumerate_disk.return_value = (mock.MagicMock() for _ in range(1))
         self.check_fs.return_value = (mock.MagicMock(), None, mock.MagicMock())
         self.assertFalse(cc_disk_setup.is_disk_used(mock.MagicMock()))
+
+
+class TestDeviceCache(TestCase):
+
+    def setUp(self):
+        super(TestDeviceCache, self).setUp()
+        cc_disk_setup.clear_device_cache()
+        self.addCleanup(cc_disk_setup.clear_device_cache)
+        self.patches = ExitStack()
+        self.addCleanup(self.patches.close)
+        self.subp = self.patches.enter_context(
+            mock.patch.object(cc_disk_setup.util, 'subp'))
+
+    def test_lsblk_run_once_until_cleared(self):
+        self.subp.return_value = (
+            'NAME="xvdb" TYPE="disk" FSTYPE="" LABEL=""\n'
+            'NAME="xvdb1" TYPE="part" FSTYPE="ext4" LABEL="data"\n', '')
+        first = list(cc_disk_setup.enumerate_disk('/dev/xvdb'))
+        first[0]['name'] = 'mutated'
+        self.assertEqual(
+            [{'name': 'xvdb', 'type': 'disk', 'fstype': '', 'label': ''},
+             {'name': 'xvdb1', 'type': 'part', 'fstype': 'ext4',
+              'label': 'data'}],
+            list(cc_disk_setup.enumerate_disk('/dev/xvdb')))
+        self.assertTrue(cc_disk_setup.is_disk_used('/dev/xvdb'))
+        self.assertEqual(1, self.subp.call_count)
+
+        cc_disk_setup.clear_device_cache()
+        list(cc_disk_setup.enumerate_disk('/dev/xvdb'))
+        self.assertEqual(2, self.subp.call_count)
+
+    def test_blkid_run_once(self):
+        self.subp.return_value = (
+            '/dev/xvdb1: LABEL="data" UUID="1234" TYPE="ext4"\n', '')
+        self.assertEqual(('data', 'ext4', '1234'),
+                         cc_disk_setup.check_fs('/dev/xvdb1'))
+        self.assertEqual('ext4', cc_disk_setup.is_filesystem('/dev/xvdb1'))
+        self.assertEqual(1, self.subp.call_count)
+
+    def test_mkfs_clears_cache(self):
+        self.subp.return_value = ('', '')
+        self.patches.enter_context(
+            mock.patch.object(cc_disk_setup.util, 'which',
+                              return_value='/sbin/mkfs.ext4'))
+        self.patches.enter_context(
+            mock.patch.object(cc_disk_setup, 'device_type',
+                              return_value='disk'))
+        cc_disk_setup.mkfs({'device': '/dev/xvdb', 'partition': 'none',
+                            'filesystem': 'ext4'})
+        self.assertEqual({}, cc_disk_setup._BLKID_CACHE)
+
+
+class TestDeviceDisk(TestCase):
+
+    def setUp(self):
+        super(TestDeviceDisk, self).setUp()
+        # nothing is in sysfs, as for partitions not created yet
+        patcher = mock.patch.object(cc_disk_setup.os.path, 'exists',
+                                    return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_partitions_not_created_yet_keyed_by_name(self):
+        for (device, disk) in (('/dev/sdb1', '/dev/sdb'),
+                               ('/dev/xvdc12', '/dev/xvdc'),
+                               ('/dev/vdaa3', '/dev/vdaa'),
+                               ('/dev/nvme0n1p2', '/dev/nvme0n1'),
+                               ('/dev/mmcblk0p1', '/dev/mmcblk0'),
+                               ('/dev/md0p1', '/dev/md0')):
+            self.assertEqual(disk, cc_disk_setup.device_disk(device))
+
+    def test_disks_are_their_own_disk(self):
+        for device in ('/dev/sdb', '/dev/nvme0n1', '/dev/mmcblk0',
+                       '/dev/md0', '/dev/xvdc'):
+            self.assertEqual(device, cc_disk_setup.device_disk(device))
+
+    def test_new_partition_runs_after_its_disk_is_partitioned(self):
+        calls = []
+        plan = cc_disk_setup.DiskPlan()
+        plan.add('/dev/sdb', calls.append, 'mkpart sdb')
+        plan.add('/dev/sdb1', calls.append, 'mkfs sdb1')
+        plan.add('/dev/nvme0n1', calls.append, 'mkpart nvme0n1')
+        plan.add('/dev/nvme0n1p1', calls.append, 'mkfs nvme0n1p1')
+        self.assertEqual(['/dev/sdb', '/dev/nvme0n1'], plan.disks)
+        plan.run()
+        self.assertLess(calls.index('mkpart sdb'), calls.index('mkfs sdb1'))
+        self.assertLess(calls.index('mkpart nvme0n1'),
+                        calls.index('mkfs nvme0n1p1'))
+
+
+class TestDiskPlan(TestCase):
+
+    def setUp(self):
+        super(TestDiskPlan, self).setUp()
+        patcher = mock.patch.object(
+            cc_disk_setup, 'device_disk',
+            side_effect=lambda d: d.rstrip('0123456789') if d else None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_steps_ordered_per_disk_and_disks_concurrent(self):
+        calls = []
+        xvdc_started = threading.Event()
+
+        def step(name):
+            if name == 'xvdb':
+                # only finishes once work on xvdc has started as well
+                self.assertTrue(xvdc_started.wait(5))
+            if name.startswith('xvdc'):
+                xvdc_started.set()
+            calls.append(name)
+
+        plan = cc_disk_setup.DiskPlan()
+        for dev in ('/dev/xvdb', '/dev/xvdc', '/dev/xvdb1', '/dev/xvdc1'):
+            plan.add(dev, step, os.path.basename(dev))
+        plan.run()
+        self.assertEqual(['/dev/xvdb', '/dev/xvdc'], plan.disks)
+        self.assertLess(calls.index('xvdb'), calls.index('xvdb1'))
+        self.assertLess(calls.index('xvdc'), calls.index('xvdc1'))
+
+    def test_handle_plans_partitioning_before_filesystems(self):
+        cfg = {'disk_setup': {'/dev/xvdb': {'layout': True}},
+               'fs_setup': [{'device': '/dev/xvdb', 'partition': 1,
+                             'filesystem': 'ext4'}]}
+        mycloud = mock.Mock(reporter=None)
+        mycloud.device_name_to_device.return_value = None
+        calls = []
+        with ExitStack() as mocks:
+            mocks.enter_context(mock.patch.object(
+                cc_disk_setup, 'mkpart',
+                side_effect=lambda d, c: calls.append(('mkpart', d))))
+            mocks.enter_context(mock.patch.object(
+                cc_disk_setup, 'mkfs',
+                side_effect=lambda c: calls.append(('mkfs', c['device']))))
+            cc_disk_setup.handle('disk_setup', cfg, mycloud, mock.Mock(), [])
+        self.assertEqual([('mkpart', '/dev/xvdb'), ('mkfs', '/dev/xvdb')],
+                         calls)
+
+
+class TestFastMkfs(TestCase):
+
+    def setUp(self):
+        super(TestFastMkfs, self).setUp()
+        cc_disk_setup.clear_device_cache()
+        self.addCleanup(cc_disk_setup.clear_device_cache)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _mkfs_cmd(self, fs_cfg, mkfs_cmd='/sbin/mkfs'):
+        with ExitStack() as mocks:
+            m_subp = mocks.enter_context(mock.patch.object(
+                cc_disk_setup.util, 'subp', return_value=('', '')))
+            mocks.enter_context(mock.patch.object(
+                cc_disk_setup.util, 'which', return_value=mkfs_cmd))
+            mocks.enter_context(mock.patch.object(
+                cc_disk_setup, 'device_type', return_value='part'))
+            cc_disk_setup.mkfs(fs_cfg)
+        return m_subp.call_args_list[-1][0][0]
+
+    def test_fast_options_per_filesystem(self):
+        for (fs_type, opts) in (
+                ('ext4', ['-E',
+                          'lazy_itable_init=1,lazy_journal_init=1,nodiscard']),
+                ('ext3', ['-E', 'lazy_journal_init=1,nodiscard']),
+                ('xfs', ['-K']),
+                ('vfat', [])):
+            cmd = self._mkfs_cmd({'device': '/dev/xvdb1', 'partition': 'none',
+                                  'filesystem': fs_type, 'fast': True,
+                                  'overwrite': True})
+            force = [cc_disk_setup.lookup_force_flag(fs_type)]
+            self.assertEqual(['/sbin/mkfs', '/dev/xvdb1'] + force + opts, cmd)
+
+    def test_fast_extended_opts_merged_into_users(self):
+        for (extra, merged) in (
+                (['-E', 'stride=16,lazy_itable_init=0', '-m', '1'],
+                 ['-E', 'lazy_journal_init=1,nodiscard,stride=16,'
+                  'lazy_itable_init=0', '-m', '1']),
+                (['-Ediscard'],
+                 ['-Elazy_itable_init=1,lazy_journal_init=1,discard'])):
+            cmd = self._mkfs_cmd({'device': '/dev/xvdb1', 'partition': 'none',
+                                  'filesystem': 'ext4', 'fast': True,
+                                  'extra_opts': extra})
+            self.assertEqual(['/sbin/mkfs', '/dev/xvdb1'] + merged, cmd)
+            self.assertEqual(1, len([o for o in cmd if o.startswith('-E')]))
+
+    def test_fast_opts_kept_without_user_extended_opts(self):
+        cmd = self._mkfs_cmd({'device': '/dev/xvdb1', 'partition': 'none',
+                              'filesystem': 'ext3', 'fast': True,
+                              'extra_opts': ['-m', '1']})
+        self.assertEqual(['/sbin/mkfs', '/dev/xvdb1', '-E',
+                          'lazy_journal_init=1,nodiscard', '-m', '1'], cmd)
+
+    def test_not_fast_by_default(self):
+        cmd = self._mkfs_cmd({'device': '/dev/xvdb1', 'partition': 'none',
+                              'filesystem': 'ext4'})
+        self.assertEqual(['/sbin/mkfs', '/dev/xvdb1'], cmd)
+
+    @unittest.skipUnless(util.which('mkfs.ext4') and util.which('blkid'),
+                         "mkfs.ext4 and blkid are needed")
+    def test_fast_ext4_on_image(self):
+        # a sparse image stands in for a loop device, which needs root
+        image = os.path.join(self.tmp, 'disk.img')
+        with open(image, 'wb') as fp:
+            fp.truncate(64 * 1024 * 1024)
+        cfg = {'device': image, 'partition': 'none', 'filesystem': 'ext4',
+               'label': 'fast', 'fast': True, 'overwrite': True}
+        with mock.patch.object(cc_disk_setup, 'BLKID_CMD',
+                               util.which('blkid')):
+            cc_disk_setup.mkfs(cfg)
+            self.assertEqual(('fast', 'ext4'),
+                             cc_disk_setup.check_fs(image)[:2])
+
+    def test_mkfs_time_reported(self):
+        reporter = events.ReportEventStack(
+            name='config-disk_setup', description='test',
+            reporting_enabled=False)
+        with mock.patch.object(cc_disk_setup, 'mkfs'):
+            cc_disk_setup.create_filesystem({'device': '/dev/xvdb'},
+                                            reporter)
+        (result, msg) = reporter.children['mkfs-xvdb']
+        self.assertEqual(events.status.SUCCESS, result)
+        self.assertIn("filesystem setup for /dev/xvdb took", msg)
+
+    def test_mkfs_failure_reported(self):
+        reporter = events.ReportEventStack(
+            name='config-disk_setup', description='test',
+            reporting_enabled=False)
+        with mock.patch.object(cc_disk_setup, 'mkfs',
+                               side_effect=RuntimeError("no mkfs")):
+            cc_disk_setup.create_filesystem({'device': '/dev/xvdb'},
+                                            reporter)
+        (result, msg) = reporter.children['mkfs-xvdb']
+        self.assertEqual(events.status.FAIL, result)
+        self.assertIn("filesystem setup for /dev/xvdb failed after", msg)
@@ -8,6 +8,8 @@ import errno
 import logging
 import os
 import re
+import stat
+import threading
 import unittest
 
 try:
@@ -84,6 +86,8 @@ class TestConfig(TestCase):
 
         self.cloud_init = None
         self.handle = cc_growpart.handle
+        cc_growpart._AVAILABLE.clear()
+        self.addCleanup(cc_growpart._AVAILABLE.clear)
 
     @mock.patch.dict("os.environ", clear=True)
     def test_no_resizers_auto_is_fine(self):
@@ -145,6 +149,16 @@ class TestConfig(TestCase):
             factory.assert_called_once_with('auto')
             rsdevs.assert_called_once_with(myresizer, ['/'])
 
+    @mock.patch.dict("os.environ", clear=True)
+    def test_availability_probed_once(self):
+        with mock.patch.object(
+                util, 'subp',
+                return_value=(HELP_GROWPART_RESIZE, "")) as mockobj:
+            cc_growpart.resizer_factory(mode="auto")
+            cc_growpart.resizer_factory(mode="growpart")
+            mockobj.assert_called_once_with(
+                ['growpart', '--help'], env={'LANG': 'C'})
+
 
 class TestResize(unittest.TestCase):
     def setUp(self):
@@ -207,6 +221,110 @@ class TestResize(unittest.TestCase):
             os.stat = real_stat
 
 
+class TestResizeDevices(unittest.TestCase):
+
+    def _resize(self, devices, resizer):
+        blockstat = Bunch(st_mode=stat.S_IFBLK)
+        with ExitStack() as mocks:
+            mocks.enter_context(mock.patch.object(
+                cc_growpart, 'device_part_info', simple_device_part_info))
+            mocks.enter_context(mock.patch.object(
+                cc_growpart, 'devent2dev',
+                side_effect=lambda d: '/dev/vda1' if d == '/' else d))
+            mocks.enter_context(mock.patch.object(
+                cc_growpart.os, 'stat', return_value=blockstat))
+            return cc_growpart.resize_devices(resizer, devices)
+
+    def test_disks_resized_concurrently_in_order(self):
+        barrier = threading.Event()
+        calls = []
+
+        class myresizer(object):
+            def resize(self, diskdev, partnum, partdev):
+                calls.append(partdev)
+                if partdev == "/dev/vdb1":
+                    # only returns once vdc is being resized too
+                    self.waited = barrier.wait(5)
+                else:
+                    barrier.set()
+                return (1, 2)
+
+        resizer = myresizer()
+        devs = ["/dev/vdb1", "/dev/vdc1", "/dev/vdb2"]
+        resized = self._resize(devs, resizer)
+        self.assertTrue(resizer.waited)
+        self.assertEqual(devs, [r[0] for r in resized])
+        self.assertEqual([cc_growpart.RESIZE.CHANGED] * 3,
+                         [r[1] for r in resized])
+        # partitions on the same disk are still done in order
+        self.assertLess(calls.index("/dev/vdb1"), calls.index("/dev/vdb2"))
+
+    def test_same_partition_resized_once(self):
+        resizer = mock.Mock()
+        resizer.resize.return_value = (1, 2)
+        resized = self._resize(["/", "/dev/vda1"], resizer)
+        resizer.resize.assert_called_once_with("/dev/vda", "1", "/dev/vda1")
+        self.assertEqual(["/", "/dev/vda1"], [r[0] for r in resized])
+        self.assertEqual(resized[0][1:], resized[1][1:])
+
+
+class TestGrowPartFreeSpace(unittest.TestCase):
+
+    # vda is 1000 sectors, vda1 covers 0-599, vda2 starts at 700
+    SYSFS = {
+        '/sys/class/block/vda1/start': '0',
+        '/sys/class/block/vda1/size': '600',
+        '/sys/class/block/vda2/start': '700',
+        '/sys/class/block/vda2/size': '290',
+        '/sys/devices/vda/size': '1000',
+        '/sys/devices/vda/vda1/start': '0',
+        '/sys/devices/vda/vda2/start': '700',
+    }
+
+    def _free(self, devpath):
+        def load_file(path):
+            if path not in self.SYSFS:
+                raise IOError(errno.ENOENT, "No such file", path)
+            return self.SYSFS[path]
+
+        def realpath(path):
+            if path.startswith('/sys/class/block/'):
+                return '/sys/devices/vda/' + os.path.basename(path)
+            return path
+
+        with ExitStack() as mocks:
+            mocks.enter_context(mock.patch.object(
+                cc_growpart.os.path, 'realpath', side_effect=realpath))
+            mocks.enter_context(mock.patch.object(
+                cc_growpart.os.path, 'exists',
+                side_effect=lambda p: p in self.SYSFS))
+            mocks.enter_context(mock.patch.object(
+                cc_growpart.os, 'listdir',
+                return_value=['vda1', 'vda2', 'queue']))
+            mocks.enter_context(mock.patch.object(
+                util, 'load_file', side_effect=load_file))
+            return cc_growpart.part_free_sectors(devpath)
+
+    def test_free_sectors(self):
+        self.assertEqual(100, self._free('/dev/vda1'))
+        self.assertEqual(10, self._free('/dev/vda2'))
+
+    def test_unknown_device(self):
+        self.assertIsNone(self._free('/dev/vdz1'))
+
+    def test_dry_run_skipped_without_free_space(self):
+        resizer = cc_growpart.ResizeGrowPart()
+        with ExitStack() as mocks:
+            m_subp = mocks.enter_context(mock.patch.object(util, 'subp'))
+            mocks.enter_context(mock.patch.object(
+                cc_growpart, 'get_size', return_value=1024))
+            mocks.enter_context(mock.patch.object(
+                cc_growpart, 'part_free_sectors', return_value=10))
+            self.assertEqual((1024, 1024),
+                             resizer.resize('/dev/vda', '2', '/dev/vda2'))
+        self.assertEqual(0, m_subp.call_count)
+
+
 def simple_device_part_info(devpath):
     # simple stupid return (/dev/vda, 1) for /dev/vda
     ret = re.search("([^0-9]*)([0-9]*)$", devpath)
@@ -0,0 +1,56 @@
+from cloudinit.config import cc_migrator
+
+from cloudinit import helpers
+from cloudinit.settings import PER_INSTANCE
+from cloudinit import util
+
+from .. import helpers as t_help
+
+import json
+import logging
+import os
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+LOG = logging.getLogger(__name__)
+
+
+class TestMigrateSemIndex(t_help.TempDirTestCase):
+
+    def _cloud(self, backend):
+        ds = mock.Mock()
+        ds.get_instance_id.return_value = "i-1"
+        paths = helpers.Paths({'cloud_dir': self.tmp,
+                               'semaphores': backend}, ds=ds)
+        return mock.Mock(paths=paths)
+
+    def _write_index(self, cloud, entries):
+        sem_path = cloud.paths.get_ipath('sem')
+        util.write_file(os.path.join(sem_path, helpers.SEM_INDEX_FILE),
+                        json.dumps(entries))
+        return sem_path
+
+    def test_index_turned_into_marker_files(self):
+        cloud = self._cloud('files')
+        sem_path = self._write_index(
+            cloud, {'config_a': '1: 2', 'config-b.once': '3: 4'})
+        cc_migrator.handle('migrator', {}, cloud, LOG, [])
+        self.assertEqual(['config_a', 'config_b.once'],
+                         sorted(os.listdir(sem_path)))
+        self.assertEqual("1: 2\n", util.load_file(
+            os.path.join(sem_path, 'config_a')))
+        sems = helpers.FileSemaphores(sem_path)
+        self.assertTrue(sems.has_run('config_a', PER_INSTANCE))
+
+    def test_index_names_canonicalized(self):
+        cloud = self._cloud('index')
+        sem_path = self._write_index(
+            cloud, {'config-a': '1: 2', 'config_b.once': '3: 4'})
+        cc_migrator.handle('migrator', {}, cloud, LOG, [])
+        self.assertEqual([helpers.SEM_INDEX_FILE], os.listdir(sem_path))
+        self.assertEqual({'config_a': '1: 2', 'config_b.once': '3: 4'},
+                         json.loads(util.load_file(
+                             os.path.join(sem_path, helpers.SEM_INDEX_FILE))))
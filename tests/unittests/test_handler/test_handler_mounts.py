@@ -131,3 +131,120 @@ class TestSanitizeDevname(test_helpers.FilesystemMockingTestCase):
         self.assertIsNone(
             cc_mounts.sanitize_devname(
                 'ephemeral0.1', lambda x: disk_path, mock.Mock()))
+
+
+class TestCreateSwapfile(test_helpers.TestCase):
+
+    def setUp(self):
+        super(TestCreateSwapfile, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.fname = os.path.join(self.tmp, 'swap.img')
+        patcher = mock.patch.object(cc_mounts.util, 'subp')
+        self.m_subp = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create(self, fs_type, size=3 * 2 ** 20, kernel=(4, 4)):
+        with mock.patch.object(cc_mounts.util, 'get_mount_info',
+                               return_value=('/dev/sda1', fs_type, '/')):
+            with mock.patch.object(cc_mounts, 'kernel_version',
+                                   return_value=kernel):
+                return cc_mounts.create_swapfile(self.fname, size)
+
+    @test_helpers.skipIf(not hasattr(os, 'posix_fallocate'),
+                         "posix_fallocate is not available")
+    def test_fallocate_on_ext4(self):
+        self.assertEqual('fallocate', self._create('ext4'))
+        self.assertEqual(3 * 2 ** 20, os.path.getsize(self.fname))
+        self.assertEqual(0o600, os.stat(self.fname).st_mode & 0o777)
+        self.m_subp.assert_called_once_with(['mkswap', self.fname])
+
+    @test_helpers.skipIf(not hasattr(os, 'posix_fallocate'),
+                         "posix_fallocate is not available")
+    def test_fallocate_on_xfs_only_from_4_18(self):
+        self.assertEqual('write', self._create('xfs', kernel=(4, 17)))
+        self.assertEqual('fallocate', self._create('xfs', kernel=(4, 18)))
+
+    def test_kernel_version(self):
+        with mock.patch.object(cc_mounts.os, 'uname',
+                               return_value=('Linux', 'host',
+                                             '4.15.0-20-generic', '#21',
+                                             'x86_64')):
+            self.assertEqual((4, 15), cc_mounts.kernel_version())
+
+    def test_written_out_on_btrfs(self):
+        with mock.patch.object(cc_mounts, 'SWAP_WRITE_SIZE', 2 ** 20):
+            self.assertEqual('write', self._create('btrfs', 5 * 2 ** 20 + 7))
+        with open(self.fname, 'rb') as fp:
+            self.assertEqual(b'\0' * (5 * 2 ** 20 + 7), fp.read())
+
+    def test_removed_when_mkswap_fails(self):
+        self.m_subp.side_effect = cc_mounts.util.ProcessExecutionError(
+            exit_code=1)
+        self.assertRaises(cc_mounts.util.ProcessExecutionError,
+                          self._create, 'btrfs')
+        self.assertFalse(os.path.exists(self.fname))
+
+    def test_swap_setup_in_background_is_reported(self):
+        reporter = cc_mounts.events.ReportEventStack(
+            name='config-mounts', description='test',
+            reporting_enabled=False)
+        with mock.patch.object(cc_mounts, 'handle_swapcfg',
+                               return_value='/swap.img') as m_swapcfg:
+            wait = cc_mounts.start_swapcfg({'size': 1}, reporter)
+            self.assertEqual('/swap.img', wait())
+        m_swapcfg.assert_called_once_with({'size': 1})
+        (result, msg) = reporter.children['swap']
+        self.assertEqual(cc_mounts.events.status.SUCCESS, result)
+        self.assertIn("swap file setup took", msg)
+
+    def test_swap_waited_for_when_mounts_fail(self):
+        wait = mock.Mock()
+        with mock.patch.object(cc_mounts, 'start_swapcfg',
+                               return_value=wait):
+            with mock.patch.object(cc_mounts, 'mount_entries',
+                                   side_effect=ValueError("bad mounts")):
+                self.assertRaises(ValueError, cc_mounts.handle, 'mounts',
+                                  {}, mock.Mock(), mock.Mock(), [])
+        wait.assert_called_once_with()
+
+
+class TestHandle(test_helpers.FilesystemMockingTestCase):
+
+    def setUp(self):
+        super(TestHandle, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.patchUtils(self.tmp)
+        cc_mounts.util.write_file(cc_mounts.FSTAB_PATH, "/dev/sda1 / ext4\n")
+        self.cloud = mock.Mock()
+        self.cloud.distro.uses_systemd.return_value = False
+        patcher = mock.patch.object(cc_mounts.util, 'subp')
+        self.m_subp = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fstab_written_while_swap_is_prepared(self):
+        seen = []
+
+        def wait():
+            seen.append(cc_mounts.util.load_file(cc_mounts.FSTAB_PATH))
+            return '/swap.img'
+
+        entries = [['/dev/sdb', '/opt/data', 'auto', 'defaults', '0', '2']]
+        with mock.patch.object(cc_mounts, 'start_swapcfg',
+                               return_value=wait):
+            with mock.patch.object(cc_mounts, 'mount_entries',
+                                   return_value=entries):
+                cc_mounts.handle('mounts', {}, self.cloud, mock.Mock(), [])
+        self.assertIn("/opt/data", seen[0])
+        self.assertNotIn("swap", seen[0])
+        fstab = cc_mounts.util.load_file(cc_mounts.FSTAB_PATH).splitlines()
+        self.assertEqual(
+            ["/dev/sda1 / ext4",
+             "/dev/sdb\t/opt/data\tauto\tdefaults,comment=cloudconfig\t0\t2",
+             "/swap.img\tnone\tswap\tsw,comment=cloudconfig\t0\t0"],
+            fstab)
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp, 'opt/data')))
+        self.assertEqual([mock.call(("swapon", "-a")),
+                          mock.call(("mount", "-a"))],
+                         self.m_subp.call_args_list)
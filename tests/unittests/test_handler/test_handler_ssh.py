@@ -0,0 +1,85 @@
+from cloudinit.config import cc_ssh
+from cloudinit.reporting import events
+from cloudinit import util
+
+from .. import helpers as t_help
+
+import logging
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+LOG = logging.getLogger(__name__)
+
+
+class TestHostKeyGeneration(t_help.TestCase):
+
+    def setUp(self):
+        super(TestHostKeyGeneration, self).setUp()
+        self.reporter = events.ReportEventStack(
+            name="config-ssh", description="test", reporting_enabled=False)
+        self.cloud = mock.Mock(reporter=self.reporter)
+        for name, kwargs in (('SeLinuxGuard', {}), ('ensure_dir', {}),
+                             ('subp', {'side_effect': self._subp})):
+            patcher = mock.patch.object(cc_ssh.util, name, **kwargs)
+            setattr(self, 'm_' + name, patcher.start())
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(cc_ssh.sys, 'stdout')
+        self.m_stdout = patcher.start()
+        self.addCleanup(patcher.stop)
+        for name, kwargs in (
+                ('apply_credentials', {}),
+                ('ug_util', {'extract_default.return_value': (None, None),
+                             'normalize_users_groups.return_value': ({},
+                                                                     {})})):
+            patcher = mock.patch.object(cc_ssh, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _subp(self, cmd, capture=False, env=None):
+        keytype = cmd[2]
+        if keytype == 'broken':
+            raise OSError("ssh-keygen went away")
+        if keytype == 'bogus':
+            raise util.ProcessExecutionError(
+                stderr="unknown key type bogus\n", exit_code=1)
+        return ("%s done\n" % keytype, "")
+
+    def _handle(self, keytypes):
+        cfg = {'ssh_deletekeys': False, 'ssh_genkeytypes': keytypes}
+        with mock.patch.object(cc_ssh.os.path, 'exists',
+                               return_value=False):
+            cc_ssh.handle("ssh", cfg, self.cloud, LOG, [])
+
+    def test_all_types_generated_with_one_relabel(self):
+        self._handle(['rsa', 'dsa', 'ecdsa', 'ed25519'])
+        self.assertEqual(
+            sorted(['rsa', 'dsa', 'ecdsa', 'ed25519']),
+            sorted(c[0][0][2] for c in self.m_subp.call_args_list))
+        self.m_SeLinuxGuard.assert_called_once_with("/etc/ssh",
+                                                    recursive=True)
+        self.assertEqual(
+            [mock.call("%s done\n" % t)
+             for t in ('rsa', 'dsa', 'ecdsa', 'ed25519')],
+            self.m_stdout.write.call_args_list)
+
+    def test_timing_reported_per_type(self):
+        self._handle(['rsa', 'bogus'])
+        self.assertEqual(set(['keygen-rsa', 'keygen-bogus']),
+                         set(self.reporter.children))
+        (result, msg) = self.reporter.children['keygen-rsa']
+        self.assertEqual(events.status.SUCCESS, result)
+        self.assertIn("generated rsa host key in", msg)
+
+    def test_unknown_key_type_only_logged_at_debug(self):
+        with mock.patch.object(cc_ssh.util, 'logexc') as m_logexc:
+            self._handle(['bogus', 'rsa'])
+        self.assertEqual(0, m_logexc.call_count)
+        self.m_stdout.write.assert_called_once_with("rsa done\n")
+
+    def test_other_failures_still_fail_the_module(self):
+        self.assertRaises(OSError, self._handle, ['rsa', 'broken', 'dsa'])
+        self.assertEqual([mock.call("rsa done\n"), mock.call("dsa done\n")],
+                         self.m_stdout.write.call_args_list)
@@ -0,0 +1,45 @@
+from cloudinit.config import cc_users_groups
+from cloudinit import distros
+from cloudinit import util
+
+from .. import helpers as t_help
+
+import logging
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+LOG = logging.getLogger(__name__)
+
+
+class TestHandle(t_help.TestCase):
+
+    def setUp(self):
+        super(TestHandle, self).setUp()
+        distro = distros.fetch("ubuntu")("ubuntu", {}, None)
+        self.cloud = mock.Mock(distro=distro)
+        patcher = mock.patch.object(distro, 'create_users_groups')
+        self.m_create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_normalized_users_and_groups_created_in_one_call(self):
+        self.m_create.return_value = {'bob': None}
+        cfg = {'groups': ['admins'],
+               'users': [{'name': 'bob', 'groups': 'admins'}]}
+        cc_users_groups.handle("users-groups", cfg, self.cloud, LOG, [])
+        (users, groups) = self.m_create.call_args[0]
+        self.assertEqual(['bob'], list(users))
+        self.assertEqual('admins', users['bob']['groups'])
+        self.assertEqual({'admins': []}, groups)
+
+    def test_failed_users_fail_the_module(self):
+        self.m_create.return_value = {
+            'bob': util.ProcessExecutionError(exit_code=1), 'alice': None}
+        cfg = {'users': ['bob', 'alice']}
+        with mock.patch.object(LOG, 'warn') as m_warn:
+            self.assertRaisesRegexp(
+                RuntimeError, "1 of 2 users: bob", cc_users_groups.handle,
+                "users-groups", cfg, self.cloud, LOG, [])
+        self.assertEqual(1, m_warn.call_count)
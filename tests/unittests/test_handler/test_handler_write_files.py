@@ -1,14 +1,17 @@
+from cloudinit.config import cc_write_files
 from cloudinit.config.cc_write_files import write_files
 from cloudinit import log as logging
 from cloudinit import util
 
-from ..helpers import FilesystemMockingTestCase
+from ..helpers import ExitStack, FilesystemMockingTestCase, mock
 
 import base64
 import gzip
+import os
 import shutil
 import six
 import tempfile
+import unittest
 
 LOG = logging.getLogger(__name__)
 
@@ -95,6 +98,66 @@ class TestWriteFiles(FilesystemMockingTestCase):
             len(gz_aliases + gz_b64_aliases + b64_aliases) * len(datum))
         self.assertEqual(len(expected), flen_expected)
 
+    def test_text_base64_and_multi_member_gzip(self):
+        self.patchUtils(self.tmp)
+        gz = _gzip_bytes(b"one\n") + _gzip_bytes(b"two\n")
+        write_files("test_members", [
+            {'path': '/tmp/b64', 'encoding': 'b64',
+             'content': base64.b64encode(b"text\n").decode()},
+            {'path': '/tmp/gz', 'encoding': 'gz', 'content': gz}], LOG)
+        self.assertEqual("text\n", util.load_file('/tmp/b64'))
+        self.assertEqual("one\ntwo\n", util.load_file('/tmp/gz'))
+
+    @unittest.skipIf(six.PY2, "python 2 can not tell gzip was truncated")
+    def test_bad_gzip_leaves_nothing_behind(self):
+        self.patchUtils(self.tmp)
+        with mock.patch.object(cc_write_files, 'CHUNK_SIZE', 8):
+            self.assertRaises(
+                util.DecompressionError, write_files, "test_bad",
+                [{'path': '/tmp/bad', 'encoding': 'gz',
+                  'content': _gzip_bytes(b"x" * 100)[:-12]}], LOG)
+        self.assertEqual([], os.listdir(os.path.join(self.tmp, 'tmp')))
+
+    def test_symlink_target_replaced_with_mode(self):
+        self.patchUtils(self.tmp)
+        os.makedirs(os.path.join(self.tmp, 'etc'))
+        os.makedirs(os.path.join(self.tmp, 'run'))
+        util.write_file('/run/resolv.conf', 'old')
+        os.symlink('../run/resolv.conf',
+                   os.path.join(self.tmp, 'etc', 'resolv.conf'))
+        write_files("test_link", [{'path': '/etc/resolv.conf',
+                                   'content': 'new', 'permissions': '0600'}],
+                    LOG)
+        self.assertTrue(
+            os.path.islink(os.path.join(self.tmp, 'etc', 'resolv.conf')))
+        self.assertEqual('new', util.load_file('/run/resolv.conf'))
+        self.assertEqual(0o600, os.stat(
+            os.path.join(self.tmp, 'run', 'resolv.conf')).st_mode & 0o777)
+
+    def test_owners_resolved_and_dirs_synced_once(self):
+        self.patchUtils(self.tmp)
+        files = [{'path': '/a/%d' % i, 'content': 'x', 'owner': 'bob:staff'}
+                 for i in range(5)]
+        files.append({'path': '/b/file', 'content': 'y'})
+        with ExitStack() as mocks:
+            m_pwd = mocks.enter_context(mock.patch.object(
+                cc_write_files.pwd, 'getpwnam',
+                return_value=mock.Mock(pw_uid=1000)))
+            mocks.enter_context(mock.patch.object(
+                cc_write_files.grp, 'getgrnam',
+                return_value=mock.Mock(gr_gid=50)))
+            m_chown = mocks.enter_context(
+                mock.patch.object(util, 'chownbyid'))
+            m_fsync = mocks.enter_context(
+                mock.patch.object(util, 'fsync_dir'))
+            write_files("test_owners", files, LOG)
+        self.assertEqual(2, m_pwd.call_count)  # bob and root
+        self.assertEqual(6, m_chown.call_count)
+        self.assertEqual((1000, 50), m_chown.call_args_list[0][0][1:])
+        self.assertEqual(
+            [os.path.join(self.tmp, 'a'), os.path.join(self.tmp, 'b')],
+            sorted(c[0][0] for c in m_fsync.call_args_list))
+
 
 def _gzip_bytes(data):
     buf = six.BytesIO()
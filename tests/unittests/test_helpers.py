@@ -1,10 +1,19 @@
 """Tests of the built-in user data handlers."""
 
+import json
 import os
 
 from . import helpers as test_helpers
 
+from cloudinit import helpers
+from cloudinit.settings import PER_ALWAYS, PER_INSTANCE, PER_ONCE
 from cloudinit import sources
+from cloudinit import util
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 
 class MyDataSource(sources.DataSource):
@@ -31,3 +40,100 @@ class TestPaths(test_helpers.ResourceUsingTestCase):
         mypaths = self.getCloudPaths(myds)
 
         self.assertEqual(None, mypaths.get_ipath())
+
+
+class TestIndexSemaphores(test_helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(TestIndexSemaphores, self).setUp()
+        self.sem_path = self.tmp_path('sem')
+        self.index_fn = os.path.join(self.sem_path, helpers.SEM_INDEX_FILE)
+
+    def _index(self):
+        return json.loads(util.load_file(self.index_fn))
+
+    def _run(self, sems, name, freq=PER_INSTANCE):
+        with sems.lock(name, freq) as lk:
+            self.assertTrue(lk)
+
+    def test_markers_kept_in_one_file(self):
+        sems = helpers.IndexSemaphores(self.sem_path)
+        self._run(sems, 'config-a')
+        self._run(sems, 'config_b', PER_ONCE)
+        self.assertEqual([helpers.SEM_INDEX_FILE], os.listdir(self.sem_path))
+        self.assertEqual(['config_a', 'config_b.once'],
+                         sorted(self._index()))
+        self.assertTrue(sems.has_run('config-a', PER_INSTANCE))
+        self.assertFalse(sems.has_run('config_a', PER_ONCE))
+        self.assertFalse(sems.has_run('config_a', PER_ALWAYS))
+
+    def test_has_run_only_stats_index(self):
+        sems = helpers.IndexSemaphores(self.sem_path)
+        self._run(sems, 'config_a')
+        with mock.patch.object(helpers.os, 'stat',
+                               wraps=helpers.os.stat) as m_stat:
+            with mock.patch.object(helpers.util, 'load_file') as m_load:
+                self.assertTrue(sems.has_run('config_a', PER_INSTANCE))
+                self.assertFalse(sems.has_run('config_b', PER_INSTANCE))
+        self.assertEqual(2, m_stat.call_count)
+        self.assertEqual(0, m_load.call_count)
+
+    def test_has_run_sees_entries_of_other_writers(self):
+        first = helpers.IndexSemaphores(self.sem_path)
+        second = helpers.IndexSemaphores(self.sem_path)
+        self.assertFalse(first.has_run('config_a', PER_INSTANCE))
+        self._run(second, 'config_a')
+        self.assertTrue(first.has_run('config_a', PER_INSTANCE))
+
+    def test_runners_skip_what_another_runners_ran(self):
+        paths = mock.Mock(sem_backend='index')
+        paths.get_ipath.return_value = self.sem_path
+        functor = mock.Mock()
+        (first, second) = (helpers.Runners(paths), helpers.Runners(paths))
+        self.assertEqual((True, functor.return_value),
+                         first.run('config_b', functor, [], PER_INSTANCE))
+        second.run('config_a', functor, [], PER_INSTANCE)
+        self.assertEqual((False, None),
+                         first.run('config_a', functor, [], PER_INSTANCE))
+        self.assertEqual(2, functor.call_count)
+
+    def test_entries_of_other_writers_kept(self):
+        first = helpers.IndexSemaphores(self.sem_path)
+        second = helpers.IndexSemaphores(self.sem_path)
+        self.assertFalse(first.has_run('config_b', PER_INSTANCE))
+        self._run(second, 'config_a')
+        self._run(first, 'config_b')
+        self.assertEqual(['config_a', 'config_b'], sorted(self._index()))
+        with first.lock('config_a', PER_INSTANCE) as lk:
+            self.assertIsNone(lk)
+
+    def test_marker_files_moved_into_index(self):
+        util.write_file(os.path.join(self.sem_path, 'config_a'), "1: 2\n")
+        util.write_file(os.path.join(self.sem_path, 'config_b.once'), "")
+        sems = helpers.IndexSemaphores(self.sem_path)
+        self.assertTrue(sems.has_run('config_a', PER_INSTANCE))
+        self.assertTrue(sems.has_run('config_b', PER_ONCE))
+        self.assertEqual({'config_a': '1: 2', 'config_b.once': ''},
+                         self._index())
+        self.assertEqual([helpers.SEM_INDEX_FILE], os.listdir(self.sem_path))
+
+    def test_clear(self):
+        sems = helpers.IndexSemaphores(self.sem_path)
+        self._run(sems, 'config_a')
+        self._run(sems, 'config_b')
+        self.assertTrue(sems.clear('config-a', PER_INSTANCE))
+        self.assertFalse(sems.has_run('config_a', PER_INSTANCE))
+        self.assertEqual(['config_b'], list(self._index()))
+        sems.clear_all()
+        self.assertFalse(sems.has_run('config_b', PER_INSTANCE))
+
+    def test_runners_use_configured_backend(self):
+        myds = MyDataSource(sys_cfg={}, distro=None, paths={})
+        myds._instance_id = "i-1"
+        for (backend, cls) in (('files', helpers.FileSemaphores),
+                               ('index', helpers.IndexSemaphores),
+                               ('bogus', helpers.FileSemaphores)):
+            paths = helpers.Paths({'cloud_dir': self.tmp,
+                                   'semaphores': backend}, ds=myds)
+            runners = helpers.Runners(paths)
+            self.assertIs(cls, type(runners._get_sem(PER_INSTANCE)))
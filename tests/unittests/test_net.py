@@ -461,49 +461,95 @@ pre-down route del -net 10.0.0.0 netmask 255.0.0.0 gw 11.0.0.1 metric 3 || true
 }
 
 
-def _setup_test(tmp_dir, mock_get_devicelist, mock_sys_netdev_info,
-                mock_sys_dev_path):
-    mock_get_devicelist.return_value = ['eth1000']
-    dev_characteristics = {
-        'eth1000': {
-            "bridge": False,
-            "carrier": False,
-            "dormant": False,
-            "operstate": "down",
-            "address": "07-1C-C6-75-A4-BE",
+def _setup_test(tmp_dir, dev_characteristics=None):
+    """Populate a fake /sys/class/net under tmp_dir, return a patcher
+    pointing cloudinit.net at it."""
+    if dev_characteristics is None:
+        dev_characteristics = {
+            'eth1000': {
+                "carrier": "0",
+                "dormant": "0",
+                "operstate": "down",
+                "address": "07-1C-C6-75-A4-BE",
+                "device": None,
+            }
         }
+    sys_class_net = os.path.join(tmp_dir, "sys-class-net") + "/"
+    for dev, attrs in dev_characteristics.items():
+        for attr, value in attrs.items():
+            if value is None:
+                os.makedirs(os.path.join(sys_class_net, dev, attr))
+            else:
+                util.write_file(os.path.join(sys_class_net, dev, attr),
+                                value + "\n")
+    return mock.patch.multiple("cloudinit.net", SYS_CLASS_NET=sys_class_net,
+                               _SNAPSHOT=None)
+
+
+class TestNetSnapshot(TestCase):
+    devs = {
+        'lo': {'address': '00:00:00:00:00:00', 'carrier': '1'},
+        'eth0': {'address': '52:54:00:00:00:01', 'carrier': '0',
+                 'operstate': 'down', 'device': None},
+        'ens3': {'address': '52:54:00:00:00:02', 'carrier': '1',
+                 'operstate': 'up', 'device': None},
+        'wlan0': {'address': '52:54:00:00:00:03', 'device': None,
+                  'wireless': None, 'operstate': 'dormant'},
+        'br0': {'address': '52:54:00:00:00:04', 'carrier': '1',
+                'bridge': None},
+        'veth1': {'address': '52:54:00:00:00:05', 'carrier': '1'},
     }
 
-    def netdev_info(name, field):
-        return dev_characteristics[name][field]
-
-    mock_sys_netdev_info.side_effect = netdev_info
-
-    def sys_dev_path(devname, path=""):
-        return tmp_dir + devname + "/" + path
+    def setUp(self):
+        super(TestNetSnapshot, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        patcher = _setup_test(self.tmp_dir, self.devs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
-    for dev in dev_characteristics:
-        os.makedirs(os.path.join(tmp_dir, dev))
-        with open(os.path.join(tmp_dir, dev, 'operstate'), 'w') as fh:
-            fh.write("down")
+    def test_snapshot_contents(self):
+        snap = net.snapshot()
+        self.assertEqual(sorted(self.devs), sorted(snap))
+        self.assertEqual(
+            {'name': 'wlan0', 'address': '52:54:00:00:00:03',
+             'carrier': None, 'dormant': None, 'iflink': None,
+             'operstate': 'dormant', 'bridge': False, 'physical': True,
+             'wireless': True}, snap['wlan0'])
+        self.assertTrue(snap['br0']['bridge'])
+        self.assertFalse(snap['lo']['physical'])
+
+    def test_snapshot_is_cached_until_refresh(self):
+        snap = net.snapshot()
+        with mock.patch("cloudinit.net.os.listdir") as m_listdir:
+            self.assertIs(snap, net.snapshot())
+            self.assertEqual(0, m_listdir.call_count)
+        util.write_file(os.path.join(net.SYS_CLASS_NET, 'eth9', 'address'),
+                        '52:54:00:00:00:09\n')
+        self.assertNotIn('eth9', net.snapshot())
+        self.assertIn('eth9', net.snapshot(refresh=True))
+
+    def test_fallback_prefers_connected(self):
+        cfg = net.generate_fallback_config()
+        self.assertEqual(
+            [{'type': 'physical', 'name': 'ens3',
+              'mac_address': '52:54:00:00:00:02',
+              'subnets': [{'type': 'dhcp'}]}], cfg['config'])
 
-    mock_sys_dev_path.side_effect = sys_dev_path
+    def test_fallback_possibly_connected_prefers_eth0(self):
+        util.write_file(os.path.join(net.SYS_CLASS_NET, 'ens3', 'carrier'),
+                        '0\n')
+        cfg = net.generate_fallback_config()
+        self.assertEqual('eth0', cfg['config'][0]['name'])
 
 
 class TestSysConfigRendering(TestCase):
 
-    @mock.patch("cloudinit.net.sys_dev_path")
-    @mock.patch("cloudinit.net.sys_netdev_info")
-    @mock.patch("cloudinit.net.get_devicelist")
-    def test_default_generation(self, mock_get_devicelist,
-                                mock_sys_netdev_info,
-                                mock_sys_dev_path):
+    def test_default_generation(self):
         tmp_dir = tempfile.mkdtemp()
         self.addCleanup(shutil.rmtree, tmp_dir)
-        _setup_test(tmp_dir, mock_get_devicelist,
-                    mock_sys_netdev_info, mock_sys_dev_path)
-
-        network_cfg = net.generate_fallback_config()
+        with _setup_test(tmp_dir):
+            network_cfg = net.generate_fallback_config()
         ns = network_state.parse_net_config_data(network_cfg,
                                                  skip_broken=False)
 
@@ -549,18 +595,11 @@ USERCTL=no
 
 class TestEniNetRendering(TestCase):
 
-    @mock.patch("cloudinit.net.sys_dev_path")
-    @mock.patch("cloudinit.net.sys_netdev_info")
-    @mock.patch("cloudinit.net.get_devicelist")
-    def test_default_generation(self, mock_get_devicelist,
-                                mock_sys_netdev_info,
-                                mock_sys_dev_path):
+    def test_default_generation(self):
         tmp_dir = tempfile.mkdtemp()
         self.addCleanup(shutil.rmtree, tmp_dir)
-        _setup_test(tmp_dir, mock_get_devicelist,
-                    mock_sys_netdev_info, mock_sys_dev_path)
-
-        network_cfg = net.generate_fallback_config()
+        with _setup_test(tmp_dir):
+            network_cfg = net.generate_fallback_config()
         ns = network_state.parse_net_config_data(network_cfg,
                                                  skip_broken=False)
 
@@ -588,6 +627,154 @@ iface eth1000 inet dhcp
         self.assertEqual(expected.lstrip(), contents.lstrip())
 
 
+class TestIncrementalRendering(TestCase):
+    cfg = {
+        'version': 1,
+        'config': [
+            {"type": "physical", "name": "eth0",
+             "mac_address": "c0:d6:9f:2c:e8:80",
+             "subnets": [{"type": "dhcp4"}]},
+            {"type": "physical", "name": "eth1",
+             "mac_address": "c0:d6:9f:2c:e8:81",
+             "subnets": [{"type": "static", "address": "10.0.0.2/24"}]},
+        ]}
+
+    def setUp(self):
+        super(TestIncrementalRendering, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def _changed_cfg(self):
+        cfg = copy.deepcopy(self.cfg)
+        cfg['config'][1]['subnets'][0]['address'] = '10.0.0.3/24'
+        return network_state.parse_net_config_data(cfg)
+
+    def _render_twice(self, renderer):
+        ns = network_state.parse_net_config_data(self.cfg)
+        first = renderer.render_network_state(self.tmp_dir, ns)
+        with mock.patch('cloudinit.atomic_helper.write_file') as m_write:
+            second = renderer.render_network_state(self.tmp_dir, ns)
+        self.assertEqual(0, m_write.call_count)
+        return first, second
+
+    def test_sysconfig_only_changed_files_written(self):
+        renderer = sysconfig.Renderer()
+        first, second = self._render_twice(renderer)
+        self.assertEqual(set(['eth0', 'eth1']), first)
+        self.assertEqual(set(), second)
+        self.assertEqual(set(['eth1']), renderer.render_network_state(
+            self.tmp_dir, self._changed_cfg()))
+        with open(os.path.join(self.tmp_dir, 'etc/sysconfig/network-scripts/'
+                               'ifcfg-eth1')) as fh:
+            self.assertIn('10.0.0.3', fh.read())
+
+    def test_eni_only_changed_interfaces_returned(self):
+        renderer = eni.Renderer(
+            {'links_path_prefix': 'etc/systemd/network/50-cloud-init-',
+             'eni_path': 'etc/network/interfaces',
+             'netrules_path': 'etc/udev/rules.d/70-persistent-net.rules'})
+        first, second = self._render_twice(renderer)
+        self.assertEqual(set(['lo', 'eth0', 'eth1']), first)
+        self.assertEqual(set(), second)
+        self.assertEqual(set(['eth1']), renderer.render_network_state(
+            self.tmp_dir, self._changed_cfg()))
+        self.assertEqual(
+            ['50-cloud-init-eth0.link', '50-cloud-init-eth1.link'],
+            sorted(os.listdir(os.path.join(self.tmp_dir,
+                                           'etc/systemd/network'))))
+
+    def test_eni_stanzas_by_device(self):
+        contents = textwrap.dedent("""\
+            auto lo
+            iface lo inet loopback
+
+            auto eth0 eth0:1
+            iface eth0 inet dhcp
+                mtu 1500
+            iface eth0:1 inet static
+                address 10.0.0.2/24
+            source /etc/network/interfaces.d/*.cfg
+            """)
+        self.assertEqual(
+            {'lo': ['auto lo', 'iface lo inet loopback'],
+             'eth0': ['auto eth0', 'auto eth0:1', 'iface eth0 inet dhcp',
+                      'mtu 1500', 'iface eth0:1 inet static',
+                      'address 10.0.0.2/24']},
+            eni._stanzas_by_device(contents))
+
+
+class TestEniParsing(TestCase):
+
+    def setUp(self):
+        super(TestEniParsing, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        util.write_file(path, textwrap.dedent(content))
+        return path
+
+    def test_includes_parsed_in_order(self):
+        self._write("interfaces.d/eth1", """\
+            auto eth1
+            iface eth1 inet dhcp
+            """)
+        self._write("interfaces.d/eth0", """\
+            auto eth0
+            iface eth0 inet static
+                address 10.0.0.2
+            """)
+        self._write("interfaces.d/skip.cfg", "iface eth9 inet dhcp\n")
+        self._write("extra", "iface eth2 inet manual\n")
+        path = self._write("interfaces", """\
+            auto lo
+            iface lo inet loopback
+            source-directory interfaces.d
+            source extra*
+            """)
+        ifaces = eni.parse_deb_config(path)
+        self.assertEqual(['eth0', 'eth1', 'eth2', 'lo'], sorted(ifaces))
+        self.assertEqual('10.0.0.2', ifaces['eth0']['address'])
+        self.assertEqual(os.path.join(self.tmp_dir, 'interfaces.d/eth1'),
+                         ifaces['eth1']['_source_path'])
+        self.assertFalse(ifaces['eth2']['auto'])
+
+    def test_include_loop_is_an_error(self):
+        self._write("other", "source interfaces\n")
+        path = self._write("interfaces", "source other\n")
+        with self.assertRaises(net.ParserError) as ctx:
+            eni.parse_deb_config(path)
+        self.assertIn("other:1:", str(ctx.exception))
+
+    def test_error_reports_line_number(self):
+        data = textwrap.dedent("""\
+            auto eth0
+            # comment
+            iface eth0 inet
+            """)
+        with self.assertRaises(net.ParserError) as ctx:
+            eni.convert_eni_data(data)
+        self.assertIn("<data>:3:", str(ctx.exception))
+
+    def test_redefined_iface_reports_line_number(self):
+        data = "iface eth0 inet dhcp\n\niface eth0 inet dhcp\n"
+        with self.assertRaises(net.ParserError) as ctx:
+            eni.convert_eni_data(data)
+        self.assertIn("<data>:3: Interface eth0", str(ctx.exception))
+
+    def test_line_continuation_and_whitespace(self):
+        ifaces = {}
+        eni._parse_deb_config_data(ifaces, textwrap.dedent("""\
+            iface eth0 inet static
+                address   10.0.0.2
+                post-up echo \\
+                    hello
+            """), None, None)
+        self.assertEqual('10.0.0.2', ifaces['eth0']['address'])
+        self.assertEqual(['echo hello'], ifaces['eth0']['post-up'])
+
+
 class TestEniNetworkStateToEni(TestCase):
     mycfg = {
         'config': [{"type": "physical", "name": "eth0",
@@ -619,6 +806,73 @@ class TestEniNetworkStateToEni(TestCase):
         self.assertNotIn("hwaddress", rendered)
 
 
+class TestNetworkStateRecords(TestCase):
+    mycfg = {
+        'config': [
+            {"type": "physical", "name": "eth0",
+             "mac_address": "C0:D6:9F:2C:E8:80",
+             "subnets": [{"type": "static", "address": "10.0.0.2/24",
+                          "routes": [{"network": "10.1.0.0",
+                                      "netmask": "255.255.0.0",
+                                      "gateway": "10.0.0.1"}]}]},
+            {"type": "physical", "name": "eth1",
+             "subnets": [{"type": "dhcp6"}]},
+            {"type": "vlan", "name": "eth0.10", "vlan_id": 10,
+             "vlan_link": "eth0", "subnets": [{"type": "dhcp4"}]},
+            {"type": "route", "destination": "192.168.0.0/16",
+             "gateway": "10.0.0.1"},
+            {"type": "nameserver", "address": "8.8.8.8",
+             "search": "example.com"},
+        ],
+        'version': 1}
+
+    def setUp(self):
+        super(TestNetworkStateRecords, self).setUp()
+        self.ns = network_state.parse_net_config_data(self.mycfg)
+
+    def test_records_are_read_only(self):
+        iface = self.ns.get_interface('eth0')
+        self.assertIsInstance(iface, network_state.InterfaceRecord)
+        self.assertRaises(TypeError, iface.__setitem__, 'mtu', 9000)
+        self.assertRaises(TypeError, iface.update, {'mtu': 9000})
+        subnet = iface['subnets'][0]
+        self.assertIsInstance(subnet, network_state.SubnetRecord)
+        self.assertRaises(TypeError, subnet.pop, 'type')
+        route = list(self.ns.iter_routes())[0]
+        self.assertIsInstance(route, network_state.RouteRecord)
+        self.assertIsInstance(subnet['routes'][0],
+                              network_state.RouteRecord)
+        self.assertRaises(TypeError, route.__delitem__, 'gateway')
+
+    def test_copies_are_plain_dicts(self):
+        iface = self.ns.get_interface('eth0')
+        for dupe in (copy.copy(iface), copy.deepcopy(iface), iface.copy()):
+            self.assertEqual(dict, type(dupe))
+            self.assertEqual(dict(iface), dupe)
+        self.assertEqual(dict, type(copy.deepcopy(iface)['subnets'][0]))
+
+    def test_lookups(self):
+        self.assertEqual(['eth0', 'eth1'],
+                         sorted(i['name'] for i in
+                                self.ns.iter_interfaces_by_type('physical')))
+        self.assertEqual(['eth0.10'],
+                         [i['name'] for i in
+                          self.ns.iter_interfaces_by_type('vlan')])
+        self.assertEqual([], list(self.ns.iter_interfaces_by_type('bond')))
+        self.assertIsNone(self.ns.get_interface('eth9'))
+        self.assertEqual(
+            ['eth0'], [i['name'] for i in
+                       self.ns.get_interfaces_by_mac('c0:d6:9f:2c:e8:80')])
+        self.assertEqual(['8.8.8.8'], self.ns.dns_nameservers)
+        self.assertEqual(['example.com'], self.ns.dns_searchdomains)
+
+    def test_rendering_does_not_change_state(self):
+        before = [copy.deepcopy(i) for i in self.ns.iter_interfaces()]
+        eni.network_state_to_eni(self.ns)
+        sysconfig.Renderer()._render_sysconfig('etc/sysconfig/', self.ns)
+        self.assertEqual(before, list(self.ns.iter_interfaces()))
+
+
 class TestCmdlineConfigParsing(TestCase):
     simple_cfg = {
         'config': [{"type": "physical", "name": "eth0",
@@ -7,7 +7,17 @@ from cloudinit import reporting
 from cloudinit.reporting import events
 from cloudinit.reporting import handlers
 
+import json
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+
 import mock
+from six.moves import BaseHTTPServer
 
 from .helpers import TestCase
 
@@ -156,6 +166,302 @@ class TestLogHandler(TestCase):
                       getLogger.return_value.log.call_args[0][1])
 
 
+class _Collector(BaseHTTPServer.HTTPServer):
+    """A local webhook endpoint recording the json it is sent."""
+
+    def __init__(self):
+        collector = self
+        self.posts = []
+        self.status = 200
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                body = json.loads(self.rfile.read(length).decode())
+                if collector.status == 200:
+                    collector.posts.append(body)
+                self.send_response(collector.status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%s/' % self.server_port
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       args=(0.01,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestBatchedWebHookHandler(TestCase):
+
+    def setUp(self):
+        super(TestBatchedWebHookHandler, self).setUp()
+        self.collector = _Collector()
+        self.addCleanup(self.collector.stop)
+
+    def _handler(self, **kwargs):
+        kwargs.setdefault('flush_interval', 60)
+        return handlers.BatchedWebHookHandler(self.collector.url, **kwargs)
+
+    def _publish(self, handler, count):
+        for i in range(count):
+            handler.publish_event(
+                events.ReportingEvent('start', 'ev%d' % i, 'description'))
+
+    def _posted_names(self):
+        return [[e['name'] for e in post] for post in self.collector.posts]
+
+    def test_events_posted_in_batches(self):
+        handler = self._handler(batch_size=3)
+        self._publish(handler, 7)
+        self.assertTrue(handler.flush())
+        self.assertEqual([['ev0', 'ev1', 'ev2'], ['ev3', 'ev4', 'ev5'],
+                          ['ev6']], self._posted_names())
+
+    def test_publish_does_not_post(self):
+        handler = self._handler(batch_size=10)
+        with mock.patch.object(handlers.url_helper, 'readurl') as m_readurl:
+            self._publish(handler, 5)
+            self.assertEqual(0, m_readurl.call_count)
+            handler.flush()
+            self.assertEqual(1, m_readurl.call_count)
+
+    def test_posted_after_flush_interval(self):
+        handler = self._handler(flush_interval=0.01)
+        self._publish(handler, 2)
+        for _ in range(50):
+            if self.collector.posts:
+                break
+            time.sleep(0.01)
+        self.assertEqual([['ev0', 'ev1']], self._posted_names())
+
+    def test_failed_post_retried(self):
+        self.collector.status = 500
+        handler = self._handler(batch_size=2, backoff=0.01)
+        self._publish(handler, 3)
+        self.assertFalse(handler.flush(timeout=0.2))
+        self.assertEqual([], self.collector.posts)
+        self.collector.status = 200
+        self.assertTrue(handler.flush())
+        self.assertEqual([['ev0', 'ev1'], ['ev2']], self._posted_names())
+
+    def test_queue_bounded_while_endpoint_down(self):
+        self.collector.status = 500
+        handler = self._handler(batch_size=2, max_queue=4, backoff=0.01)
+        self._publish(handler, 10)
+        self.assertFalse(handler.flush(timeout=0.2))
+        self.assertEqual(6, handler.dropped)
+        self.collector.status = 200
+        self.assertTrue(handler.flush())
+        self.assertEqual([['ev6', 'ev7'], ['ev8', 'ev9']],
+                         self._posted_names())
+
+    def test_flush_events_flushes_registered_handlers(self):
+        handler = self._handler()
+        self._publish(handler, 2)
+        registry = mock.Mock(registered_items={'batched': handler})
+        with mock.patch.object(reporting, 'instantiated_handler_registry',
+                               registry):
+            reporting.flush_events()
+        self.assertEqual([['ev0', 'ev1']], self._posted_names())
+
+    @mock.patch.dict(reporting._configured, clear=True)
+    @mock.patch.object(
+        reporting, 'instantiated_handler_registry', reporting.DictRegistry())
+    def test_reapplied_config_keeps_pending_events(self):
+        config = {'batched': {'type': 'batched_webhook', 'flush_interval': 60,
+                              'endpoint': self.collector.url}}
+        reporting.update_configuration(config)
+        handler = reporting.instantiated_handler_registry.registered_items[
+            'batched']
+        self._publish(handler, 3)
+        reporting.update_configuration(config)
+        self.assertIs(handler, reporting.instantiated_handler_registry.
+                      registered_items['batched'])
+        reporting.flush_events()
+        self.assertEqual([['ev0', 'ev1', 'ev2']], self._posted_names())
+
+    @mock.patch.dict(reporting._configured, clear=True)
+    @mock.patch.object(
+        reporting, 'instantiated_handler_registry', reporting.DictRegistry())
+    def test_replaced_handler_flushed_and_stopped(self):
+        config = {'type': 'batched_webhook', 'flush_interval': 60,
+                  'endpoint': self.collector.url}
+        reporting.update_configuration({'batched': config})
+        old = reporting.instantiated_handler_registry.registered_items[
+            'batched']
+        self._publish(old, 2)
+        reporting.update_configuration(
+            {'batched': dict(config, batch_size=10)})
+        self.assertEqual([['ev0', 'ev1']], self._posted_names())
+        old._thread.join(5)
+        self.assertFalse(old._thread.is_alive())
+        self.assertIsNot(old, reporting.instantiated_handler_registry.
+                         registered_items['batched'])
+
+
+class TestJsonLinesHandler(TestCase):
+
+    def setUp(self):
+        super(TestJsonLinesHandler, self).setUp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'run', 'events.jsonl')
+
+    def _lines(self):
+        with open(self.path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_events_appended_with_context(self):
+        handler = handlers.JsonLinesHandler(path=self.path)
+        registry = mock.Mock(registered_items={'jsonl': handler})
+        with mock.patch('cloudinit.reporting.events.'
+                        'instantiated_handler_registry', registry):
+            parent = events.ReportEventStack('init-network', 'init')
+            with parent:
+                with events.ReportEventStack('search', 'ds', parent=parent):
+                    pass
+        lines = self._lines()
+        self.assertEqual(
+            [('start', 'init-network', None),
+             ('start', 'init-network/search', 'init-network'),
+             ('finish', 'init-network/search', 'init-network'),
+             ('finish', 'init-network', None)],
+            [(l['event_type'], l['name'], l['parent']) for l in lines])
+        for line in lines:
+            self.assertEqual('init-network', line['stage'])
+            self.assertEqual(os.getpid(), line['pid'])
+            self.assertIn('timestamp', line)
+        self.assertEqual('SUCCESS', lines[-1]['result'])
+        self.assertTrue(lines[0]['monotonic'] <= lines[-1]['monotonic'])
+
+    def test_file_opened_once_and_appended_to(self):
+        handler = handlers.JsonLinesHandler(path=self.path)
+        handler.publish_event(events.ReportingEvent('start', 'a', 'a'))
+        with mock.patch.object(handlers.os, 'open') as m_open:
+            handler.publish_event(events.ReportingEvent('start', 'b', 'b'))
+            # line buffered, so already on disk
+            self.assertEqual(['a', 'b'], [l['name'] for l in self._lines()])
+        self.assertEqual(0, m_open.call_count)
+        handlers.JsonLinesHandler(path=self.path).publish_event(
+            events.ReportingEvent('start', 'c', 'c'))
+        self.assertEqual(['a', 'b', 'c'], [l['name'] for l in self._lines()])
+
+    @mock.patch.dict(reporting._configured, clear=True)
+    @mock.patch.object(
+        reporting, 'instantiated_handler_registry', reporting.DictRegistry())
+    def test_replaced_handler_file_closed(self):
+        reporting.update_configuration(
+            {'jsonl': {'type': 'jsonl', 'path': self.path}})
+        old = reporting.instantiated_handler_registry.registered_items['jsonl']
+        old.publish_event(events.ReportingEvent('start', 'a', 'a'))
+        fp = old._fp
+        reporting.update_configuration(
+            {'jsonl': {'type': 'jsonl', 'path': self.path, 'mode': 0o600}})
+        self.assertTrue(fp.closed)
+        reporting.instantiated_handler_registry.registered_items[
+            'jsonl'].publish_event(events.ReportingEvent('start', 'b', 'b'))
+        self.assertEqual(['a', 'b'], [l['name'] for l in self._lines()])
+
+    def test_write_failure_only_warns(self):
+        handler = handlers.JsonLinesHandler(path=self.path)
+        with mock.patch.object(handlers.os, 'open',
+                               side_effect=OSError("read-only")):
+            handler.publish_event(events.ReportingEvent('start', 'a', 'a'))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_configured_by_type(self):
+        self.assertIs(handlers.JsonLinesHandler,
+                      handlers.available_handlers.registered_items['jsonl'])
+
+
+class TestUnixSocketHandlers(TestCase):
+
+    def setUp(self):
+        super(TestUnixSocketHandlers, self).setUp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'events.sock')
+        self.reader = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(self.reader.close)
+        self.reader.bind(self.path)
+        self.reader.settimeout(1)
+
+    def _parse_journal(self, data):
+        fields = {}
+        while data:
+            (line, data) = data.split(b'\n', 1)
+            if b'=' in line:
+                (key, value) = line.split(b'=', 1)
+            else:
+                (size,) = struct.unpack('<Q', data[:8])
+                (key, value) = (line, data[8:8 + size])
+                data = data[8 + size + 1:]
+            fields[key.decode()] = value.decode()
+        return fields
+
+    def test_event_sent_as_json_datagram(self):
+        handler = handlers.UnixSocketHandler(path=self.path)
+        event = events.ReportingEvent('start', 'init/search', 'searching')
+        handler.publish_event(event)
+        self.assertEqual(event.as_dict(),
+                         json.loads(self.reader.recv(65536).decode()))
+
+    def test_close_closes_socket(self):
+        handler = handlers.UnixSocketHandler(path=self.path)
+        with mock.patch.object(handlers.socket, 'socket') as m_socket:
+            handler.publish_event(events.ReportingEvent('start', 'a', 'a'))
+        handler.close()
+        m_socket.return_value.close.assert_called_once_with()
+        self.assertIsNone(handler._sock)
+
+    def test_slow_reader_drops_events(self):
+        handler = handlers.UnixSocketHandler(path=self.path)
+        for i in range(5000):
+            handler.publish_event(
+                events.ReportingEvent('start', 'ev%d' % i, 'x' * 1000))
+            if handler.dropped:
+                break
+        self.assertEqual(1, handler.dropped)
+        self.assertEqual('ev0', json.loads(
+            self.reader.recv(65536).decode())['name'])
+
+    def test_missing_socket_drops_events(self):
+        handler = handlers.UnixSocketHandler(path=self.path + '.missing')
+        handler.publish_event(events.ReportingEvent('start', 'a', 'a'))
+        handler.publish_event(events.ReportingEvent('start', 'b', 'b'))
+        self.assertEqual(2, handler.dropped)
+
+    def test_journald_fields(self):
+        handler = handlers.JournaldHandler(path=self.path)
+        handler.publish_event(events.FinishReportingEvent(
+            'init/search', 'multi\nline', result=events.status.FAIL))
+        fields = self._parse_journal(self.reader.recv(65536))
+        self.assertEqual('finish: init/search: FAIL: multi\nline',
+                         fields['MESSAGE'])
+        self.assertEqual('4', fields['PRIORITY'])
+        self.assertEqual('cloud-init', fields['SYSLOG_IDENTIFIER'])
+        self.assertEqual('finish', fields['CLOUDINIT_EVENT_TYPE'])
+        self.assertEqual('init/search', fields['CLOUDINIT_NAME'])
+        self.assertEqual('FAIL', fields['CLOUDINIT_RESULT'])
+        self.assertEqual('multi\nline', fields['CLOUDINIT_DESCRIPTION'])
+
+    def test_configured_from_reporting_config(self):
+        registry = reporting.instantiated_handler_registry
+        self.addCleanup(registry.unregister_item, 'agent', force=True)
+        reporting.update_configuration(
+            {'agent': {'type': 'unix_socket', 'path': self.path}})
+        handler = registry.registered_items['agent']
+        self.assertIsInstance(handler, handlers.UnixSocketHandler)
+        self.assertEqual(self.path, handler.path)
+
+
 class TestDefaultRegisteredHandler(TestCase):
 
     def test_log_handler_registered_by_default(self):
@@ -238,6 +544,30 @@ class TestReportingConfiguration(TestCase):
         reporting.update_configuration({handler_name: None})
         self.assertEqual(
             0, len(reporting.instantiated_handler_registry.registered_items))
+        handler_cls.return_value.close.assert_called_once_with()
+
+    @mock.patch.dict(reporting._configured, clear=True)
+    @mock.patch.object(
+        reporting, 'instantiated_handler_registry', reporting.DictRegistry())
+    @mock.patch.object(reporting, 'available_handlers')
+    def test_unchanged_handler_kept_changed_one_closed(
+            self, available_handlers):
+        handler_cls = mock.Mock(side_effect=lambda **kw: mock.Mock())
+        available_handlers.registered_items = {'test_handler': handler_cls}
+        config = {'my_test_handler': {'type': 'test_handler', 'foo': 'bar'}}
+        reporting.update_configuration(config)
+        first = reporting.instantiated_handler_registry.registered_items[
+            'my_test_handler']
+        reporting.update_configuration(config)
+        self.assertEqual(1, handler_cls.call_count)
+        self.assertEqual(0, first.close.call_count)
+        reporting.update_configuration(
+            {'my_test_handler': {'type': 'test_handler', 'foo': 'baz'}})
+        self.assertEqual(2, handler_cls.call_count)
+        first.close.assert_called_once_with()
+        self.assertIsNot(
+            first, reporting.instantiated_handler_registry.registered_items[
+                'my_test_handler'])
 
 
 class TestReportingEventStack(TestCase):
@@ -4,10 +4,16 @@ import tempfile
 
 from .. import helpers
 
+from cloudinit import distros
 from cloudinit.settings import PER_INSTANCE
 from cloudinit import stages
 from cloudinit import util
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 
 class TestSimpleRun(helpers.FilesystemMockingTestCase):
     def _patchIn(self, root):
@@ -79,3 +85,29 @@ class TestSimpleRun(helpers.FilesystemMockingTestCase):
         self.assertIn('write-files', which_ran)
         contents = util.load_file('/etc/blah.ini')
         self.assertEqual(contents, 'blah')
+
+
+class TestModulesReporter(helpers.TestCase):
+
+    def test_cloud_reporter_restored_after_each_module(self):
+        seen = []
+        init = mock.Mock(cfg={}, reporter=None)
+        cloud = init.cloudify.return_value
+        cloud.reporter = original = object()
+        cloud.distro = distros.fetch("ubuntu")("ubuntu", {}, None)
+
+        def run(_name, func, args, freq):
+            seen.append(cloud.reporter)
+            if len(seen) == 2:
+                raise RuntimeError("module failed")
+            return (True, None)
+        cloud.run.side_effect = run
+        mods = [[mock.Mock(frequency=PER_INSTANCE), name, None, []]
+                for name in ('one', 'two')]
+        runner = stages.Modules(init)
+        runner._cached_cfg = {}
+        (_ran, failures) = runner._run_modules(mods)
+        self.assertEqual(['two'], [f[0] for f in failures])
+        self.assertEqual(['config-one', 'config-two'],
+                         [r.name for r in seen])
+        self.assertIs(original, cloud.reporter)
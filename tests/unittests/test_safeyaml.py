@@ -0,0 +1,72 @@
+from cloudinit import safeyaml
+from cloudinit import util
+
+from . import helpers
+
+import glob
+import os
+
+import yaml
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+
+def _load_with(loader, blob):
+    try:
+        return yaml.load(blob, Loader=loader)
+    except yaml.YAMLError:
+        return yaml.YAMLError
+
+
+@helpers.skipIf(safeyaml._CustomCSafeLoader is None,
+                "pyyaml was built without libyaml")
+class TestCSafeLoader(helpers.ResourceUsingTestCase):
+
+    def _sources(self):
+        top = os.path.dirname(os.path.abspath(self.resourceLocation()))
+        top = os.path.dirname(top)
+        files = [os.path.join(top, 'config', 'cloud.cfg')]
+        files.extend(sorted(glob.glob(
+            os.path.join(top, 'doc', 'examples', '*.txt'))))
+        files.extend(sorted(glob.glob(
+            os.path.join(top, 'doc', 'examples', 'seed', '*'))))
+        return [f for f in files if os.path.isfile(f)]
+
+    def test_same_results_as_python_loader(self):
+        sources = self._sources()
+        self.assertTrue(len(sources) > 20)
+        for fname in sources:
+            blob = util.load_file(fname)
+            self.assertEqual(
+                _load_with(safeyaml._CustomSafeLoader, blob),
+                _load_with(safeyaml._CustomCSafeLoader, blob),
+                "%s loads differently with libyaml" % fname)
+
+    def test_python_unicode_tag(self):
+        blob = "a: !!python/unicode 'b'\nc: [1, 2.5, true, null]\n"
+        self.assertEqual({'a': 'b', 'c': [1, 2.5, True, None]},
+                         _load_with(safeyaml._CustomCSafeLoader, blob))
+
+    def test_other_python_tags_refused(self):
+        blob = "a: !!python/object/apply:os.system ['true']\n"
+        self.assertRaises(yaml.constructor.ConstructorError, yaml.load,
+                          blob, Loader=safeyaml._CustomCSafeLoader)
+
+    def test_load_uses_libyaml(self):
+        with mock.patch.object(safeyaml._CustomSafeLoader, '__init__',
+                               side_effect=AssertionError("pure python")):
+            self.assertEqual({'a': 1}, safeyaml.load("a: 1\n"))
+
+    def test_falls_back_to_python_parser(self):
+        def fail(*args, **kwargs):
+            raise yaml.YAMLError("libyaml says no")
+
+        with mock.patch.object(safeyaml._CustomCSafeLoader, '__init__',
+                               side_effect=fail):
+            self.assertEqual({'a': 1}, safeyaml.load("a: 1\n"))
+
+    def test_invalid_yaml_still_raises(self):
+        self.assertRaises(yaml.YAMLError, safeyaml.load, "a: [1\n")
@@ -3,6 +3,10 @@ from mock import patch
 from . import helpers as test_helpers
 from cloudinit import ssh_util
 
+import os
+import shutil
+import tempfile
+
 
 VALID_CONTENT = {
     'dsa': (
@@ -168,4 +172,109 @@ class TestParseSSHConfig(test_helpers.TestCase):
         self.assertEqual('foo', ret[0].key)
         self.assertEqual('bar', ret[0].value)
 
+
+def _nested_update_authorized_keys(old_entries, keys):
+    # the original O(n*m) merge, kept to check the indexed one against
+    to_add = list(keys)
+    for i in range(0, len(old_entries)):
+        ent = old_entries[i]
+        if not ent.valid():
+            continue
+        for k in keys:
+            if not ent.valid():
+                continue
+            if k.base64 == ent.base64:
+                ent = k
+                if k in to_add:
+                    to_add.remove(k)
+        old_entries[i] = ent
+    for key in to_add:
+        old_entries.append(key)
+    lines = [str(b) for b in old_entries]
+    lines.append('')
+    return '\n'.join(lines)
+
+
+class TestUpdateAuthorizedKeys(test_helpers.TestCase):
+
+    def _parse(self, lines):
+        parser = ssh_util.AuthKeyLineParser()
+        return [parser.parse(line) for line in lines]
+
+    def _check_same(self, old_lines, new_lines):
+        expected = _nested_update_authorized_keys(
+            self._parse(old_lines), self._parse(new_lines))
+        found = ssh_util.update_authorized_keys(
+            self._parse(old_lines), self._parse(new_lines))
+        self.assertEqual(expected, found)
+        return found
+
+    def test_replaces_in_place_and_appends_in_order(self):
+        old = ['# header',
+               'ssh-rsa %s old-rsa' % VALID_CONTENT['rsa'],
+               '',
+               'ssh-dss %s old-dsa' % VALID_CONTENT['dsa']]
+        new = ['ecdsa-sha2-nistp256 %s new-ecdsa' % VALID_CONTENT['ecdsa'],
+               'ssh-dss %s new-dsa' % VALID_CONTENT['dsa']]
+        found = self._check_same(old, new)
+        self.assertEqual(
+            ['# header', 'ssh-rsa %s old-rsa' % VALID_CONTENT['rsa'], '',
+             'ssh-dss %s new-dsa' % VALID_CONTENT['dsa'],
+             'ecdsa-sha2-nistp256 %s new-ecdsa' % VALID_CONTENT['ecdsa'],
+             ''], found.split('\n'))
+
+    def test_duplicates_and_invalid_lines(self):
+        rsa = VALID_CONTENT['rsa']
+        old = ['ssh-rsa %s one' % rsa, 'garbage', 'ssh-rsa %s two' % rsa]
+        new = ['ssh-rsa %s three' % rsa, 'not a key', '',
+               'ssh-rsa %s four' % rsa,
+               'ssh-dss %s five' % VALID_CONTENT['dsa'],
+               'ssh-dss %s six' % VALID_CONTENT['dsa']]
+        self._check_same(old, new)
+
+    def test_many_keys(self):
+        old = ['ssh-rsa AAAA%05d old%d' % (i, i) for i in range(0, 300, 2)]
+        new = ['ssh-rsa AAAA%05d new%d' % (i, i) for i in range(0, 300, 3)]
+        self._check_same(old, new)
+
+    def test_empty(self):
+        self.assertEqual('', self._check_same([], []))
+
+
+class TestParseSSHConfigMap(test_helpers.TestCase):
+
+    def setUp(self):
+        super(TestParseSSHConfigMap, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.fname = os.path.join(self.tmp, 'sshd_config')
+        patcher = patch.object(ssh_util, '_SSHD_CFG_CACHE', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, content):
+        with open(self.fname, 'w') as fp:
+            fp.write(content)
+
+    def test_parse_reused_while_unchanged(self):
+        self._write('AuthorizedKeysFile %h/keys\n')
+        with patch.object(ssh_util, 'parse_ssh_config',
+                          wraps=ssh_util.parse_ssh_config) as m_parse:
+            first = ssh_util.parse_ssh_config_map(self.fname)
+            first['mutated'] = True
+            second = ssh_util.parse_ssh_config_map(self.fname)
+        self.assertEqual({'authorizedkeysfile': '%h/keys'}, second)
+        self.assertEqual(1, m_parse.call_count)
+
+    def test_change_is_noticed(self):
+        self._write('AuthorizedKeysFile %h/keys\n')
+        ssh_util.parse_ssh_config_map(self.fname)
+        self._write('AuthorizedKeysFile %h/other_keys\n')
+        self.assertEqual({'authorizedkeysfile': '%h/other_keys'},
+                         ssh_util.parse_ssh_config_map(self.fname))
+
+    def test_missing_file(self):
+        self.assertEqual({}, ssh_util.parse_ssh_config_map(
+            os.path.join(self.tmp, 'missing')))
+
 # vi: ts=4 expandtab
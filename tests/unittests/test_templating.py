@@ -19,9 +19,16 @@
 from __future__ import print_function
 
 from . import helpers as test_helpers
+import os
 import textwrap
 
 from cloudinit import templater
+from cloudinit import util
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 
 try:
     import Cheetah
@@ -117,3 +124,56 @@ $a,$b'''
                                           {'mirror': mirror,
                                            'codename': codename})
         self.assertEqual(ex_data, out_data)
+
+
+class TestTemplateCache(test_helpers.TempDirTestCase):
+
+    def setUp(self):
+        super(TestTemplateCache, self).setUp()
+        self.addCleanup(templater.set_bytecode_cache_dir, None)
+        templater.set_bytecode_cache_dir(None)
+
+    def test_file_compiled_once(self):
+        tmpl = self.tmp_path('hosts.tmpl')
+        util.write_file(tmpl, "## template:jinja\n{{a}}\n")
+        with mock.patch.object(templater.util, 'load_file',
+                               wraps=util.load_file) as m_load:
+            self.assertEqual("1\n", templater.render_from_file(tmpl, {'a': 1}))
+            self.assertEqual("2\n", templater.render_from_file(tmpl, {'a': 2}))
+            self.assertEqual(1, m_load.call_count)
+            util.write_file(tmpl, "## template:jinja\nb={{a}}\n")
+            self.assertEqual("b=3\n",
+                             templater.render_from_file(tmpl, {'a': 3}))
+            self.assertEqual(2, m_load.call_count)
+
+    def test_string_compiled_once(self):
+        with mock.patch.object(templater, 'detect_template',
+                               wraps=templater.detect_template) as m_detect:
+            for i in range(3):
+                self.assertEqual("deb %s main" % i, templater.render_string(
+                    "deb $mirror main", {'mirror': i}))
+        self.assertEqual(1, m_detect.call_count)
+
+    def test_basic_lookup_errors(self):
+        self.assertRaises(KeyError, templater.render_string,
+                          "$a.c", {'a': {'b': 1}})
+        self.assertRaises(TypeError, templater.render_string,
+                          "${a.b.c}", {'a': {'b': 1}})
+        self.assertEqual("no substitutions",
+                         templater.basic_render("no substitutions", {}))
+
+    @test_helpers.skipIf(not templater.JINJA_AVAILABLE, 'jinja not available')
+    def test_jinja_bytecode_cached_on_disk(self):
+        cache_dir = self.tmp_path('cache')
+        blob = "## template:jinja\n{% for i in a %}{{i}},{% endfor %}\n"
+        templater.set_bytecode_cache_dir(cache_dir)
+        self.assertEqual("1,2,\n",
+                         templater.render_string(blob, {'a': [1, 2]}))
+        self.assertEqual(1, len(os.listdir(cache_dir)))
+        # as if in a new process
+        templater.set_bytecode_cache_dir(cache_dir)
+        with mock.patch.object(templater.jinja2.Environment, 'compile',
+                               side_effect=AssertionError("compiled")):
+            self.assertEqual("3,\n", templater.render_string(blob, {'a': [3]}))
+        templater.set_bytecode_cache_dir(None)
+        self.assertEqual("4,\n", templater.render_string(blob, {'a': [4]}))
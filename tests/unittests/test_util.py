@@ -1,10 +1,12 @@
 from __future__ import print_function
 
+import json
 import logging
 import os
 import shutil
 import stat
 import tempfile
+import time
 
 import six
 import yaml
@@ -129,6 +131,19 @@ class TestWriteFile(helpers.TestCase):
             create_contents = f.read()
             self.assertEqual("LINE1\nHey there", create_contents)
 
+    def test_atomic_write_synced_before_rename(self):
+        path = os.path.join(self.tmp, "NewFile.txt")
+        calls = []
+        (fsync, rename) = (os.fsync, os.rename)
+        with mock.patch.object(util.os, 'fsync') as m_fsync:
+            m_fsync.side_effect = lambda *a: calls.append('fsync') or fsync(*a)
+            with mock.patch.object(util.os, 'rename') as m_rename:
+                m_rename.side_effect = (
+                    lambda *a: calls.append('rename') or rename(*a))
+                util.write_file_atomic(path, ["Hey ", "there"])
+        self.assertEqual(['fsync', 'rename'], calls)
+        self.assertEqual("Hey there", util.load_file(path))
+
     def test_restorecon_if_possible_is_called(self):
         """Make sure the selinux guard is called correctly."""
         my_file = os.path.join(self.tmp, "my_file")
@@ -604,6 +619,292 @@ class TestSubp(helpers.TestCase):
                          util.target_path("/target/", "///my/path/"))
 
 
+class TestProbeDevices(helpers.TestCase):
+
+    def setUp(self):
+        super(TestProbeDevices, self).setUp()
+        patcher = mock.patch.object(util, 'mounts', return_value={'m': 1})
+        self.m_mounts = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_in_device_order(self):
+        def cb(dev, mounted):
+            if dev == '/dev/sdb':
+                raise util.MountFailedError("nope")
+            return dev.upper()
+
+        devs = ['/dev/sda', '/dev/sdb', '/dev/sdc', '/dev/sdd', '/dev/sde']
+        results = list(util.probe_devices(devs, cb, max_workers=2))
+        self.assertEqual(devs, [r[0] for r in results])
+        self.assertEqual(['/DEV/SDA', None, '/DEV/SDC', '/DEV/SDD',
+                          '/DEV/SDE'], [r[1] for r in results])
+        self.assertIsInstance(results[1][2], util.MountFailedError)
+        self.assertEqual([None, None, None], [r[2] for r in results[2:]])
+
+    def test_mount_table_read_once(self):
+        seen = []
+
+        def cb(dev, mounted):
+            seen.append(mounted)
+
+        list(util.probe_devices(['a', 'b', 'c'], cb))
+        self.assertEqual([{'m': 1}] * 3, seen)
+        self.assertEqual(1, self.m_mounts.call_count)
+
+    def test_stops_probing_when_consumer_stops(self):
+        probed = []
+
+        def cb(dev, mounted):
+            probed.append(dev)
+            return dev
+
+        devs = ['a', 'b', 'c', 'd', 'e', 'f']
+        for (dev, _ret, _exc) in util.probe_devices(devs, cb, max_workers=2):
+            if dev == 'a':
+                break
+        self.assertEqual(['a', 'b'], sorted(probed))
+
+
+class TestParallelMap(helpers.TestCase):
+
+    def test_results_in_item_order(self):
+        def func(item):
+            if item == 3:
+                raise ValueError("three")
+            return item * 2
+
+        results = util.parallel_map(func, range(6), max_workers=3)
+        self.assertEqual([0, 2, 4, None, 8, 10], [r[0] for r in results])
+        self.assertIsInstance(results[3][1], ValueError)
+        self.assertEqual([None] * 5,
+                         [r[1] for i, r in enumerate(results) if i != 3])
+
+    def test_empty_items(self):
+        self.assertEqual([], util.parallel_map(lambda i: i, []))
+
+
+class TestRunparts(helpers.TestCase):
+
+    def setUp(self):
+        super(TestRunparts, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.log = os.path.join(self.tmp, 'log')
+        self.logs = six.StringIO()
+        handler = logging.StreamHandler(self.logs)
+        handler.setLevel(logging.DEBUG)
+        util.LOG.addHandler(handler)
+        self.addCleanup(util.LOG.removeHandler, handler)
+        self.addCleanup(util.LOG.setLevel, util.LOG.level)
+        util.LOG.setLevel(logging.DEBUG)
+
+    def _script(self, name, body="", mode=0o755):
+        path = os.path.join(self.tmp, 'parts', name)
+        util.write_file(path, "#!/bin/sh\n%s\necho %s >> %s\n" %
+                        (body, name, self.log), mode=mode)
+        return path
+
+    def test_groups_by_number_prefix(self):
+        paths = ['/s/01-a', '/s/10-b', '/s/10_c', '/s/10.d', '/s/abc',
+                 '/s/def', '/s/20-e', '/s/10-f']
+        self.assertEqual(
+            [['/s/01-a'], ['/s/10-b', '/s/10_c', '/s/10.d'], ['/s/abc'],
+             ['/s/def'], ['/s/20-e'], ['/s/10-f']],
+            util.runparts_groups(paths))
+
+    def test_runs_executables_in_order(self):
+        for name in ('10-b', '10-a', 'c'):
+            self._script(name)
+        self._script('10-skipped', mode=0o644)
+        util.runparts(os.path.join(self.tmp, 'parts'))
+        self.assertEqual("10-a\n10-b\nc\n", util.load_file(self.log))
+
+    def test_group_runs_concurrently(self):
+        # each script waits for the other to have started
+        wait = ("touch %s/$(basename $0).started\n"
+                "for i in $(seq 100); do\n"
+                "  [ -e %s/$OTHER.started ] && break\n"
+                "  sleep 0.05\n"
+                "done\n"
+                "[ -e %s/$OTHER.started ]") % ((self.tmp,) * 3)
+        self._script('10-a', "OTHER=10-b\n" + wait)
+        self._script('10-b', "OTHER=10-a\n" + wait)
+        self._script('20-c')
+        util.runparts(os.path.join(self.tmp, 'parts'), max_workers=2)
+        lines = util.load_file(self.log).splitlines()
+        self.assertEqual(['10-a', '10-b'], sorted(lines[:2]))
+        self.assertEqual('20-c', lines[2])
+
+    def test_failures_counted(self):
+        self._script('10-a', "exit 1")
+        self._script('10-b')
+        self._script('20-c', "exit 2")
+        for workers in (1, 4):
+            with self.assertRaises(RuntimeError) as ctx:
+                util.runparts(os.path.join(self.tmp, 'parts'),
+                              max_workers=workers)
+            self.assertIn("2 failures in 3 attempted",
+                          str(ctx.exception))
+
+    def test_missing_dir_skipped(self):
+        util.runparts(os.path.join(self.tmp, 'nope'))
+
+    def _run_captured(self, **kwargs):
+        (out, err) = (six.BytesIO(), six.BytesIO())
+        with mock.patch.object(util.sys, 'stdout', out):
+            with mock.patch.object(util.sys, 'stderr', err):
+                try:
+                    util.runparts(os.path.join(self.tmp, 'parts'), **kwargs)
+                except RuntimeError:
+                    pass
+        return (out.getvalue(), err.getvalue())
+
+    def test_lone_script_output_passed_on_logged_and_recorded(self):
+        self._script('10-a', "echo out-a; echo err-a >&2; exit 3")
+        self._script('20-b', "printf out-b")
+        ledger = os.path.join(self.tmp, 'ledger.jsonl')
+        (out, err) = self._run_captured(ledger=ledger)
+        self.assertEqual(b"out-a\nout-b", out)
+        self.assertEqual(b"err-a\n", err)
+        logs = self.logs.getvalue()
+        for line in ('10-a: out-a', '10-a: err-a', '20-b: out-b'):
+            self.assertIn(line, logs)
+        records = [json.loads(line) for line in
+                   util.load_file(ledger).splitlines()]
+        self.assertEqual([3, 0], [r['exit_code'] for r in records])
+        self.assertEqual([6, 5], [r['stdout_bytes'] for r in records])
+        self.assertEqual([6, 0], [r['stderr_bytes'] for r in records])
+
+    def test_output_passed_on_to_text_stream(self):
+        self._script('10-a', "echo out-a")
+        self._script('10-b', "echo out-b")
+        for workers in (1, 2):
+            out = six.StringIO()
+            with mock.patch.object(util.sys, 'stdout', out):
+                util.runparts(os.path.join(self.tmp, 'parts'),
+                              max_workers=workers)
+            self.assertEqual("out-a\nout-b\n", out.getvalue())
+
+    def test_lone_script_output_not_held(self):
+        # the script fails unless its first line is passed on while it runs
+        seen = os.path.join(self.tmp, 'seen')
+        self._script('10-a', "echo first\nfor i in $(seq 100); do\n"
+                     "  [ -e %s ] && break\n  sleep 0.05\ndone\n"
+                     "[ -e %s ] || exit 1" % (seen, seen))
+
+        class Stream(six.BytesIO):
+            def write(stream, data):
+                open(seen, 'w').close()
+                return six.BytesIO.write(stream, data)
+
+        out = Stream()
+        with mock.patch.object(util.sys, 'stdout', out):
+            util.runparts(os.path.join(self.tmp, 'parts'))
+        self.assertEqual(b"first\n", out.getvalue())
+
+    def test_concurrent_output_passed_on_logged_and_recorded(self):
+        self._script('10-a', "echo out-a; echo err-a >&2; exit 3")
+        self._script('10-b', "printf out-b")
+        ledger = os.path.join(self.tmp, 'ledger.jsonl')
+        (out, err) = self._run_captured(ledger=ledger, max_workers=2)
+        self.assertEqual(b"out-a\nout-b", out)
+        self.assertEqual(b"err-a\n", err)
+        logs = self.logs.getvalue()
+        for line in ('10-a: out-a', '10-a: err-a', '10-b: out-b'):
+            self.assertIn(line, logs)
+        records = [json.loads(line) for line in
+                   util.load_file(ledger).splitlines()]
+        self.assertEqual([os.path.join(self.tmp, 'parts', n)
+                          for n in ('10-a', '10-b')],
+                         [r['script'] for r in records])
+        self.assertEqual([3, 0], [r['exit_code'] for r in records])
+        self.assertEqual([6, 5], [r['stdout_bytes'] for r in records])
+        self.assertEqual([6, 0], [r['stderr_bytes'] for r in records])
+        for r in records:
+            self.assertEqual(round(r['end'] - r['start'], 3), r['duration'])
+
+    def test_concurrent_output_kept_together(self):
+        self._script('10-a', "echo a1; sleep 0.2; echo a2")
+        self._script('10-b', "echo b1; sleep 0.2; echo b2")
+        (out, _err) = self._run_captured(max_workers=2)
+        self.assertEqual(b"a1\na2\nb1\nb2\n", out)
+
+    def test_logged_and_held_output_capped(self):
+        self._script('10-a', "seq 1 100000")
+        self._script('10-b')
+        with mock.patch.object(util, 'RUNPARTS_LOG_MAX', 1000):
+            with mock.patch.object(util, 'RUNPARTS_HOLD_MAX', 1000):
+                (out, _err) = self._run_captured(max_workers=2)
+        self.assertEqual(
+            b"".join(b"%d\n" % i for i in range(1, 100001)), out)
+        logs = self.logs.getvalue()
+        self.assertIn("10-a: 1\n", logs)
+        self.assertNotIn("10-a: 1000\n", logs)
+        self.assertIn("not logging more than 1000 bytes", logs)
+
+    def test_background_process_does_not_hold_up_runparts(self):
+        # the background job keeps the script's stdout open
+        self._script('10-a', "(sleep 3; echo late) &")
+        self._script('10-b')
+        start = time.time()
+        with mock.patch.object(util, 'RUNPARTS_EOF_WAIT', 0.1):
+            self._run_captured(max_workers=2)
+        self.assertLess(time.time() - start, 2)
+
+    def test_script_events_reported(self):
+        from cloudinit.reporting import events
+        self._script('10-a', "exit 1")
+        self._script('10-b')
+        parent = events.ReportEventStack("parent", "parent", parent=None,
+                                         reporting_enabled=False)
+        self._run_captured(reporter=parent, max_workers=2)
+        self.assertEqual(events.status.FAIL,
+                         parent.children['script-10-a'][0])
+        self.assertEqual(events.status.SUCCESS,
+                         parent.children['script-10-b'][0])
+        self.assertIn("10-a exited 1 after",
+                      parent.children['script-10-a'][1])
+
+
+class TestConfSidecar(helpers.TestCase):
+
+    def setUp(self):
+        super(TestConfSidecar, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.fname = os.path.join(self.tmp, 'cloud-config.txt')
+
+    def _write(self, cfg):
+        content = util.yaml_dumps(cfg)
+        util.write_file(self.fname, content)
+        util.write_conf_sidecar(self.fname, content, cfg)
+
+    def test_sidecar_used_for_same_content(self):
+        cfg = {'a': [1, 'two', {'three': None}], 'b': True}
+        self._write(cfg)
+        self.assertEqual(os.path.join(self.tmp, 'cloud-config.json'),
+                         util.conf_sidecar_path(self.fname))
+        with mock.patch.object(util, 'load_yaml') as m_load:
+            self.assertEqual(cfg, util.read_conf_sidecar(self.fname))
+        self.assertEqual(0, m_load.call_count)
+
+    def test_changed_content_reparsed(self):
+        self._write({'a': 1})
+        util.write_file(self.fname, "a: 2\n")
+        self.assertEqual({'a': 2}, util.read_conf_sidecar(self.fname))
+
+    def test_not_json_safe_not_stored(self):
+        self._write({'a': 1})
+        self._write({'a': {1: 'int key'}})
+        self.assertFalse(
+            os.path.exists(util.conf_sidecar_path(self.fname)))
+        self.assertEqual({'a': {1: 'int key'}},
+                         util.read_conf_sidecar(self.fname))
+
+    def test_missing_file(self):
+        self.assertEqual({}, util.read_conf_sidecar(self.fname))
+
+
 class TestEncode(helpers.TestCase):
     """Test the encoding functions"""
     def test_decode_binary_plain_text_with_hex(self):